@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+A PyAlgoTrade bar feed backed by NumPy arrays, usually memory-mapped from the bar store (barstore.py).
+
+Unlike csvfeed.GenericBarFeed, no bar objects are built up front: each bar is created when the
+strategy asks for it, so startup time and memory do not grow with the length of the history.
+"""
+
+import datetime
+import numpy as np
+from pyalgotrade import bar
+from pyalgotrade import barfeed
+import barstore
+
+
+EPOCH=datetime.datetime(1970, 1, 1)
+
+
+class ArrayBarFeed(barfeed.BaseBarFeed):
+    #frequency: The bars frequency, see pyalgotrade.bar.Frequency
+    #maxLen: The maximum number of values the bar data series will hold, see barfeed.BaseBarFeed
+
+    def __init__(self, frequency, maxLen=None):
+        super(ArrayBarFeed, self).__init__(frequency, maxLen)
+        self.__arrays={}
+        self.__nextPos={}
+        self.__haveAdjClose=True
+        self.__started=False
+        self.__currDateTime=None
+
+    def addBarsFromArrays(self, instrument, dateTimes, open_, high, low, close, volume, adjClose=None):
+        #dateTimes: int64 epoch seconds, sorted ascending. The other arrays must have the same length.
+        if self.__started:
+            raise Exception("Can't add more bars once you started consuming bars")
+        if adjClose is None:
+            self.__haveAdjClose=False
+        self.__arrays[instrument]=(np.asarray(dateTimes), open_, high, low, close, volume, adjClose)
+        self.__nextPos[instrument]=0
+        self.registerInstrument(instrument)
+
+    def addBarsFromStore(self, instrument, store_directory, interval, start=None, end=None):
+        bars=barstore.load_bars(store_directory, interval, instrument, start=start, end=end)
+        self.addBarsFromArrays(instrument, bars['datetime'], bars['open'], bars['high'], bars['low'],
+                               bars['close'], bars['volume'], bars['adj_close'])
+
+    def reset(self):
+        for instrument in self.__nextPos:
+            self.__nextPos[instrument]=0
+        self.__currDateTime=None
+        super(ArrayBarFeed, self).reset()
+
+    def getCurrentDateTime(self):
+        return self.__currDateTime
+
+    def barsHaveAdjClose(self):
+        return self.__haveAdjClose
+
+    def start(self):
+        super(ArrayBarFeed, self).start()
+        self.__started=True
+
+    def stop(self):
+        pass
+
+    def join(self):
+        pass
+
+    def eof(self):
+        for instrument, arrays in self.__arrays.items():
+            if self.__nextPos[instrument] < len(arrays[0]):
+                return False
+        return True
+
+    def __peekEpoch(self):
+        ret=None
+        for instrument, arrays in self.__arrays.items():
+            pos=self.__nextPos[instrument]
+            if pos < len(arrays[0]):
+                value=int(arrays[0][pos])
+                if ret is None or value < ret:
+                    ret=value
+        return ret
+
+    def peekDateTime(self):
+        epoch=self.__peekEpoch()
+        if epoch is None:
+            return None
+        return EPOCH+datetime.timedelta(seconds=epoch)
+
+    def getNextBars(self):
+        epoch=self.__peekEpoch()
+        if epoch is None:
+            return None
+        dateTime=EPOCH+datetime.timedelta(seconds=epoch)
+        frequency=self.getFrequency()
+        ret={}
+        for instrument, (dateTimes, open_, high, low, close, volume, adjClose) in self.__arrays.items():
+            pos=self.__nextPos[instrument]
+            if pos < len(dateTimes) and dateTimes[pos]==epoch:
+                ret[instrument]=bar.BasicBar(dateTime, float(open_[pos]), float(high[pos]), float(low[pos]),
+                                             float(close[pos]), float(volume[pos]),
+                                             float(adjClose[pos]) if adjClose is not None else None, frequency)
+                self.__nextPos[instrument]=pos+1
+        if self.__currDateTime==dateTime:
+            raise Exception("Duplicate bars found for %s on %s" % (list(ret.keys()), dateTime))
+        self.__currDateTime=dateTime
+        return bar.Bars(ret)
@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+'''
+Runs the MovingAverageStrategy backtest for every ticker of a watch list, spreading the tickers
+over a process pool. Each worker sends back only the compact metrics record and error records
+of its ticker, the parent merges them into the results and errors DataFrames in watch list order.
+'''
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import sma_9_strategy_backtest as sma_9
+import pyalgotrade.barfeed.csvfeed as csvfeed
+import pyalgotrade.bar as bar
+from pyalgotrade.broker import backtesting
+import arrayfeed
+import plotrender
+import instrumentation
+import resultcache
+import streamanalyzer
+
+
+RESULT_COLUMNS=['Ticker', 'Initial Equity', 'Net P/L', 'Annualized Sharpe', 'Trades Made',
+                'Avg P/L', 'Max Profit', 'Max Loss', 'Annual Ret', 'Final Equity', 'Max Drawdown']
+ERROR_COLUMNS=['Ticker', 'Section', 'Error']
+
+#Default backtest settings, see multipleInstrumentTest.py
+DEFAULT_SETTINGS={
+    'data_directory':'',        #Directory holding one csv per ticker
+    'store_directory':None,     #Bar store directory, used instead of the csv files when set
+    'store_interval':'1d',
+    'frequency':bar.Frequency.DAY,
+    'fast_period':9,
+    'initial_budget':1600,
+    'budget_use':0.50,
+    'risk_percent':2,
+    'commission':0.1,           #Fixed commission per trade
+    'output_info':False,
+    'series_directory':None,    #Save the series needed for a plot here when set, see plotrender.py
+}
+
+
+'''
+Function Name: make_feed(ticker, settings)
+Purpose: Build the bar feed for one ticker, from the bar store if settings['store_directory'] is set,
+         otherwise from <data_directory><ticker>.csv
+Returns: a pyalgotrade bar feed
+'''
+def make_feed(ticker, settings):
+    if settings['store_directory']:
+        feed = arrayfeed.ArrayBarFeed(settings['frequency'])
+        feed.addBarsFromStore(ticker,settings['store_directory'],settings['store_interval'])
+    else:
+        feed = csvfeed.GenericBarFeed(settings['frequency'])
+        feed.addBarsFromCSV(ticker,settings['data_directory']+ticker+'.csv')
+    return feed
+
+
+'''
+Function Name: run_backtest(ticker, settings, timings)
+Purpose: Backtest MovingAverageStrategy on one ticker with the Returns, SharpeRatio and Trades analyzers attached.
+         This is the body of the original watch list loop, it runs in a worker process.
+Arguments: ticker: String, the ticker symbol
+           settings: dict, see DEFAULT_SETTINGS
+           timings: instrumentation.Timings to fill in, None to run without instrumentation
+Returns: dict results row (None if the metrics could not be computed), list of error row dicts
+'''
+def run_backtest(ticker, settings, timings=None):
+    settings=dict(DEFAULT_SETTINGS, **settings)
+    try:
+        if timings is None:
+            feed=make_feed(ticker, settings)
+        else:
+            with timings.phase('Feed'):
+                feed=make_feed(ticker, settings)
+            #Size of the ticker's data files, not the bytes read: the bar store is memory mapped
+            timings.count('File Bytes', sum(os.path.getsize(path) for path in resultcache.data_files(ticker, settings)))
+    except Exception:
+        return None, [{'Ticker':ticker,'Section':'Feed','Error':str(sys.exc_info()[0])}]
+    return run_strategy(feed, ticker, settings, timings)
+
+
+'''
+Function Name: run_backtest_timed(ticker, settings, options)
+Purpose: run_backtest() with instrumentation, the ticker runs under cProfile when it is in options['profile_tickers']
+Arguments: options: dict, from instrumentation.Report.getOptions()
+Returns: (result, errors) record, (timings row, onBars latency histogram or None)
+'''
+def run_backtest_timed(ticker, settings, options):
+    timings=instrumentation.Timings(ticker, options['histogram'])
+    if ticker in options['profile_tickers'] and options['profile_directory']:
+        record=instrumentation.profile_call(options['profile_directory'], ticker, run_backtest, ticker, settings, timings)
+    else:
+        record=run_backtest(ticker, settings, timings)
+    return record, (timings.getRow(), timings.getHistogram() if timings.histogram else None)
+
+
+'''
+Function Name: run_strategy(feed, ticker, settings, timings)
+Purpose: Backtest MovingAverageStrategy on a prepared bar feed and collect the results row
+Arguments: feed: a pyalgotrade bar feed holding the bars of the ticker
+           ticker: String, the ticker symbol
+           settings: dict, see DEFAULT_SETTINGS
+           timings: instrumentation.Timings to fill in, None to run without instrumentation
+Returns: dict results row (None if the metrics could not be computed), list of error row dicts.
+         The row also holds 'Metrics', the streamanalyzer.MetricAggregate of the run, and 'Trades', the float array
+         of the closed trades' P/L, which the result cache keeps and the results DataFrame and sink lines leave out.
+'''
+def run_strategy(feed, ticker, settings, timings=None):
+    settings=dict(DEFAULT_SETTINGS, **settings)
+    errors=[]
+    result=None
+    movingAverageStrategy=None
+    recorder=None
+    try:
+        movingAverageStrategy = sma_9.MovingAverageStrategy(feed,ticker,settings['fast_period'])
+        movingAverageStrategy.initBackTestStrategy(settings['initial_budget'])
+        movingAverageStrategy.setRiskPercent(settings['risk_percent'])
+        movingAverageStrategy.setBudgetUse(settings['budget_use'])
+        movingAverageStrategy.getBroker().setCommission(backtesting.FixedPerTrade(settings['commission']))
+        movingAverageStrategy.setInfoOutput(settings['output_info'])
+
+        if settings['series_directory']:
+            recorder=plotrender.SeriesRecorder(ticker, movingAverageStrategy.getFastMA())
+            movingAverageStrategy.attachAnalyzer(recorder)
+
+        analyzer = streamanalyzer.StreamingAnalyzer(keepTrades=True)
+        movingAverageStrategy.attachAnalyzer(analyzer)
+
+        if timings is None:
+            movingAverageStrategy.run()
+        else:
+            timings.wrapStrategy(movingAverageStrategy, [analyzer, recorder] if recorder is not None else [analyzer])
+            with timings.phase('Run'):
+                movingAverageStrategy.run()
+    except Exception:
+        errors.append({'Ticker':ticker,'Section':'Trades','Error':str(sys.exc_info()[0])})
+
+    started=time.perf_counter()
+    try:
+        result=metrics_row(ticker, settings, analyzer)
+    except Exception:
+        errors.append({'Ticker':ticker,'Section':'Results','Error':str(sys.exc_info()[0])})
+
+    if recorder is not None:
+        if timings is not None:
+            timings.add('Results', time.perf_counter()-started)
+            started=time.perf_counter()
+        try:
+            plotrender.save_series(settings['series_directory'], ticker, recorder.getSeries())
+        except Exception:
+            errors.append({'Ticker':ticker,'Section':'Plot','Error':str(sys.exc_info()[0])})
+        if timings is not None:
+            timings.add('Series', time.perf_counter()-started)
+    elif timings is not None:
+        timings.add('Results', time.perf_counter()-started)
+    return result, errors
+
+
+'''
+Function Name: metrics_row(ticker, settings, analyzer)
+Purpose: Build the results row of a run from its streamanalyzer.StreamingAnalyzer
+Returns: dict results row, with 'Metrics', the MetricAggregate of the run, and 'Trades' when the analyzer kept them
+'''
+def metrics_row(ticker, settings, analyzer):
+    trades=analyzer.trades
+    row={'Ticker':ticker, 'Initial Equity':settings['initial_budget'], 'Net P/L':trades.total,
+         'Annualized Sharpe':analyzer.getSharpeRatio(0.0), 'Trades Made':trades.count,
+         'Avg P/L':trades.getMean(), 'Max Profit':trades.max, 'Max Loss':trades.min,
+         'Annual Ret':analyzer.getCumulativeReturn()*100, 'Final Equity':analyzer.broker.getEquity(),
+         'Max Drawdown':analyzer.getMaxDrawDown()*100, 'Metrics':analyzer.getAggregate()}
+    if analyzer.tradePnL is not None:
+        row['Trades']=np.array(analyzer.tradePnL)
+    return row
+
+
+'''
+Function Name: make_portfolio_feed(tickers, settings)
+Purpose: Load every ticker into one time aligned bar feed, from the bar store or the csv files like make_feed()
+Returns: a pyalgotrade bar feed, list of the tickers loaded, list of error row dicts for the tickers that failed
+'''
+def make_portfolio_feed(tickers, settings):
+    if settings['store_directory']:
+        feed = arrayfeed.ArrayBarFeed(settings['frequency'])
+    else:
+        feed = csvfeed.GenericBarFeed(settings['frequency'])
+    loaded=[]
+    errors=[]
+    for ticker in tickers:
+        try:
+            if settings['store_directory']:
+                feed.addBarsFromStore(ticker,settings['store_directory'],settings['store_interval'])
+            else:
+                feed.addBarsFromCSV(ticker,settings['data_directory']+ticker+'.csv')
+            loaded.append(ticker)
+        except Exception:
+            errors.append({'Ticker':ticker,'Section':'Feed','Error':str(sys.exc_info()[0])})
+    return feed, loaded, errors
+
+
+'''
+Function Name: run_portfolio(tickers, settings)
+Purpose: Backtest the watch list as one portfolio with sma_9.PortfolioMovingAverageStrategy: one feed, one event loop
+         and one broker, initial_budget is the cash of the whole portfolio
+Arguments: tickers: list of ticker symbol strings
+           settings: dict, see DEFAULT_SETTINGS
+Returns: dict results row of the portfolio (Ticker is 'PORTFOLIO', None if the metrics could not be computed),
+         pandas DataFrame of the closed trades and net P/L per ticker, pandas DataFrame errors
+'''
+def run_portfolio(tickers, settings):
+    settings=dict(DEFAULT_SETTINGS, **settings)
+    tickers=list(dict.fromkeys(tickers))
+    feed, loaded, errors=make_portfolio_feed(tickers, settings)
+    result=None
+    portfolioStrategy=None
+    try:
+        portfolioStrategy = sma_9.PortfolioMovingAverageStrategy(feed,loaded,settings['fast_period'],settings['initial_budget'])
+        portfolioStrategy.setRiskPercent(settings['risk_percent'])
+        portfolioStrategy.setBudgetUse(settings['budget_use'])
+        portfolioStrategy.getBroker().setCommission(backtesting.FixedPerTrade(settings['commission']))
+        portfolioStrategy.setInfoOutput(settings['output_info'])
+
+        analyzer = streamanalyzer.StreamingAnalyzer()
+        portfolioStrategy.attachAnalyzer(analyzer)
+
+        portfolioStrategy.run()
+    except Exception:
+        errors.append({'Ticker':'PORTFOLIO','Section':'Trades','Error':str(sys.exc_info()[0])})
+
+    try:
+        result=metrics_row('PORTFOLIO', settings, analyzer)
+    except Exception:
+        errors.append({'Ticker':'PORTFOLIO','Section':'Results','Error':str(sys.exc_info()[0])})
+
+    stats=portfolioStrategy.getTradeStats() if portfolioStrategy is not None else {}
+    instruments=pd.DataFrame([(ticker,)+stats[ticker] for ticker in loaded if ticker in stats],
+                             columns=['Ticker','Trades Made','Net P/L'])
+    return result, instruments, pd.DataFrame(errors, columns=ERROR_COLUMNS)
+
+
+'''
+Function Name: merge_records(records)
+Purpose: Build the results and errors DataFrames from (result, errors) records, in the order the records are given
+Returns: pandas DataFrame results, pandas DataFrame errors
+'''
+def merge_records(records):
+    results=pd.DataFrame([result for result, _ in records if result is not None], columns=RESULT_COLUMNS)
+    errors=pd.DataFrame([error for _, errors in records for error in errors], columns=ERROR_COLUMNS)
+    return results, errors
+
+
+'''
+Function Name: run_watchlist(tickers, settings, workers, cache, sink)
+Purpose: Backtest every ticker of a watch list, in parallel over a process pool
+Arguments: tickers: list of ticker symbol strings
+           settings: dict, see DEFAULT_SETTINGS
+           workers: int, the number of worker processes, None for one per core, 1 runs in this process
+           cache: resultcache.ResultCache, tickers whose data and settings are unchanged since a cached run
+                  are read from it instead of backtested. None disables caching.
+           sink: resultsink.ResultSink, every ticker's record is appended to it as soon as it is known and
+                 tickers it already holds are not run again unless their data files changed since.
+                 None keeps the records in memory only.
+           report: instrumentation.Report, receives the timings and counters of every ticker backtested.
+                   None runs without instrumentation.
+Returns: pandas DataFrame results, pandas DataFrame errors, both in watch list order
+'''
+def run_watchlist(tickers, settings, workers=None, cache=None, sink=None, report=None):
+    tickers=list(dict.fromkeys(tickers))
+    full_settings=dict(DEFAULT_SETTINGS, **settings)
+    if settings.get('series_directory') and not os.path.exists(settings['series_directory']):
+        os.makedirs(settings['series_directory'])
+    fingerprints={}
+    if sink is not None:
+        fingerprints={ticker:resultcache.data_fingerprint(ticker, full_settings) for ticker in tickers}
+    records=sink.records(fingerprints) if sink is not None else {}
+    keys={}
+    if cache is not None:
+        for ticker in tickers:
+            if ticker in records:
+                continue
+            keys[ticker]=cache.key(ticker, full_settings)
+            #Missing plot series mean the ticker has to run again to record them
+            if settings.get('series_directory') and not os.path.exists(plotrender.series_path(settings['series_directory'], ticker)):
+                continue
+            record=cache.get(keys[ticker])
+            if record is not None:
+                records[ticker]=record
+                if sink is not None:
+                    sink.write(ticker, record, fingerprints[ticker])
+    pending=[ticker for ticker in tickers if ticker not in records]
+    if report is None:
+        function, arguments=run_backtest, [[settings]*len(pending)]
+    else:
+        function, arguments=run_backtest_timed, [[settings]*len(pending), [report.getOptions()]*len(pending)]
+    if workers==1:
+        computed=map(function, pending, *arguments)
+        pool=None
+    else:
+        pool=ProcessPoolExecutor(max_workers=workers)
+        #map yields the records in the order of the tickers, whatever order the workers finish in
+        computed=pool.map(function, pending, *arguments, chunksize=4)
+    try:
+        for ticker, record in zip(pending, computed):
+            if report is not None:
+                record, timings=record
+                report.add(timings)
+            records[ticker]=record
+            if sink is not None:
+                sink.write(ticker, record, fingerprints[ticker])
+            if cache is not None:
+                cache.put(keys[ticker], record)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if cache is not None and pending:
+        cache.evict()
+    return merge_records([records[ticker] for ticker in tickers])
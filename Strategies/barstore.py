@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+Columnar binary bar store.
+
+Bars are kept next to (or instead of) the per ticker csv files as one typed NumPy array per column:
+
+    store_directory/<interval>/<TICKER>/datetime.npy   int64 epoch seconds
+    store_directory/<interval>/<TICKER>/open.npy       float64
+    ...                                 high, low, close, volume, adj_close
+
+Arrays are opened memory-mapped, so loading a ticker costs a few page faults instead of parsing
+text, and a date range or a subset of columns is a zero-copy slice of the mapped file.
+
+A ticker is written whole: its columns go to a hidden staging directory next to it, which then
+replaces the ticker directory, so a crash never leaves columns of different lengths behind.
+load_bars() still checks the lengths, for stores written before.
+"""
+
+import os
+import shutil
+import tempfile
+import numpy as np
+import pandas as pd
+
+
+#Store column name -> ticker csv column name
+COLUMNS={'datetime':'Date Time', 'open':'Open', 'high':'High', 'low':'Low', 'close':'Close',
+         'volume':'Volume', 'adj_close':'Adj Close'}
+
+#Bar spacing in seconds of the Yahoo intervals
+INTERVAL_SECONDS={'1m':60, '2m':120, '5m':300, '15m':900, '30m':1800, '60m':3600, '90m':5400, '1h':3600,
+                  '1d':86400, '5d':5*86400, '1wk':7*86400, '1mo':31*86400, '3mo':92*86400}
+
+
+'''
+Function Name: ticker_directory(store_directory, interval, ticker)
+Purpose: Return the directory holding the column files of a ticker for a given interval
+Returns: String
+'''
+def ticker_directory(store_directory, interval, ticker):
+    return os.path.join(store_directory, interval, ticker)
+
+
+'''
+Function Name: write_bars(store_directory, interval, ticker, df)
+Purpose: Write the bars of one ticker to the store, replacing what was stored before, see write_arrays()
+Arguments: store_directory: String, the root directory of the store
+           interval: String, the bar interval, ex 1d or 1m. Each interval is a separate dataset.
+           ticker: String, the ticker symbol
+           df: pandas DataFrame in the ticker csv layout (Date Time, Open, High, Low, Close, Volume, Adj Close),
+               Date Time holding datetimes, sorted by Date Time
+Returns: int, the number of bars written
+'''
+def write_bars(store_directory, interval, ticker, df):
+    date_times=pd.to_datetime(df['Date Time'])
+    if date_times.dt.tz is not None:
+        date_times=date_times.dt.tz_localize(None)
+    arrays={'datetime':date_times.to_numpy(dtype='datetime64[s]').astype(np.int64)}
+    for column, csv_column in COLUMNS.items():
+        if column=='datetime':
+            continue
+        if csv_column in df.columns:
+            arrays[column]=df[csv_column].to_numpy(dtype=np.float64)
+        else:
+            arrays[column]=arrays['close'] if column=='adj_close' else np.full(len(df), np.nan)
+    #Downloaded bars replace bars resample.py derived for this interval
+    derived=os.path.join(ticker_directory(store_directory, interval, ticker), 'derived.json')
+    if os.path.exists(derived):
+        os.remove(derived)
+    return write_arrays(store_directory, interval, ticker, arrays)
+
+
+'''
+Function Name: write_arrays(store_directory, interval, ticker, arrays)
+Purpose: Write the bars of one ticker to the store from arrays, replacing what was stored before. All the columns
+         are written to a staging directory that is then renamed over the ticker directory, readers see either the
+         old bars or the new ones. A crash between the two renames leaves the ticker missing, not mixed.
+Arguments: arrays: dict column name (see COLUMNS) -> numpy array of the same length, datetime as int64 epoch seconds
+Returns: int, the number of bars written
+'''
+def write_arrays(store_directory, interval, ticker, arrays):
+    count=len(arrays['datetime'])
+    if any(len(values)!=count for values in arrays.values()):
+        raise ValueError("Columns of different lengths for {}".format(ticker))
+    directory=ticker_directory(store_directory, interval, ticker)
+    parent=os.path.dirname(directory)
+    os.makedirs(parent, exist_ok=True)
+    staging=tempfile.mkdtemp(prefix='.'+ticker+'.', dir=parent)
+    try:
+        for column, values in arrays.items():
+            with open(os.path.join(staging, column+'.npy'), 'wb') as f:
+                np.save(f, np.ascontiguousarray(values))
+        if os.path.exists(directory):
+            #Files that are not columns (derived.json of resample.py) stay with the ticker
+            for name in os.listdir(directory):
+                if not name.endswith('.npy'):
+                    shutil.copy2(os.path.join(directory, name), os.path.join(staging, name))
+            old=tempfile.mkdtemp(prefix='.'+ticker+'.', dir=parent)
+            os.rename(directory, os.path.join(old, ticker))
+            os.rename(staging, directory)
+            shutil.rmtree(old, ignore_errors=True)
+        else:
+            os.rename(staging, directory)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return count
+
+
+'''
+Function Name: load_bars(store_directory, interval, ticker, start, end, columns, mmap)
+Purpose: Load the bars of one ticker from the store. With mmap=True the returned arrays are read only views of
+         the memory-mapped files, slicing by date range does not copy any data.
+Arguments: store_directory: String, the root directory of the store
+           interval: String, the bar interval
+           ticker: String, the ticker symbol
+           start: datetime-like or None, first timestamp to include
+           end: datetime-like or None, timestamps at or after end are excluded
+           columns: list of column names (see COLUMNS), None for all columns. datetime is always loaded.
+           mmap: Bool, memory-map the files instead of reading them into memory
+Returns: dict column name -> numpy array
+'''
+def load_bars(store_directory, interval, ticker, start=None, end=None, columns=None, mmap=True):
+    directory=ticker_directory(store_directory, interval, ticker)
+    if not os.path.exists(os.path.join(directory, 'datetime.npy')):
+        raise IOError("No {} bars stored for {} in {}".format(interval, ticker, store_directory))
+    mmap_mode='r' if mmap else None
+    date_times=np.load(os.path.join(directory, 'datetime.npy'), mmap_mode=mmap_mode)
+    first=0
+    last=len(date_times)
+    if start is not None:
+        first=int(np.searchsorted(date_times, _epoch(start), side='left'))
+    if end is not None:
+        last=int(np.searchsorted(date_times, _epoch(end), side='left'))
+    bars={'datetime':date_times[first:last]}
+    for column in (columns or COLUMNS.keys()):
+        if column=='datetime':
+            continue
+        values=np.load(os.path.join(directory, column+'.npy'), mmap_mode=mmap_mode)
+        if len(values)!=len(date_times):
+            raise IOError("The {} column of {} {} has {} bars, datetime has {}".format(column, ticker, interval,
+                                                                                 len(values), len(date_times)))
+        bars[column]=values[first:last]
+    return bars
+
+
+'''
+Function Name: load_frame(store_directory, interval, ticker, start, end, columns)
+Purpose: Same as load_bars() but returns a pandas DataFrame in the ticker csv layout, for code that works on frames
+Returns: pandas DataFrame
+'''
+def load_frame(store_directory, interval, ticker, start=None, end=None, columns=None):
+    bars=load_bars(store_directory, interval, ticker, start, end, columns)
+    df=pd.DataFrame({COLUMNS[column]:values for column, values in bars.items() if column!='datetime'})
+    df.insert(0, 'Date Time', pd.to_datetime(bars['datetime'], unit='s'))
+    return df
+
+
+'''
+Function Name: list_tickers(store_directory, interval)
+Purpose: Return the tickers stored for an interval
+Returns: sorted list of ticker symbol strings
+'''
+def list_tickers(store_directory, interval):
+    directory=os.path.join(store_directory, interval)
+    if not os.path.exists(directory):
+        return []
+    #Names starting with a dot are staging directories of write_arrays()
+    return sorted(name for name in os.listdir(directory)
+                  if not name.startswith('.') and os.path.exists(os.path.join(directory, name, 'datetime.npy')))
+
+
+def _epoch(value):
+    value=pd.Timestamp(value)
+    if value.tz is not None:
+        value=value.tz_localize(None)
+    return int(value.value//10**9)
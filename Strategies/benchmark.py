@@ -0,0 +1,546 @@
+# -*- coding: utf-8 -*-
+'''
+Benchmarks for the data pipeline, run on synthetic data so the numbers can be
+reproduced on any machine. Run: python benchmark.py [--quick] [--only NAME ...]
+
+Every run is appended to RESULTS_FILE with the machine and commit it ran on, and each
+benchmark is compared with the previous run of the same size on the same machine. Each suite
+runs REPEAT times and keeps its best time, and a slowdown is only flagged past both
+REGRESSION_THRESHOLD and REGRESSION_FLOOR, so timer noise on the short benchmarks is not.
+'''
+
+import os
+import io
+import sys
+import json
+import asyncio
+import time
+import socket
+import platform
+import argparse
+import subprocess
+import tempfile
+import tracemalloc
+import contextlib
+import dataprovider
+import numpy as np
+import synthdata
+import barstore
+import arrayfeed
+import tickerdatautil as td
+import sma_9_strategy_backtest as sma_9
+import backtestrunner
+import vectorbacktest
+import papertrade
+import screener
+import httpcache
+import threading
+import http.server
+import pandas as pd
+import pyalgotrade.barfeed.csvfeed as csvfeed
+import pyalgotrade.bar as bar
+
+
+#Benchmark settings
+TICKERS=20              #Number of synthetic tickers
+BARS=390*252*2          #Bars per ticker, two years of minute bars
+FREQ='min'
+INTERVAL='1m'
+FEED_BARS=390*252*3     #Bars in the single ticker feed benchmark, three years of minute bars
+VOLATILITY=0.001        #Per bar volatility of the synthetic minute bars
+DAILY_TICKERS=100       #Tickers of the daily csv, watch list and download benchmarks
+DAILY_BARS=1260         #Five years of daily bars
+LATENCY=0.05            #Round trip time of the fake provider in seconds
+RESULTS_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Results', 'benchmarks.jsonl')
+PAPER_TICKERS=500       #Tickers of the paper trading benchmark, minute bars replayed through the replay server
+PAPER_BARS=60
+PAPER_SPEED=600         #Replay speed, a minute bar of every ticker each 0.1 s
+SCREEN_TICKERS=500      #Tickers of the screener benchmark, daily bars in the bar store
+HTTP_REQUESTS=200       #Requests of the HTTP cache benchmark, to a local stub server
+REGRESSION_THRESHOLD=0.2    #Flag benchmarks more than 20% slower than the previous run
+REGRESSION_FLOOR=0.01       #and more than that many seconds slower, so the noise of sub-second timings is not flagged
+REPEAT=3                    #Each suite runs that many times and its best time is kept
+
+#Sizes used with --quick, a smoke run of the whole suite in a few seconds
+QUICK={'TICKERS':4, 'BARS':390*20, 'FEED_BARS':390*20, 'DAILY_TICKERS':10, 'DAILY_BARS':504,
+       'PAPER_TICKERS':50, 'PAPER_BARS':20, 'SCREEN_TICKERS':50, 'HTTP_REQUESTS':20}
+
+
+'''
+Function Name: time_call(function, repeat)
+Purpose: Run a function several times and return the best wall time in seconds and the last result
+'''
+def time_call(function, repeat=3):
+    best=None
+    for _ in range(repeat):
+        started=time.perf_counter()
+        result=function()
+        elapsed=time.perf_counter()-started
+        best=elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+'''
+Function Name: directory_size(directory)
+Purpose: Return the total size in bytes of the files below a directory
+'''
+def directory_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+'''
+Function Name: benchmark_store(work_directory, tickers, bars, freq, interval)
+Purpose: Compare loading a synthetic universe from the ticker csv files against loading it from the columnar
+         bar store: full load, a one month date range and a close-only column subset.
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_store(work_directory, tickers=TICKERS, bars=BARS, freq=FREQ, interval=INTERVAL):
+    data_directory=work_directory+'/'
+    store_directory=os.path.join(work_directory, 'store')
+    symbols=synthdata.write_csv_universe(data_directory, 'csv', tickers, bars=bars, freq=freq, session=True)
+    td.convert_csv_directory_to_store(data_directory, 'csv', store_directory, interval)
+    csv_files=[os.path.join(data_directory, 'csv', ticker+'.csv') for ticker in symbols]
+    last=barstore.load_bars(store_directory, interval, symbols[0], columns=[])['datetime'][-1]
+    month_start=np.datetime64(int(last), 's')-np.timedelta64(30, 'D')
+
+    def csv_load():
+        return sum(float(td.read_ticker_csv(path)['Close'].sum()) for path in csv_files)
+
+    def store_load():
+        return sum(float(barstore.load_bars(store_directory, interval, ticker)['close'].sum()) for ticker in symbols)
+
+    def store_range():
+        return sum(float(barstore.load_bars(store_directory, interval, ticker, start=month_start)['close'].sum())
+                   for ticker in symbols)
+
+    def store_close():
+        return sum(float(barstore.load_bars(store_directory, interval, ticker, columns=['close'])['close'].sum())
+                   for ticker in symbols)
+
+    results=[]
+    for name, function in [('csv full load', csv_load), ('store full load', store_load),
+                           ('store last month', store_range), ('store close only', store_close)]:
+        seconds, _=time_call(function)
+        results.append((name, seconds))
+    print("csv bytes: {}  store bytes: {}".format(directory_size(os.path.join(work_directory, 'csv')),
+                                                   directory_size(store_directory)))
+    return results
+
+
+'''
+Function Name: peak_memory(function)
+Purpose: Run a function once and return the peak Python heap allocation in bytes while it ran
+'''
+def peak_memory(function):
+    tracemalloc.start()
+    function()
+    _, peak=tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+'''
+Function Name: run_sma_strategy(feed, ticker)
+Purpose: Run MovingAverageStrategy with the settings used by multipleInstrumentTest.py on a prepared feed
+Returns: the final portfolio equity
+'''
+def run_sma_strategy(feed, ticker):
+    strat=sma_9.MovingAverageStrategy(feed, ticker, 9)
+    strat.initBackTestStrategy(1600)
+    strat.setRiskPercent(2)
+    strat.setBudgetUse(0.5)
+    strat.run()
+    return strat.getBroker().getEquity()
+
+
+'''
+Function Name: benchmark_feed(work_directory, bars, freq, interval)
+Purpose: Compare csvfeed.GenericBarFeed against arrayfeed.ArrayBarFeed on a synthetic minute bar file:
+         startup (building the feed, with its peak memory) and a full MovingAverageStrategy run.
+Returns: list of (name, seconds, peak bytes or None) tuples
+'''
+def benchmark_feed(work_directory, bars=FEED_BARS, freq=FREQ, interval=INTERVAL):
+    ticker='SYN'
+    store_directory=os.path.join(work_directory, 'store')
+    df=td.format_history(synthdata.generate_bars(ticker, bars=bars, freq=freq, drift=0.0, volatility=VOLATILITY, session=True))
+    #GenericBarFeed expects "%Y-%m-%d %H:%M:%S" date times
+    csv_file=os.path.join(work_directory, ticker+'.csv')
+    df.to_csv(csv_file, date_format='%Y-%m-%d %H:%M:%S', index=False)
+    barstore.write_bars(store_directory, interval, ticker, df)
+
+    def csv_feed():
+        feed=csvfeed.GenericBarFeed(bar.Frequency.MINUTE)
+        feed.addBarsFromCSV(ticker, csv_file)
+        return feed
+
+    def array_feed():
+        feed=arrayfeed.ArrayBarFeed(bar.Frequency.MINUTE)
+        feed.addBarsFromStore(ticker, store_directory, interval)
+        return feed
+
+    results=[]
+    for name, make_feed in [('GenericBarFeed', csv_feed), ('ArrayBarFeed', array_feed)]:
+        seconds, _=time_call(make_feed, repeat=1)
+        results.append((name+' startup', seconds, peak_memory(make_feed)))
+        seconds, _=time_call(lambda: run_sma_strategy(make_feed(), ticker), repeat=1)
+        results.append((name+' run', seconds, None))
+    return results
+
+
+'''
+Function Name: benchmark_vector(work_directory, bars, runs)
+Purpose: Time the event driven MovingAverageStrategy against vectorbacktest on the same daily bars
+Returns: list of (name, seconds per run) tuples
+'''
+def benchmark_vector(work_directory, bars=1260*4, runs=20):
+    ticker='VEC'
+    barstore.write_bars(work_directory, '1d', ticker, td.format_history(synthdata.generate_bars(ticker, bars=bars)))
+    arrays=barstore.load_bars(work_directory, '1d', ticker)
+
+    def event():
+        feed=arrayfeed.ArrayBarFeed(bar.Frequency.DAY)
+        feed.addBarsFromStore(ticker, work_directory, '1d')
+        return backtestrunner.run_strategy(feed, ticker, {})
+
+    def vector():
+        for _ in range(runs):
+            vectorbacktest.run_sma_backtest(arrays['datetime'], arrays['open'], arrays['close'])
+
+    event_seconds, _=time_call(event, repeat=1)
+    vector_seconds, _=time_call(vector, repeat=1)
+    return [('event driven', event_seconds), ('vectorized', vector_seconds/runs)]
+
+
+'''
+Function Name: benchmark_csv(work_directory, tickers, bars)
+Purpose: Time the tickerdatautil csv paths on a synthetic daily universe: writing the csv files the way the
+         download functions do, reading them back with read_ticker_csv() and loading them in csvfeed.GenericBarFeed
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_csv(work_directory, tickers=DAILY_TICKERS, bars=DAILY_BARS):
+    symbols=['SYN{:04d}'.format(i) for i in range(tickers)]
+    frames={ticker:synthdata.generate_bars(ticker, bars=bars) for ticker in symbols}
+    directory=os.path.join(work_directory, 'csv')
+    os.makedirs(directory, exist_ok=True)
+
+    def csv_write():
+        for ticker, df in frames.items():
+            td.format_history(df).to_csv(os.path.join(directory, ticker+'.csv'), date_format='%s', index=False)
+
+    def csv_read():
+        return sum(len(td.read_ticker_csv(os.path.join(directory, ticker+'.csv'))) for ticker in symbols)
+
+    feed_directory=os.path.join(work_directory, 'feed')
+    synthdata.write_csv_universe(work_directory, 'feed', symbols, bars=bars, date_format='%Y-%m-%d %H:%M:%S')
+
+    def feed_load():
+        for ticker in symbols:
+            feed=csvfeed.GenericBarFeed(bar.Frequency.DAY)
+            feed.addBarsFromCSV(ticker, os.path.join(feed_directory, ticker+'.csv'))
+
+    return [(name, time_call(function)[0]) for name, function in
+            [('csv write', csv_write), ('csv read', csv_read), ('GenericBarFeed load', feed_load)]]
+
+
+'''
+Function Name: benchmark_strategy(work_directory, bars)
+Purpose: Time one MovingAverageStrategy backtest with the streamanalyzer.StreamingAnalyzer metrics, as
+         backtestrunner.run_backtest() runs it for a watch list ticker, from a csv file
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_strategy(work_directory, bars=DAILY_BARS):
+    synthdata.write_csv_universe(work_directory, 'strategy', ['SYN'], bars=bars, date_format='%Y-%m-%d %H:%M:%S')
+    settings={'data_directory':os.path.join(work_directory, 'strategy')+'/'}
+    seconds, _=time_call(lambda: backtestrunner.run_backtest('SYN', settings))
+    return [('strategy with analyzers', seconds)]
+
+
+'''
+Function Name: benchmark_watchlist(work_directory, tickers, bars)
+Purpose: Time a full watch list run with backtestrunner.run_watchlist(), in process and over the process pool
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_watchlist(work_directory, tickers=DAILY_TICKERS, bars=DAILY_BARS):
+    symbols=synthdata.write_csv_universe(work_directory, 'watchlist', tickers, bars=bars, date_format='%Y-%m-%d %H:%M:%S')
+    settings={'data_directory':os.path.join(work_directory, 'watchlist')+'/'}
+    return [('watch list 1 worker', time_call(lambda: backtestrunner.run_watchlist(symbols, settings, 1), repeat=1)[0]),
+            ('watch list pool', time_call(lambda: backtestrunner.run_watchlist(symbols, settings, None), repeat=1)[0])]
+
+
+'''
+Function Name: benchmark_download(work_directory, tickers, latency)
+Purpose: Time the download paths of tickerdatautil against dataprovider.FakeProvider with the given round trip
+         latency: sequential, concurrent and batched full downloads, then an incremental update five days later
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_download(work_directory, tickers=DAILY_TICKERS, latency=LATENCY):
+    symbols=['SYN{:04d}'.format(i) for i in range(tickers)]
+    pd.DataFrame({'Ticker':symbols}).to_csv(os.path.join(work_directory, 'download.csv'), index=False)
+    data_directory=work_directory+'/'
+    end=pd.Timestamp('2020-06-26')
+    runs=[('download sequential', {'workers':1}), ('download 8 workers', {'workers':8}),
+          ('download batched', {'workers':2, 'batch_size':50})]
+    results=[]
+    #The functions print a line per ticker
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, options in runs:
+            provider=dataprovider.FakeProvider(latency=latency, bars=DAILY_BARS, end=end)
+            seconds, _=time_call(lambda: td.get_data_from_yahoo(data_directory, 'download', 'download.csv', '5y', True, True,
+                                                                0.001, provider=provider, **options), repeat=1)
+            results.append((name, seconds))
+        provider=dataprovider.FakeProvider(latency=latency, bars=DAILY_BARS, end=end+pd.Timedelta(days=7))
+        seconds, _=time_call(lambda: td.update_ticker_prices_fromLast(data_directory, 'download', 'download.csv', 0.001,
+                                                                      workers=8, provider=provider), repeat=1)
+        results.append(('update 8 workers', seconds))
+    return results
+
+
+'''
+Function Name: benchmark_paper(work_directory, tickers, bars, speed)
+Purpose: Replay synthetic minute bars through papertrade.serve_replay() into a PaperTrader and report the latency
+         from bar arrival to order decision, the median and 99th percentile, in seconds
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_paper(work_directory, tickers=PAPER_TICKERS, bars=PAPER_BARS, speed=PAPER_SPEED):
+    data={}
+    for i in range(tickers):
+        df=synthdata.generate_bars('SYN{:04d}'.format(i), bars=bars, freq='min', session=True, volatility=VOLATILITY)
+        data['SYN{:04d}'.format(i)]={'datetime':df.index.values.astype('datetime64[s]').astype(np.int64),
+                                     'open':df['Open'].values, 'high':df['High'].values, 'low':df['Low'].values,
+                                     'close':df['Close'].values, 'volume':df['Volume'].values.astype(np.float64)}
+
+    async def replay():
+        server=await papertrade.serve_replay(papertrade.ReplaySource(data, 60, speed))
+        host, port=server.sockets[0].getsockname()[:2]
+        try:
+            return await papertrade.PaperTrader(papertrade.SocketSource(host, port), list(data), {}).run()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    stats=asyncio.run(replay())
+    return [('paper latency p50', stats['p50 ms']/1e3), ('paper latency p99', stats['p99 ms']/1e3)]
+
+
+'''
+Function Name: benchmark_cli(work_directory, tickers)
+Purpose: Time whole cli.py processes, interpreter start included, as a scheduler launches them: --help, and report
+         over a results file of tickers rows
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_cli(work_directory, tickers=DAILY_TICKERS):
+    import resultsink
+    path=os.path.join(work_directory, 'results.jsonl')
+    with resultsink.ResultSink(path, 'benchmark', sync=False) as sink:
+        for i in range(tickers):
+            result={column:float(i) for column in backtestrunner.RESULT_COLUMNS}
+            result['Ticker']='SYN{:04d}'.format(i)
+            sink.write(result['Ticker'], (result, []))
+    script=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+    def launch(*arguments):
+        return lambda: subprocess.run([sys.executable, script]+list(arguments), check=True, stdout=subprocess.DEVNULL)
+
+    return [('cli --help', time_call(launch('--help'), repeat=5)[0]),
+            ('cli report', time_call(launch('report', path), repeat=5)[0])]
+
+
+'''
+Function Name: benchmark_screen(work_directory, tickers, bars)
+Purpose: Time screener.run_screen() over a universe of daily bars, from the bar store and from the csv files
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_screen(work_directory, tickers=SCREEN_TICKERS, bars=DAILY_BARS):
+    data_directory=work_directory+'/'
+    store_directory=os.path.join(work_directory, 'store')
+    symbols=synthdata.write_csv_universe(data_directory, 'csv', tickers, bars=bars)
+    td.convert_csv_directory_to_store(data_directory, 'csv', store_directory, '1d')
+    store={'store_directory':store_directory, 'store_interval':'1d'}
+    files={'data_directory':os.path.join(data_directory, 'csv')+'/'}
+    with contextlib.redirect_stdout(io.StringIO()):
+        return [('screen store', time_call(lambda: screener.run_screen(symbols, store))[0]),
+                ('screen csv', time_call(lambda: screener.run_screen(symbols, files))[0])]
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    #Serves a 100 kB page per path with an ETag, answers 304 to a matching If-None-Match, counts what it sent
+    protocol_version='HTTP/1.1'
+    body=b'x'*100000
+    counts=None
+
+    def do_GET(self):
+        etag='"{}"'.format(hash(self.path) & 0xffff)
+        if self.headers.get('If-None-Match')==etag:
+            self.counts['304']+=1
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.counts['200']+=1
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+'''
+Function Name: benchmark_http(work_directory, requests)
+Purpose: Time httpcache.HTTPSession against a local stub server: requests pages once with a new connection each,
+         as requests.get() does, then through the keep-alive session, again from the cache, and again after the
+         ttl has expired, revalidated with If-None-Match. Prints the cache and server counts.
+Returns: list of (name, seconds) tuples
+'''
+def benchmark_http(work_directory, requests=HTTP_REQUESTS):
+    import requests as requests_module
+    counts={'200':0, '304':0}
+    handler=type('Handler', (StubHandler,), {'counts':counts})
+    server=http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    urls=['http://127.0.0.1:{}/page{}'.format(server.server_address[1], i) for i in range(requests)]
+    session=httpcache.HTTPSession(httpcache.ResponseCache(os.path.join(work_directory, 'http')), ttl=3600)
+    try:
+        fresh=time_call(lambda: [requests_module.get(url).content for url in urls], repeat=1)[0]
+        cold=time_call(lambda: [session.get(url).content for url in urls], repeat=1)[0]
+        cached=time_call(lambda: [session.get(url).content for url in urls], repeat=1)[0]
+        session.ttl=0
+        revalidated=time_call(lambda: [session.get(url).content for url in urls], repeat=1)[0]
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
+    print("cache: {}  server: {}".format(session.getStats(), counts))
+    return [('http new connections', fresh), ('http keep-alive', cold), ('http cached', cached),
+            ('http revalidated', revalidated)]
+
+
+'''
+Function Name: run_suite(names, quick)
+Purpose: Run the benchmarks, each in its own temporary directory
+Arguments: names: list of benchmark names from SUITE to run, None for all of them
+           quick: bool, use the QUICK sizes
+           repeat: int, the number of times each benchmark runs, the best time and the highest peak memory are kept
+Returns: pandas DataFrame with Suite, Benchmark, Seconds and Peak MB columns
+'''
+def run_suite(names=None, quick=False, repeat=REPEAT):
+    sizes={name:globals()[name] for name in QUICK}
+    if quick:
+        sizes.update(QUICK)
+    suite={
+        'csv':lambda w: benchmark_csv(w, sizes['DAILY_TICKERS'], sizes['DAILY_BARS']),
+        'strategy':lambda w: benchmark_strategy(w, sizes['DAILY_BARS']),
+        'watchlist':lambda w: benchmark_watchlist(w, sizes['DAILY_TICKERS'], sizes['DAILY_BARS']),
+        'download':lambda w: benchmark_download(w, sizes['DAILY_TICKERS']),
+        'store':lambda w: benchmark_store(w, sizes['TICKERS'], sizes['BARS']),
+        'feed':lambda w: benchmark_feed(w, sizes['FEED_BARS']),
+        'vector':lambda w: benchmark_vector(w, sizes['DAILY_BARS']*4),
+        'cli':lambda w: benchmark_cli(w, sizes['DAILY_TICKERS']),
+        'paper':lambda w: benchmark_paper(w, sizes['PAPER_TICKERS'], sizes['PAPER_BARS']),
+        'screen':lambda w: benchmark_screen(w, sizes['SCREEN_TICKERS'], sizes['DAILY_BARS']),
+        'http':lambda w: benchmark_http(w, sizes['HTTP_REQUESTS']),
+    }
+    rows=[]
+    for name in names or SUITE:
+        started=time.perf_counter()
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as work_directory:
+                for result in suite[name](work_directory):
+                    peak=result[2] if len(result) > 2 and result[2] is not None else float('nan')
+                    rows.append({'Suite':name, 'Benchmark':result[0], 'Seconds':result[1], 'Peak MB':peak/2**20})
+        print("{:<10} done in {:.1f} s".format(name, time.perf_counter()-started))
+    results=pd.DataFrame(rows, columns=['Suite', 'Benchmark', 'Seconds', 'Peak MB'])
+    return results.groupby(['Suite', 'Benchmark'], sort=False, as_index=False).agg({'Seconds':'min', 'Peak MB':'max'})
+
+
+#Benchmark names in the order they run
+SUITE=['csv', 'strategy', 'watchlist', 'download', 'store', 'feed', 'vector', 'cli', 'paper', 'screen', 'http']
+
+
+'''
+Function Name: run_info(quick)
+Purpose: Describe the run: time, machine, Python and library versions and the git commit of the code
+Returns: dict
+'''
+def run_info(quick=False):
+    try:
+        commit=subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit=''
+    return {'Time':time.strftime('%Y-%m-%d %H:%M:%S'), 'Host':socket.gethostname(), 'Platform':platform.platform(),
+            'Python':platform.python_version(), 'CPUs':os.cpu_count(), 'NumPy':np.__version__,
+            'pandas':pd.__version__, 'Commit':commit, 'Quick':quick}
+
+
+'''
+Function Name: save_results(results, info, results_file)
+Purpose: Append a run to the results file, one JSON line per run
+'''
+def save_results(results, info, results_file=RESULTS_FILE):
+    directory=os.path.dirname(results_file)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    line=dict(info, Results=json.loads(results.to_json(orient='records')))
+    with open(results_file, 'a') as f:
+        f.write(json.dumps(line)+'\n')
+
+
+'''
+Function Name: load_previous(info, results_file)
+Purpose: Find the last run saved from the same host with the same size (quick or full)
+Returns: pandas DataFrame of its results, None if there is none
+'''
+def load_previous(info, results_file=RESULTS_FILE):
+    if not os.path.exists(results_file):
+        return None
+    previous=None
+    with open(results_file) as f:
+        for line in f:
+            run=json.loads(line)
+            if run.get('Host')==info['Host'] and run.get('Quick')==info['Quick']:
+                previous=run
+    return pd.DataFrame(previous['Results']) if previous is not None else None
+
+
+'''
+Function Name: compare_results(results, previous, threshold)
+Purpose: Compare each benchmark with the previous run, both best of REPEAT runs. A benchmark slower by more than
+         threshold and by more than floor seconds is a regression.
+Returns: pandas DataFrame with the Previous, Ratio and Regression columns added
+'''
+def compare_results(results, previous, threshold=REGRESSION_THRESHOLD, floor=REGRESSION_FLOOR):
+    if previous is None:
+        return results.assign(Previous=float('nan'), Ratio=float('nan'), Regression=False)
+    previous=previous[['Suite', 'Benchmark', 'Seconds']].rename(columns={'Seconds':'Previous'})
+    compared=results.merge(previous, on=['Suite', 'Benchmark'], how='left')
+    compared['Ratio']=compared['Seconds']/compared['Previous']
+    compared['Regression']=(compared['Ratio'] > 1+threshold) & (compared['Seconds']-compared['Previous'] > floor)
+    return compared
+
+
+if __name__ == "__main__":
+    parser=argparse.ArgumentParser(description='Benchmark the data and backtest pipeline on synthetic data')
+    parser.add_argument('--quick', action='store_true', help='small sizes, a smoke run of the suite')
+    parser.add_argument('--only', nargs='+', choices=SUITE, help='benchmarks to run, all by default')
+    parser.add_argument('--no-save', action='store_true', help='do not append this run to the results file')
+    parser.add_argument('--results', default=RESULTS_FILE, help='results file, JSON lines')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='slowdown flagged as a regression')
+    parser.add_argument('--floor', type=float, default=REGRESSION_FLOOR, help='seconds a slowdown must also exceed')
+    parser.add_argument('--repeat', type=int, default=REPEAT, help='runs of each benchmark, the best time is kept')
+    args=parser.parse_args()
+
+    info=run_info(args.quick)
+    print("{Host} {Platform} Python {Python} {CPUs} CPUs, commit {Commit}".format(**info))
+    results=run_suite(args.only, args.quick, args.repeat)
+    compared=compare_results(results, load_previous(info, args.results), args.threshold, args.floor)
+    pd.set_option('display.width', 200)
+    print(compared.to_string(index=False, float_format=lambda value: '{:.4f}'.format(value)))
+    if not args.no_save:
+        save_results(results, info, args.results)
+    if compared['Regression'].any():
+        print("Regressions: "+', '.join(compared.loc[compared['Regression'], 'Benchmark']))
+        sys.exit(1)
@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+'''
+Command line entry point for the data and backtest tasks, so they can be run from a scheduler
+without editing the settings in the scripts:
+
+    python cli.py [--config FILE] [--set section.key=value ...] [--timing] COMMAND [options]
+
+    fetch     download the history of the tickers in the ticker list (get_data_from_yahoo)
+    update    append the bars missing since the last row of each ticker file (update_ticker_prices_fromLast)
+    compact   sort, dedupe and check the ticker files (compact_data_directory)
+    backtest  run the SMA strategy over the watch list (backtestrunner.run_watchlist)
+    report    print or save the ranked results of the last backtest from its .jsonl results file
+    screen    rank the tickers by their SMA signal on the last bar, without backtesting (screener.run_screen)
+
+Settings come from DEFAULTS, then the config file (strategies.ini next to this script unless
+--config is given), then --set and the command's flags. The config file is INI with the
+sections and keys of DEFAULTS, ex:
+
+    [data]
+    data_directory = E:/Datasets/Stocks/
+    ticker_sub_directory = MyWatchList
+    ticker_file = MyWatchList.csv
+
+    [backtest]
+    fast_period = 9
+    workers = 4
+
+Only the standard library is imported at startup, each command imports the modules it uses.
+report reads the results file with the json module alone. --timing prints the startup and
+command times.
+'''
+
+import time
+STARTED=time.perf_counter()
+
+import os
+import sys
+import csv
+import json
+import argparse
+import configparser
+
+
+#Settings by config section, the type of each default is the type the value is read as
+DEFAULTS={
+    'data':{
+        'data_directory':'',            #Parent directory of the ticker list and ticker sub directory
+        'ticker_sub_directory':'MyWatchList',
+        'ticker_file':'MyWatchList.csv',    #Ticker list, a csv with a Ticker column or a pickled list
+        'period':'1y',
+        'interval':'1d',
+        'delay':0.5,
+        'workers':8,
+        'retries':3,
+        'batch_size':0,                 #0 sends one request per ticker
+        'store_directory':'',           #Bar store directory, used by backtest instead of the csv files when set
+        'http_cache_directory':'',      #Response cache of the downloads, empty for httpcache.CACHE_DIRECTORY
+        'http_cache_ttl':6*3600.0,      #Seconds a download is served from the cache, 0 to always download
+        'http_cache_max_bytes':512*2**20,
+    },
+    'backtest':{
+        'fast_period':9,
+        'initial_budget':1600.0,
+        'budget_use':0.5,
+        'risk_percent':2.0,
+        'commission':0.1,
+        'workers':0,                    #0 for one worker process per core
+        'resume':True,
+        'cache_directory':'',           #Result cache directory, empty for no cache
+        'cache_max_bytes':256*2**20,
+    },
+    'results':{
+        'results_directory':'Results',
+        'results_filename':'WatchListsma9',
+        'rank_by':'Annual Ret',
+        'save_plots':False,
+        'plot_top':20,
+        'plot_dpi':200,
+    },
+}
+
+CONFIG_FILE=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'strategies.ini')
+
+#Yahoo intervals to pyalgotrade bar frequencies, by name so pyalgotrade is only imported by backtest
+FREQUENCIES={'1m':'MINUTE', '2m':'MINUTE', '5m':'MINUTE', '15m':'MINUTE', '30m':'MINUTE', '60m':'HOUR',
+             '90m':'MINUTE', '1h':'HOUR', '1d':'DAY', '5d':'DAY', '1wk':'WEEK', '1mo':'MONTH', '3mo':'MONTH'}
+
+
+def _convert(default, value):
+    if isinstance(default, bool):
+        if value.strip().lower() in ('1', 'yes', 'true', 'on'):
+            return True
+        if value.strip().lower() in ('0', 'no', 'false', 'off'):
+            return False
+        raise ValueError("Not a boolean: {}".format(value))
+    return type(default)(value)
+
+
+'''
+Function Name: load_config(path, overrides)
+Purpose: Read the settings: DEFAULTS, updated with the config file if it exists, then with the overrides
+Arguments: path: String, the INI config file, None for CONFIG_FILE
+           overrides: list of 'section.key=value' Strings
+Returns: dict section -> dict key -> value
+'''
+def load_config(path=None, overrides=()):
+    config={section:dict(values) for section, values in DEFAULTS.items()}
+    parser=configparser.ConfigParser()
+    if path is not None and not os.path.exists(path):
+        raise IOError("Config file {} not found".format(path))
+    parser.read(path or CONFIG_FILE)
+    values=[(section, key, value) for section in parser.sections() for key, value in parser.items(section)]
+    for override in overrides:
+        name, _, value=override.partition('=')
+        section, _, key=name.partition('.')
+        values.append((section.strip(), key.strip(), value.strip()))
+    for section, key, value in values:
+        if section not in DEFAULTS or key not in DEFAULTS[section]:
+            raise KeyError("Unknown setting {}.{}".format(section, key))
+        config[section][key]=_convert(DEFAULTS[section][key], value)
+    return config
+
+
+def _directory(path):
+    #The tickerdatautil functions join paths by concatenation, directories need their trailing separator
+    return os.path.join(path, '')
+
+
+def _workers(value):
+    return value if value > 0 else None
+
+
+def load_tickers(data):
+    path=_directory(data['data_directory'])+data['ticker_file']
+    if not os.path.exists(path):
+        raise IOError("Ticker list {} not found".format(path))
+    if path.endswith('.pickle'):
+        import pickle
+        with open(path, 'rb') as f:
+            return list(pickle.load(f))
+    with open(path, newline='') as f:
+        return [row['Ticker'] for row in csv.DictReader(f) if row.get('Ticker')]
+
+
+def _http_session(data):
+    import httpcache
+    return httpcache.get_session(data['http_cache_directory'] or httpcache.CACHE_DIRECTORY, data['http_cache_ttl'],
+                                 data['http_cache_max_bytes'])
+
+
+def _save_download_timings(config, summary):
+    #Requests, retries and failures per ticker, to <results_filename>downloadtimings.csv/.json
+    import instrumentation
+    results=config['results']
+    results_directory=_directory(results['results_directory'])
+    if not os.path.exists(results_directory):
+        os.makedirs(results_directory)
+    report=instrumentation.Report()
+    report.addDownloads(summary)
+    report.save(results_directory+results['results_filename']+'download')
+
+
+def command_fetch(config, args):
+    import tickerdatautil as td
+    import dataprovider
+    data=config['data']
+    directory=_directory(data['data_directory'])
+    session=_http_session(data)
+    if args.sp500:
+        td.save_sp_500_tickers(directory, session)
+        return 0
+    options={'workers':data['workers'], 'retries':data['retries'], 'batch_size':data['batch_size'] or None,
+             'provider':dataprovider.YahooProvider(session), 'tickers':load_tickers(data)}
+    if args.start:
+        summary=td.get_data_from_yahoo_specific(directory, data['ticker_sub_directory'], data['ticker_file'], args.start,
+                                                args.end, data['interval'], args.refresh, args.purge, data['delay'], **options)
+    else:
+        summary=td.get_data_from_yahoo(directory, data['ticker_sub_directory'], data['ticker_file'], data['period'],
+                                       args.refresh, args.purge, data['delay'], **options)
+    print("HTTP cache: {}".format(session.getStats()))
+    _save_download_timings(config, summary)
+    return 1 if (summary['Status']!='ok').any() else 0
+
+
+def command_update(config, args):
+    import tickerdatautil as td
+    import dataprovider
+    data=config['data']
+    session=_http_session(data)
+    summary=td.update_ticker_prices_fromLast(_directory(data['data_directory']), data['ticker_sub_directory'],
+                                             data['ticker_file'], data['delay'], workers=data['workers'],
+                                             provider=dataprovider.YahooProvider(session), retries=data['retries'],
+                                             batch_size=data['batch_size'] or None, interval=data['interval'],
+                                             tickers=load_tickers(data))
+    print("HTTP cache: {}".format(session.getStats()))
+    _save_download_timings(config, summary)
+    return 1 if (summary['Status']!='ok').any() else 0
+
+
+def command_compact(config, args):
+    import tickerdatautil as td
+    data=config['data']
+    td.compact_data_directory(_directory(data['data_directory']), data['ticker_sub_directory'], data['interval'],
+                              _workers(data['workers']), not args.keep_bad, args.min_rows)
+    return 0
+
+
+def command_backtest(config, args):
+    import tickerdatautil as td
+    import backtestrunner
+    import resultcache
+    import resultsink
+    import pyalgotrade.bar as bar
+    data, backtest, results=config['data'], config['backtest'], config['results']
+    directory=_directory(data['data_directory'])
+    tickers=args.tickers or load_tickers(data)
+    tickers, skipped=td.usable_tickers(directory, data['ticker_sub_directory'], tickers)
+    if skipped:
+        print("Skipping {} tickers with bad data: {}".format(len(skipped), ', '.join(skipped)))
+    results_directory=_directory(results['results_directory'])
+    series_directory=results_directory+'plots/series/' if results['save_plots'] else None
+    if series_directory and not os.path.exists(series_directory):
+        os.makedirs(series_directory)
+    settings={'data_directory':_directory(directory+data['ticker_sub_directory']),
+              'store_directory':data['store_directory'] or None, 'store_interval':data['interval'],
+              'frequency':getattr(bar.Frequency, FREQUENCIES.get(data['interval'], 'DAY')),
+              'fast_period':backtest['fast_period'], 'initial_budget':backtest['initial_budget'],
+              'budget_use':backtest['budget_use'], 'risk_percent':backtest['risk_percent'],
+              'commission':backtest['commission'], 'series_directory':series_directory}
+    cache=None
+    if backtest['cache_directory']:
+        cache=resultcache.ResultCache(backtest['cache_directory'], backtest['cache_max_bytes'])
+    sink_path=results_directory+results['results_filename']+'.jsonl'
+    if not backtest['resume'] and os.path.exists(sink_path):
+        os.remove(sink_path)
+    with resultsink.ResultSink(sink_path, resultsink.make_run_id(settings)) as sink:
+        backtestrunner.run_watchlist(tickers, settings, _workers(backtest['workers']), cache, sink)
+        ranked, errors=sink.report(results['rank_by'])
+    ranked=ranked[ranked['Ticker'].isin(tickers)]
+    errors=errors[errors['Ticker'].isin(tickers)]
+    ranked.to_csv(results_directory+results['results_filename']+'.csv', index=False)
+    errors.to_csv(results_directory+results['results_filename']+'errors.csv', index=False)
+    if series_directory:
+        import plotrender
+        with plotrender.PlotRenderer(series_directory, results_directory+'plots/', results['plot_dpi'],
+                                     _workers(backtest['workers'])) as renderer:
+            renderer.submit(plotrender.select_plot_tickers(ranked, results['plot_top'], results['rank_by']))
+    print(ranked.head(args.top).to_string(index=False))
+    return 0
+
+
+'''
+Function Name: read_results(path, run)
+Purpose: Read the results and error rows of one run from a resultsink.ResultSink file with the json module,
+         keeping the last line of each ticker like ResultSink.read()
+Arguments: path: String, the .jsonl results file
+           run: String, the run id, None for the run of the last line in the file
+Returns: list of result dicts, list of error dicts, String run id
+'''
+def read_results(path, run=None):
+    lines=[]
+    with open(path) as f:
+        for text in f:
+            try:
+                lines.append(json.loads(text))
+            except ValueError:
+                #A line cut short by a crash, the next backtest drops it
+                continue
+    if run is None and lines:
+        run=lines[-1]['Run']
+    latest={}
+    for line in lines:
+        if line['Run']==run:
+            latest.pop(line['Ticker'], None)
+            latest[line['Ticker']]=line
+    results=[line['Result'] for line in latest.values() if isinstance(line['Result'], dict)]
+    errors=[error for line in latest.values() for error in line['Errors']]
+    return results, errors, run
+
+
+def _rank_key(rank_by):
+    def key(row):
+        value=row.get(rank_by)
+        missing=value is None or value!=value
+        return (missing, 0 if missing else -value)
+    return key
+
+
+def command_report(config, args):
+    results=config['results']
+    path=args.path or _directory(results['results_directory'])+results['results_filename']+'.jsonl'
+    if not os.path.exists(path):
+        print("Results file {} not found".format(path))
+        return 1
+    rows, errors, run=read_results(path, args.run)
+    rank_by=args.rank_by or results['rank_by']
+    rows.sort(key=_rank_key(rank_by))
+    columns=list(rows[0]) if rows else ['Ticker']
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer=csv.DictWriter(f, fieldnames=columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    print("Run {}: {} tickers, {} errors, ranked by {}".format(run, len(rows), len(errors), rank_by))
+    shown=['Ticker', rank_by, 'Net P/L', 'Trades Made', 'Annualized Sharpe']
+    shown=[column for column in dict.fromkeys(shown) if column in columns]
+    table=[shown]+[[_format(row.get(column)) for column in shown] for row in rows[:args.top]]
+    widths=[max(len(line[i]) for line in table) for i in range(len(shown))]
+    for line in table:
+        print('  '.join(value.rjust(width) for value, width in zip(line, widths)))
+    return 0
+
+
+def command_screen(config, args):
+    import screener
+    data, backtest, results=config['data'], config['backtest'], config['results']
+    directory=_directory(data['data_directory'])
+    tickers=args.tickers or load_tickers(data)
+    settings={'data_directory':_directory(directory+data['ticker_sub_directory']),
+              'store_directory':data['store_directory'] or None, 'store_interval':data['interval'],
+              'fast_period':backtest['fast_period'], 'initial_budget':backtest['initial_budget'],
+              'budget_use':backtest['budget_use'], 'risk_percent':backtest['risk_percent']}
+    ranked, errors=screener.run_screen(tickers, settings, args.slope_period, args.bars, args.rank_by)
+    results_directory=_directory(results['results_directory'])
+    if not os.path.exists(results_directory):
+        os.makedirs(results_directory)
+    ranked.to_csv(results_directory+results['results_filename']+'screen.csv', index=False)
+    if len(errors):
+        errors.to_csv(results_directory+results['results_filename']+'screenerrors.csv', index=False)
+    print(ranked.head(args.top).to_string(index=False))
+    return 0
+
+
+def _format(value):
+    if isinstance(value, float):
+        return '{:.4f}'.format(value)
+    return str(value)
+
+
+def build_parser():
+    parser=argparse.ArgumentParser(description="Data and backtest tasks of the SMA strategy")
+    parser.add_argument('--config', help="INI config file, default {}".format(CONFIG_FILE))
+    parser.add_argument('--set', action='append', default=[], metavar='SECTION.KEY=VALUE', help="Override a setting")
+    parser.add_argument('--timing', action='store_true', help="Print the startup and command times")
+    commands=parser.add_subparsers(dest='command', required=True)
+
+    fetch=commands.add_parser('fetch', help="Download the history of the ticker list")
+    fetch.add_argument('--start', help="yyyy-mm-dd, download from start to end at data.interval instead of data.period")
+    fetch.add_argument('--end')
+    fetch.add_argument('--refresh', action='store_true', help="Redownload the tickers already downloaded")
+    fetch.add_argument('--purge', action='store_true', help="Delete every file of the ticker sub directory first")
+    fetch.add_argument('--sp500', action='store_true', help="Only save the current S&P 500 list to sp500tickers.csv")
+    fetch.set_defaults(handler=command_fetch)
+
+    update=commands.add_parser('update', help="Append the bars missing since the last update")
+    update.set_defaults(handler=command_update)
+
+    compact=commands.add_parser('compact', help="Sort, dedupe and check the ticker files")
+    compact.add_argument('--keep-bad', action='store_true', help="Keep the rows with bad prices")
+    compact.add_argument('--min-rows', type=int, default=30, help="Fewer rows mark a ticker not usable")
+    compact.set_defaults(handler=command_compact)
+
+    backtest=commands.add_parser('backtest', help="Backtest the watch list")
+    backtest.add_argument('tickers', nargs='*', help="Tickers to backtest instead of the ticker list")
+    backtest.add_argument('--top', type=int, default=20, help="Number of result rows printed")
+    backtest.set_defaults(handler=command_backtest)
+
+    report=commands.add_parser('report', help="Print the ranked results of the last backtest")
+    report.add_argument('path', nargs='?', help="Results .jsonl file, default from the results settings")
+    report.add_argument('--run', help="Run id, default the run of the last line")
+    report.add_argument('--rank-by', help="Results column to rank by, default results.rank_by")
+    report.add_argument('--top', type=int, default=20, help="Number of rows printed")
+    report.add_argument('--csv', help="Also save the ranked results to this csv file")
+    report.set_defaults(handler=command_report)
+
+    screen=commands.add_parser('screen', help="Rank the tickers by their SMA signal on the last bar")
+    screen.add_argument('tickers', nargs='*', help="Tickers to screen instead of the ticker list")
+    screen.add_argument('--slope-period', type=int, default=2, help="Number of SMA values the slope is fitted over")
+    screen.add_argument('--bars', type=int, help="Number of most recent bars loaded, default enough for the SMA")
+    screen.add_argument('--rank-by', default='SMA Distance %', help="Signal column to rank by, largest first")
+    screen.add_argument('--top', type=int, default=20, help="Number of rows printed")
+    screen.set_defaults(handler=command_screen)
+    return parser
+
+
+def main(argv=None):
+    args=build_parser().parse_args(argv)
+    config=load_config(args.config, args.set)
+    ready=time.perf_counter()
+    status=args.handler(config, args)
+    if args.timing:
+        print("Startup {:.1f} ms, {} {:.1f} ms".format((ready-STARTED)*1e3, args.command, (time.perf_counter()-ready)*1e3),
+              file=sys.stderr)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Price history providers used by tickerdatautil.
+
+A provider is any object with a history(ticker, period=None, start=None, end=None, interval='1d')
+method that returns a yfinance style DataFrame (DatetimeIndex plus Open, High, Low, Close, Volume,
+Dividends and Stock Splits columns). Providers that can fetch several symbols in one round trip
+also have a download(tickers, period=None, start=None, end=None, interval='1d') method returning
+one wide frame with (ticker, field) MultiIndex columns, like yf.download(group_by='ticker').
+
+YahooProvider is the real data source, its frames cached through httpcache, FakeProvider is a local stand-in with
+simulated latency used for benchmarking the download pool and rate limiter and for counting round trips.
+"""
+
+import threading
+import time
+import random
+import pandas as pd
+import synthdata
+import httpcache
+
+
+#Map of Yahoo intervals to pandas frequencies, used by the fake provider
+INTERVAL_FREQ={'1m':'min', '2m':'2min', '5m':'5min', '15m':'15min', '30m':'30min', '60m':'h', '90m':'90min',
+               '1h':'h', '1d':'B', '5d':'5B', '1wk':'W-FRI', '1mo':'BMS', '3mo':'3BMS'}
+
+#Map of Yahoo periods to lookback windows, used by the fake provider
+PERIOD_OFFSET={'1d':pd.DateOffset(days=1), '5d':pd.DateOffset(days=5), '1mo':pd.DateOffset(months=1),
+               '3mo':pd.DateOffset(months=3), '6mo':pd.DateOffset(months=6), '1y':pd.DateOffset(years=1),
+               '2y':pd.DateOffset(years=2), '5y':pd.DateOffset(years=5), '10y':pd.DateOffset(years=10)}
+
+
+class YahooProvider(object):
+    #Thin wrapper around yfinance so the download code does not depend on it directly
+    #session: httpcache.HTTPSession whose cache keeps the downloaded frames, None for the shared
+    #         httpcache.get_session(), False to always download. yfinance keeps its own pooled session, it does not
+    #         accept a caching one, so the frames are cached rather than the responses.
+    #The frames are keyed by ticker, interval and the request resolved to dates, a period counting back from today.
+    #A range that ended before today cannot change and is kept until evicted, one reaching today is kept for the
+    #session's ttl, so the same request made again that day (a refresh rerun included) is served from the cache.
+    #A session with a ttl of 0 always downloads.
+
+    def __init__(self, session=None):
+        self.session=httpcache.get_session() if session is None else session
+
+    def history(self, ticker, period=None, start=None, end=None, interval='1d'):
+        first, last=_resolve(period, start, end)
+        return self._cached(('history', ticker, interval, str(first), str(last)), last,
+                            lambda: self._history(ticker, period, start, end, interval))
+
+    def download(self, tickers, period=None, start=None, end=None, interval='1d'):
+        first, last=_resolve(period, start, end)
+        return self._cached(('download', ','.join(tickers), interval, str(first), str(last)), last,
+                            lambda: self._download(list(tickers), period, start, end, interval))
+
+    def _cached(self, key, end, fetch):
+        if not self.session or self.session.ttl <= 0:
+            return fetch()
+        #end is exclusive, a range ending after today is not complete yet
+        ttl=float('inf') if end <= pd.Timestamp.now().normalize() else None
+        df=self.session.getValue(key, ttl)
+        if df is not None:
+            return df
+        df=fetch()
+        #Empty answers are failures or missing symbols, they are asked again next time
+        if df is not None and len(df):
+            self.session.putValue(key, df)
+        return df
+
+    def _history(self, ticker, period, start, end, interval):
+        import yfinance as yf
+        tick=yf.Ticker(ticker)
+        if start is not None or end is not None:
+            return tick.history(start=start, end=end, interval=interval)
+        return tick.history(period=period, interval=interval)
+
+    def _download(self, tickers, period, start, end, interval):
+        import yfinance as yf
+        if start is not None or end is not None:
+            return yf.download(tickers, start=start, end=end, interval=interval, group_by='ticker',
+                               auto_adjust=True, actions=True, threads=False, progress=False)
+        return yf.download(tickers, period=period, interval=interval, group_by='ticker',
+                           auto_adjust=True, actions=True, threads=False, progress=False)
+
+
+def _resolve(period, start, end):
+    #The [start, end) dates of a request, for the cache keys: '2020-01-02' and datetime(2020, 1, 2) are the same
+    #request, a period is the range it covers today and a request without an end runs through today
+    today=pd.Timestamp.now().normalize()
+    if start is None and end is None:
+        if period in PERIOD_OFFSET:
+            start=today-PERIOD_OFFSET[period]
+        elif period=='ytd':
+            start=today.replace(month=1, day=1)
+        else:
+            start=period
+    elif start is not None:
+        start=pd.Timestamp(start)
+    end=today+pd.Timedelta(days=1) if end is None else pd.Timestamp(end)
+    #Compared with today to tell a complete range
+    if end.tzinfo is not None:
+        end=end.tz_localize(None)
+    return start, end
+
+
+class FakeProvider(object):
+    #Local stand-in for Yahoo, every call sleeps for the given latency and returns a synthetic series
+    #latency: float, simulated round trip time in seconds
+    #failure_rate: float, probability that a call raises, to exercise the retry logic
+    #bars: int, the number of bars of history that exist for every ticker
+    #end: the timestamp of the last available bar, defaults to today
+
+    def __init__(self, latency=0.05, failure_rate=0.0, bars=2520, end=None, seed=0):
+        self.latency=latency
+        self.failure_rate=failure_rate
+        self.bars=bars
+        self.end=pd.Timestamp(end) if end is not None else pd.Timestamp.now().normalize()
+        self.seed=seed
+        self.calls=0
+        self.lock=threading.Lock()
+        self.random=random.Random(seed)
+
+    def getCalls(self):
+        return self.calls
+
+    def history(self, ticker, period=None, start=None, end=None, interval='1d'):
+        self._roundTrip(ticker)
+        return self._series(ticker, period, start, end, interval)
+
+    def download(self, tickers, period=None, start=None, end=None, interval='1d'):
+        #One round trip for the whole batch, like yf.download
+        tickers=list(tickers)
+        self._roundTrip(','.join(tickers))
+        frames={ticker:self._series(ticker, period, start, end, interval) for ticker in tickers}
+        return pd.concat(frames, axis=1)
+
+    def _roundTrip(self, name):
+        with self.lock:
+            self.calls+=1
+            fail=self.random.random() < self.failure_rate
+        time.sleep(self.latency)
+        if fail:
+            raise IOError("Simulated provider failure for {}".format(name))
+
+    def _series(self, ticker, period, start, end, interval):
+        freq=INTERVAL_FREQ.get(interval, 'B')
+        first=pd.date_range(end=self.end, periods=self.bars, freq=freq)[0]
+        df=synthdata.generate_bars(ticker, bars=self.bars, freq=freq, start=first, seed=self.seed)
+        if start is not None:
+            df=df[df.index >= pd.Timestamp(start)]
+        if end is not None:
+            df=df[df.index < pd.Timestamp(end)]
+        if start is None and end is None and period in PERIOD_OFFSET:
+            df=df[df.index > self.end - PERIOD_OFFSET[period]]
+        return df
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+'''
+Shared keep-alive HTTP session with a persistent response cache, used by the download
+functions of tickerdatautil so the same request made twice in a day is served locally.
+
+HTTPSession.get() keeps one requests.Session, so its connections are pooled and reused across
+calls and download threads. A response younger than the ttl is returned from the cache without
+a request. An older one is revalidated with If-None-Match / If-Modified-Since when the server
+sent an ETag or Last-Modified header: a 304 answer costs a round trip but no body, and the
+cached response is used again for another ttl.
+
+getValue()/putValue() keep any picklable value under a key for the ttl, this is how
+dataprovider.YahooProvider caches the frames of yfinance, which does its own HTTP and does not
+accept a caching session.
+
+ResponseCache entries are pickle files in one directory like resultcache.ResultCache, the least
+recently used ones are removed when the directory grows past max_bytes. requests is imported
+when the first request is made.
+'''
+
+import os
+import glob
+import time
+import pickle
+import hashlib
+import threading
+
+
+#Default location of the cache, next to this script
+CACHE_DIRECTORY=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Cache', 'http')
+DEFAULT_TTL=6*3600          #Seconds a cached response is used without asking the server
+MAX_BYTES=512*2**20
+POOL_SIZE=16                #Connections kept alive per host, at least the number of download threads
+
+
+class ResponseCache(object):
+    #directory: where the cache entries are kept
+    #max_bytes: size bound of the directory, least recently used entries are evicted past it on put()
+
+    def __init__(self, directory=CACHE_DIRECTORY, max_bytes=MAX_BYTES):
+        self.directory=directory
+        self.max_bytes=max_bytes
+        self.lock=threading.Lock()
+        self.total=None
+        self.evicted=0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, *parts):
+        return hashlib.sha256('|'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        path=os.path.join(self.directory, key+'.pkl')
+        try:
+            with open(path, 'rb') as f:
+                record=pickle.load(f)
+            #Mark as recently used for eviction
+            os.utime(path, None)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        return record
+
+    def put(self, key, record):
+        path=os.path.join(self.directory, key+'.pkl')
+        #One temporary file per thread, the download threads may store the same key at once
+        temporary='{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary, 'wb') as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        size=os.path.getsize(temporary)
+        try:
+            replaced=os.path.getsize(path)
+        except OSError:
+            replaced=0
+        os.replace(temporary, path)
+        with self.lock:
+            if self.total is None:
+                self.total=self.size()
+            else:
+                self.total+=size-replaced
+            if self.total > self.max_bytes:
+                self.evict()
+
+    def size(self):
+        return sum(os.path.getsize(path) for path in glob.glob(os.path.join(self.directory, '*.pkl')))
+
+    def evict(self):
+        #Remove the least recently used entries until the directory fits in max_bytes
+        entries=[]
+        for path in glob.glob(os.path.join(self.directory, '*.pkl')):
+            try:
+                info=os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        total=sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total-=size
+            self.evicted+=1
+        self.total=total
+
+
+class CachedResponse(object):
+    #The parts of a requests.Response the callers use, for live and cached responses alike
+
+    def __init__(self, url, status_code, headers, content, encoding, from_cache):
+        self.url=url
+        self.status_code=status_code
+        self.headers=headers
+        self.content=content
+        self.encoding=encoding or 'utf-8'
+        self.from_cache=from_cache
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors='replace')
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise IOError("HTTP {} for {}".format(self.status_code, self.url))
+
+
+class HTTPSession(object):
+    #cache: ResponseCache, None to only pool the connections
+    #ttl: float, seconds a cached response or value is used without asking the server again
+    #timeout: float, seconds before a request fails
+
+    def __init__(self, cache=None, ttl=DEFAULT_TTL, timeout=30, pool_size=POOL_SIZE):
+        self.cache=cache
+        self.ttl=ttl
+        self.timeout=timeout
+        self.pool_size=pool_size
+        self.session=None
+        self.lock=threading.Lock()
+        self.hits=0
+        self.misses=0
+        self.revalidated=0
+        self.requests=0
+
+    def _session(self):
+        with self.lock:
+            if self.session is None:
+                import requests
+                session=requests.Session()
+                adapter=requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                self.session=session
+            return self.session
+
+    def _count(self, name):
+        with self.lock:
+            setattr(self, name, getattr(self, name)+1)
+
+    def get(self, url, params=None, ttl=None):
+        ttl=self.ttl if ttl is None else ttl
+        key=None
+        record=None
+        if self.cache is not None:
+            key=self.cache.key('GET', url, sorted((params or {}).items()))
+            record=self.cache.get(key)
+            if record is not None and time.time()-record['stored'] < ttl:
+                self._count('hits')
+                return _response(record, True)
+        headers={}
+        if record is not None:
+            if record['headers'].get('ETag'):
+                headers['If-None-Match']=record['headers']['ETag']
+            if record['headers'].get('Last-Modified'):
+                headers['If-Modified-Since']=record['headers']['Last-Modified']
+        response=self._session().get(url, params=params, headers=headers, timeout=self.timeout)
+        self._count('requests')
+        if response.status_code==304 and record is not None:
+            self._count('revalidated')
+            record['stored']=time.time()
+            self.cache.put(key, record)
+            return _response(record, True)
+        self._count('misses')
+        record={'url':response.url, 'status':response.status_code, 'headers':dict(response.headers),
+                'content':response.content, 'encoding':response.encoding, 'stored':time.time()}
+        if key is not None and response.status_code==200:
+            self.cache.put(key, record)
+        return _response(record, False)
+
+    def getValue(self, key, ttl=None):
+        #The value stored under key if it is younger than the ttl, None otherwise
+        ttl=self.ttl if ttl is None else ttl
+        record=self.cache.get(self.cache.key('VALUE', key)) if self.cache is not None else None
+        if record is None or time.time()-record['stored'] >= ttl:
+            self._count('misses')
+            return None
+        self._count('hits')
+        return record['value']
+
+    def putValue(self, key, value):
+        if self.cache is not None:
+            self.cache.put(self.cache.key('VALUE', key), {'value':value, 'stored':time.time()})
+
+    def getStats(self):
+        stats={'hits':self.hits, 'misses':self.misses, 'revalidated':self.revalidated, 'requests':self.requests}
+        if self.cache is not None:
+            stats['evicted']=self.cache.evicted
+        return stats
+
+    def close(self):
+        with self.lock:
+            if self.session is not None:
+                self.session.close()
+                self.session=None
+
+
+def _response(record, from_cache):
+    return CachedResponse(record['url'], record['status'], record['headers'], record['content'], record['encoding'],
+                          from_cache)
+
+
+_sessions={}
+_sessions_lock=threading.Lock()
+
+
+'''
+Function Name: get_session(directory, ttl, max_bytes)
+Purpose: Return the HTTPSession shared by every caller with the same cache settings, created on the first call
+Arguments: directory: String, the cache directory, None for no response cache
+           ttl: float, see HTTPSession
+           max_bytes: int, see ResponseCache
+Returns: HTTPSession
+'''
+def get_session(directory=CACHE_DIRECTORY, ttl=DEFAULT_TTL, max_bytes=MAX_BYTES):
+    with _sessions_lock:
+        key=(directory and os.path.abspath(directory), ttl, max_bytes)
+        if key not in _sessions:
+            cache=ResponseCache(directory, max_bytes) if directory else None
+            _sessions[key]=HTTPSession(cache, ttl)
+        return _sessions[key]
@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental indicators for streaming bars.
+
+Every indicator keeps a fixed size ring buffer (or a few running values) and updates in constant
+time and memory per bar, so a process fed minute bars for months keeps a flat footprint. They
+work the same inside onBars and in a live/paper loop that receives bars one at a time:
+
+    sma = SMA(9)
+    for price in prices:
+        sma.update(price)
+        if sma.isReady(): ...sma.getValue()...
+
+Running sums are rebuilt from the buffer every RESUM_INTERVAL updates to keep rounding error bounded.
+'''
+
+import math
+
+
+RESUM_INTERVAL=10000
+
+
+class RingBuffer(object):
+    #Fixed size FIFO of the last size values, push() returns the value that fell out (None while filling)
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Ring buffer size must be at least 1")
+        self.size=size
+        self.values=[0.0]*size
+        self.count=0
+        self.head=0
+
+    def push(self, value):
+        evicted=self.values[self.head] if self.count==self.size else None
+        self.values[self.head]=value
+        self.head=(self.head+1) % self.size
+        self.count=min(self.count+1, self.size)
+        return evicted
+
+    def isFull(self):
+        return self.count==self.size
+
+    def oldest(self):
+        return self.values[self.head] if self.count==self.size else self.values[0]
+
+    def newest(self):
+        return self.values[(self.head-1) % self.size]
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        #Oldest to newest
+        start=self.head if self.count==self.size else 0
+        for i in range(self.count):
+            yield self.values[(start+i) % self.size]
+
+
+class SMA(object):
+    #Simple moving average over the last period values
+
+    def __init__(self, period):
+        self.period=period
+        self.buffer=RingBuffer(period)
+        self.total=0.0
+        self.updates=0
+
+    def update(self, value):
+        evicted=self.buffer.push(value)
+        self.total+=value-(evicted if evicted is not None else 0.0)
+        self.updates+=1
+        if self.updates % RESUM_INTERVAL==0:
+            self.total=sum(self.buffer)
+        return self.getValue()
+
+    def isReady(self):
+        return self.buffer.isFull()
+
+    def getValue(self):
+        return self.total/self.period if self.buffer.isFull() else None
+
+
+class EMA(object):
+    #Exponential moving average, seeded with the SMA of the first period values like pyalgotrade.technical.ma.EMA
+
+    def __init__(self, period):
+        self.period=period
+        self.multiplier=2.0/(period+1)
+        self.seed=SMA(period)
+        self.value=None
+
+    def update(self, value):
+        if self.value is None:
+            self.value=self.seed.update(value)
+        else:
+            self.value=(value-self.value)*self.multiplier+self.value
+        return self.value
+
+    def isReady(self):
+        return self.value is not None
+
+    def getValue(self):
+        return self.value
+
+
+class Slope(object):
+    #Least squares slope of the last period values against their position (0..period-1), per bar
+
+    def __init__(self, period):
+        if period < 2:
+            raise ValueError("Slope period must be at least 2")
+        self.period=period
+        self.buffer=RingBuffer(period)
+        self.sumY=0.0
+        self.sumXY=0.0
+        self.updates=0
+        n=float(period)
+        self.sumX=n*(n-1)/2
+        self.denominator=n*(n-1)*(2*n-1)/6*n-self.sumX**2
+
+    def update(self, value):
+        if self.buffer.isFull():
+            oldest=self.buffer.oldest()
+            #Shift every x down by one, drop the oldest value and add the new one at x=period-1
+            self.sumXY=self.sumXY-(self.sumY-oldest)+(self.period-1)*value
+            self.sumY+=value-oldest
+        else:
+            self.sumXY+=len(self.buffer)*value
+            self.sumY+=value
+        self.buffer.push(value)
+        self.updates+=1
+        if self.updates % RESUM_INTERVAL==0 and self.buffer.isFull():
+            self.sumY=0.0
+            self.sumXY=0.0
+            for x, y in enumerate(self.buffer):
+                self.sumY+=y
+                self.sumXY+=x*y
+        return self.getValue()
+
+    def isReady(self):
+        return self.buffer.isFull()
+
+    def getValue(self):
+        if not self.buffer.isFull():
+            return None
+        return (self.period*self.sumXY-self.sumX*self.sumY)/self.denominator
+
+
+class RollingVolatility(object):
+    #Sample standard deviation of the last period simple returns of the values fed in
+
+    def __init__(self, period):
+        if period < 2:
+            raise ValueError("Volatility period must be at least 2")
+        self.period=period
+        self.buffer=RingBuffer(period)
+        self.previous=None
+        self.total=0.0
+        self.totalSquares=0.0
+        self.updates=0
+
+    def update(self, value):
+        if self.previous:
+            change=value/self.previous-1
+            evicted=self.buffer.push(change)
+            if evicted is not None:
+                self.total-=evicted
+                self.totalSquares-=evicted*evicted
+            self.total+=change
+            self.totalSquares+=change*change
+            self.updates+=1
+            if self.updates % RESUM_INTERVAL==0:
+                self.total=sum(self.buffer)
+                self.totalSquares=sum(v*v for v in self.buffer)
+        self.previous=value
+        return self.getValue()
+
+    def isReady(self):
+        return self.buffer.isFull()
+
+    def getValue(self):
+        if not self.buffer.isFull():
+            return None
+        n=self.period
+        variance=(self.totalSquares-self.total*self.total/n)/(n-1)
+        return math.sqrt(max(variance, 0.0))
+
+
+class ATR(object):
+    #Average true range with Wilder's smoothing, like pyalgotrade.technical.atr.ATR.
+    #update() takes the bar's high, low and close.
+
+    def __init__(self, period):
+        self.period=period
+        self.previousClose=None
+        self.seed=SMA(period)
+        self.value=None
+
+    def update(self, high, low, close):
+        if self.previousClose is None:
+            trueRange=high-low
+        else:
+            trueRange=max(high-low, abs(high-self.previousClose), abs(low-self.previousClose))
+        self.previousClose=close
+        if self.value is None:
+            self.value=self.seed.update(trueRange)
+        else:
+            self.value=(self.value*(self.period-1)+trueRange)/float(self.period)
+        return self.value
+
+    def updateBar(self, bar):
+        return self.update(bar.getHigh(), bar.getLow(), bar.getClose())
+
+    def isReady(self):
+        return self.value is not None
+
+    def getValue(self):
+        return self.value
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+'''
+Timing and counting instrumentation for the watch list runs.
+
+A Timings object follows one ticker through the backtest: seconds per phase (Feed, Run, onBars,
+Analyzers, Results, Series), size of its data files and bars processed, plus an optional
+histogram of the onBars latency. backtestrunner only touches it when a Report is passed to
+run_watchlist(), so a run without a Report pays nothing. The Report gathers the rows of every
+ticker, can take the download summary of tickerdatautil (requests and retries per ticker, those
+of a batch counted once), and is saved as a csv and a json file next to the results. Tickers listed in profile_tickers also run under cProfile.
+'''
+
+import os
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import io
+import pandas as pd
+
+
+#onBars latency histogram bin edges in microseconds, 1us to about 1s in powers of 2
+LATENCY_BINS_US=[0]+[2**i for i in range(21)]+[float('inf')]
+
+
+class Timings(object):
+    #Phase timers and counters of one ticker. histogram: also count the onBars calls per LATENCY_BINS_US bin
+
+    def __init__(self, ticker, histogram=False):
+        self.ticker=ticker
+        self.histogram=histogram
+        self.seconds={}
+        self.counters={}
+        self.latencyCounts=[0]*(len(LATENCY_BINS_US)-1)
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        self.seconds[name]=self.seconds.get(name, 0.0)+seconds
+
+    def count(self, name, value=1):
+        self.counters[name]=self.counters.get(name, 0)+value
+
+    def wrapStrategy(self, strat, analyzers=()):
+        #Time onBars and the analyzers' beforeOnBars, the strategy calls them through the instance attributes
+        onBars=strat.onBars
+        counts=self.latencyCounts if self.histogram else None
+
+        def timedOnBars(bars):
+            start=time.perf_counter()
+            try:
+                onBars(bars)
+            finally:
+                elapsed=time.perf_counter()-start
+                self.seconds['onBars']=self.seconds.get('onBars', 0.0)+elapsed
+                self.counters['Bars']=self.counters.get('Bars', 0)+1
+                if counts is not None:
+                    #Binned as it comes, the memory does not grow with the number of bars
+                    counts[bisect.bisect_right(LATENCY_BINS_US, elapsed*1e6)-1]+=1
+        strat.onBars=timedOnBars
+        for analyzer in analyzers:
+            self.__wrapAnalyzer(analyzer)
+
+    def __wrapAnalyzer(self, analyzer):
+        beforeOnBars=analyzer.beforeOnBars
+
+        def timedBeforeOnBars(strat, bars):
+            start=time.perf_counter()
+            try:
+                beforeOnBars(strat, bars)
+            finally:
+                self.seconds['Analyzers']=self.seconds.get('Analyzers', 0.0)+time.perf_counter()-start
+        analyzer.beforeOnBars=timedBeforeOnBars
+
+    def getHistogram(self):
+        return list(self.latencyCounts)
+
+    def getRow(self):
+        row={'Ticker':self.ticker}
+        row.update({name+' Seconds':value for name, value in self.seconds.items()})
+        row.update(self.counters)
+        return row
+
+
+class LatencyHistogram(object):
+    #Counts of latencies in log spaced bins, bins_per_octave per power of 2 from 1us, so percentiles are known to
+    #within a bin (about 9% with 8 per octave) without keeping the samples. The bin edges refine LATENCY_BINS_US.
+
+    def __init__(self, bins_per_octave=8, octaves=24):
+        self.edges=[0]+[2**(i/bins_per_octave) for i in range(bins_per_octave*octaves+1)]+[float('inf')]
+        self.counts=[0]*(len(self.edges)-1)
+        self.count=0
+        self.max=float('nan')
+
+    def add(self, microseconds):
+        self.counts[bisect.bisect_right(self.edges, microseconds)-1]+=1
+        self.count+=1
+        if not microseconds <= self.max:
+            self.max=microseconds
+
+    def percentile(self, q):
+        #Upper edge of the bin holding the q-th percentile, the max for the last one, nan when empty
+        if self.count==0:
+            return float('nan')
+        rank=q/100.0*self.count
+        seen=0
+        for i, count in enumerate(self.counts):
+            seen+=count
+            if count and seen >= rank:
+                return min(self.edges[i+1], self.max)
+        return self.max
+
+    def getHistogram(self, edges=LATENCY_BINS_US):
+        #Counts per bin of the coarser edges, each of them one of self.edges
+        counts=[0]*(len(edges)-1)
+        for low, count in zip(self.edges, self.counts):
+            if count:
+                counts[bisect.bisect_right(edges, low)-1]+=count
+        return counts
+
+
+class _Phase(object):
+
+    def __init__(self, timings, name):
+        self.timings=timings
+        self.name=name
+
+    def __enter__(self):
+        self.start=time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.timings.add(self.name, time.perf_counter()-self.start)
+
+
+'''
+Function Name: profile_call(profile_directory, name, function, *args)
+Purpose: Run function(*args) under cProfile, save the raw stats to <profile_directory><name>.prof and the
+         30 most expensive calls by cumulative time to <profile_directory><name>.txt
+Returns: what function returns
+'''
+def profile_call(profile_directory, name, function, *args):
+    profiler=cProfile.Profile()
+    try:
+        return profiler.runcall(function, *args)
+    finally:
+        if not os.path.exists(profile_directory):
+            os.makedirs(profile_directory)
+        profiler.dump_stats(os.path.join(profile_directory, name+'.prof'))
+        text=io.StringIO()
+        pstats.Stats(profiler, stream=text).sort_stats('cumulative').print_stats(30)
+        with open(os.path.join(profile_directory, name+'.txt'), 'w') as f:
+            f.write(text.getvalue())
+
+
+class Report(object):
+    #histogram: collect the onBars latency histogram of every ticker
+    #profile_tickers: tickers to run under cProfile, their stats are saved to profile_directory
+
+    def __init__(self, histogram=False, profile_tickers=(), profile_directory=None):
+        self.histogram=histogram
+        self.profile_tickers=set(profile_tickers)
+        self.profile_directory=profile_directory
+        self.rows=[]
+        self.histograms={}
+        self.downloads=None
+        self.started=time.time()
+
+    def getOptions(self):
+        #What a worker needs to instrument a ticker, picklable
+        return {'histogram':self.histogram, 'profile_tickers':self.profile_tickers,
+                'profile_directory':self.profile_directory}
+
+    def add(self, timings):
+        #timings: the Timings of a ticker or its (row, histogram) as sent back by a worker
+        if isinstance(timings, Timings):
+            timings=(timings.getRow(), timings.getHistogram() if timings.histogram else None)
+        row, histogram=timings
+        self.rows.append(row)
+        if histogram is not None:
+            self.histograms[row['Ticker']]=histogram
+
+    def addDownloads(self, summary):
+        #summary: the DataFrame returned by tickerdatautil.download_tickers(), the get_data functions and
+        #update_ticker_prices_fromLast(). The summaries of several calls add up, the last row per ticker is kept.
+        if self.downloads is not None:
+            summary=pd.concat([self.downloads, summary], ignore_index=True).drop_duplicates(subset=['Ticker'], keep='last')
+        self.downloads=summary.reset_index(drop=True)
+
+    def toFrame(self):
+        frame=pd.DataFrame(self.rows)
+        if self.downloads is not None and len(self.downloads):
+            downloads=self.downloads.rename(columns={'Attempts':'Requests', 'Seconds':'Download Seconds',
+                                                    'Status':'Download Status', 'Error':'Download Error'})
+            if 'Batch' in downloads:
+                #Every ticker of a batch carries the requests of the batch, they are counted once, on the row of its
+                #first ticker
+                shared=downloads['Batch'].notna() & (downloads['Batch']!=downloads['Ticker'])
+                downloads.loc[shared, 'Requests']=0
+            downloads['Retries']=(downloads['Requests']-1).clip(lower=0)
+            frame=downloads.merge(frame, on='Ticker', how='outer') if len(frame) else downloads
+        return frame
+
+    def save(self, path_prefix):
+        #Writes <path_prefix>timings.csv and <path_prefix>timings.json
+        frame=self.toFrame()
+        frame.to_csv(path_prefix+'timings.csv', index=False)
+        totals=frame.drop(columns=['Ticker']).select_dtypes('number').sum().to_dict() if len(frame) else {}
+        report={'wall_seconds':time.time()-self.started, 'totals':totals,
+                'latency_bins_us':[str(edge) for edge in LATENCY_BINS_US], 'latency_histograms':self.histograms,
+                'tickers':json.loads(frame.to_json(orient='records'))}
+        with open(path_prefix+'timings.json', 'w') as f:
+            json.dump(report, f, indent=1)
+        return frame
@@ -7,14 +7,13 @@ TODO: More documentation
 '''
 
 import tickerdatautil as td
-import sma_9_strategy_backtest as sma_9
-import pyalgotrade.plotter as plotter
-import pyalgotrade.barfeed.csvfeed as csvfeed
+import backtestrunner
+import resultcache
+import plotrender
+import resultsink
+import instrumentation
+import resumebacktest
 import pyalgotrade.bar as bar
-import pyalgotrade.stratanalyzer.returns as ret
-import pyalgotrade.stratanalyzer.sharpe as sharpe
-import pyalgotrade.stratanalyzer.trades as trades
-from pyalgotrade.broker import backtesting
 import os
 import pickle
 import sys
@@ -33,14 +32,19 @@ start_date='2020-01-01'
 end_date='2020-06-29'
 interval='1d'
 
-#Update or redownload ticker data, uncomment to do so
+#Update or redownload ticker data, uncomment to do so. The download summaries go to the timings report (instrument)
+downloads=[]
 #Update Tickers
-#td.update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName,delay)
+#downloads.append(td.update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName,delay))
+
+
+#Sort, dedupe and check the ticker files, writes the quality report used below to skip bad series
+#td.compact_data_directory(data_directory,ticker_sub_directory,interval)
 
 
 #Purge Tickers and Redownload
 #td.add_ticker_to_pickle(data_directory,pickleFile=fileName,tickerName='AMD')
-#td.get_data_from_yahoo(data_directory, ticker_sub_directory, fileName, period, False, True, delay)
+#downloads.append(td.get_data_from_yahoo(data_directory, ticker_sub_directory, fileName, period, False, True, delay))
 
 
 #Set the initial portfolio size
@@ -62,98 +66,112 @@ save_results=True
 save_errors=True
 results_directory='C:\\Users\\robru\\Documents\\Python Scripts\\PyAlgoTrade\\Strategies\\Results\\'
 plots_directory=results_directory+'plots\\'
+#Plots are drawn after the run, in background processes, for the best plot_top tickers by Annual Ret and plot_tickers
+series_directory=plots_directory+'series\\'
+plot_top=20
+plot_tickers=[]
 results_filename='WatchListsma9_5y'
+#Set to a bar store directory (see barstore.py) to stream bars from the store instead of parsing the csv files
+store_directory=None
+store_interval='1d'
+#Intervals missing from the store can be built from finer stored bars instead of downloaded, ex 1h from 1m:
+#resample.resample_store(store_directory,store_interval)
+#Number of worker processes for the backtests, None for one per core, 1 to run in this process
+workers=None
+#Fast SMA period
+fastPeriod = 9
+#Fixed commission per trade
+COMMISSION=0.1
+#Reuse the results of tickers whose data and settings did not change since the last run, None to always backtest
+cache_directory=results_directory+'cache\\'
+cache_max_bytes=256*2**20
+#Each finished ticker is appended to <results_filename>.jsonl, a restarted run skips the tickers already in it
+resume=True
+#Backtest the watch list as one portfolio sharing INITIAL_BUDGET, see backtestrunner.run_portfolio()
+portfolio_mode=False
+#Save per ticker phase timings and counters to <results_filename>timings.csv/.json, with onBars latency histograms
+#when latency_histogram is set. Tickers in profile_tickers also run under cProfile, stats saved in profile_directory.
+instrument=False
+latency_histogram=False
+profile_tickers=[]
+profile_directory=results_directory+'profile\\'
+#Continue each ticker from the snapshot of the last run and only process the bars added since, see resumebacktest.py.
+#Snapshots are rebuilt from the full history when the settings or earlier bars change. None to replay every bar.
+snapshot_directory=None
 
 if __name__ == "__main__":
     
-    results = pd.DataFrame(columns=['Ticker', 'Initial Equity', 'Net P/L', 'Annualized Sharpe', 'Trades Made',
-                                    'Avg P/L', 'Max Profit', 'Max Loss', 'Annual Ret', 'Final Equity'])
-    
-    errors = pd.DataFrame(columns=['Ticker', 'Section', 'Error'])
-    
     if not os.path.exists(tickerFile):
         print(tickerFile+" Not Found! Check Path and File Name! Exiting!")
         sys.exit()
     with open(tickerFile,"rb") as f:
         tickers=pickle.load(f)
-    if not os.path.exists(plots_directory):
-        os.makedirs(plots_directory)
-    for ticker in tickers:
-        try:
-
-            file_name=data_directory+ticker+'.csv'
-            #we want to predict the S&P500 (^GSPC index)
-            #second MA indicator tracks the fast trend with period 9
-            fastPeriod = 9
-    
-            #the data is in the CSV file (one row per day)
-            feed = csvfeed.GenericBarFeed(bar.Frequency.DAY)
-            feed.addBarsFromCSV(ticker,file_name)
-    
-            #this is where we define the time for the moving average models (slow and fast)
-            movingAverageStrategy = sma_9.MovingAverageStrategy(feed,ticker,fastPeriod)
-            #Set Initial Budget
-            movingAverageStrategy.initBackTestStrategy(INITIAL_BUDGET)
-            #Set Risk Percent, default is 2
-            movingAverageStrategy.setRiskPercent(RISK_PERCENT)
-            #Set budget useage
-            movingAverageStrategy.setBudgetUse(BUDGET_USE)
-            #we can define the cost of trading (cost pre trade)
-            movingAverageStrategy.getBroker().setCommission(backtesting.FixedPerTrade(0.1))
-            #Turn on or off the trade print output
-            movingAverageStrategy.setInfoOutput(outputInfo)
-        
-            #Prepare plots
-            plot = plotter.StrategyPlotter(movingAverageStrategy,plotAllInstruments=True,plotBuySell=True,plotPortfolio=True)
-            plot.getInstrumentSubplot(ticker).addDataSeries('Fast SMA',movingAverageStrategy.getFastMA())
-        
-            #we can analyze the returns during the backtest
-            returnAnalyzer = ret.Returns()
-            movingAverageStrategy.attachAnalyzer(returnAnalyzer)
-    
-            #we can analyze the Sharpe ratio during backtest
-            sharpeRatioAnalyzer = sharpe.SharpeRatio()
-            movingAverageStrategy.attachAnalyzer(sharpeRatioAnalyzer)
-    
-            #we can analyze the trades (maximum profit or loss etc.)
-            tradesAnalyzer = trades.Trades()
-            movingAverageStrategy.attachAnalyzer(tradesAnalyzer)
-    
-            #let's run the strategy on the data (CSV file) so let's backtest the algorithm
-            movingAverageStrategy.run()
-        
-            tradesProfits = tradesAnalyzer.getAll()
-        except:
-            e = sys.exc_info()[0]
-            #print("Ticker: ", ticker," Error: %s" % e)
-            errors = errors.append({'Ticker':ticker,'Section':'Trades','Error':e}, ignore_index=True)
-        
-        try:
-            results = results.append({'Ticker':ticker , 'Initial Equity':INITIAL_BUDGET, 'Net P/L':tradesAnalyzer.getAll().sum(),
-                                  'Annualized Sharpe':sharpeRatioAnalyzer.getSharpeRatio(0.0), 
-                                  'Trades Made':tradesAnalyzer.getCount(),'Avg P/L':tradesProfits.mean(),
-                                     'Max Profit':tradesProfits.max(), 'Max Loss':tradesProfits.min(), 
-                                     'Annual Ret':returnAnalyzer.getCumulativeReturns()[-1]*100,
-                                     'Final Equity':movingAverageStrategy.getBroker().getEquity()},ignore_index=True)
-        except:
-            e = sys.exc_info()[0]
-            #print("Error in results, Ticker: ", ticker," Error: %s" % e)
-            errors = errors.append({'Ticker':ticker,'Section':'Results','Error':e},ignore_index=True)
-       
-        if save_plots:
-            #we want to plot the stock (instrument) with the buy/sell orders
-            plot.savePlot(plots_directory+ticker+'.png', dpi=plot_dpi, format='png')
-        
-        
+    #Skip the series the last compaction reported as not usable
+    tickers, skipped=td.usable_tickers(pickle_directory, ticker_sub_directory, tickers)
+    if skipped:
+        print("Skipping {} tickers with bad data: {}".format(len(skipped), ', '.join(skipped)))
+
+    settings={'data_directory':data_directory, 'store_directory':store_directory, 'store_interval':store_interval,
+              'frequency':bar.Frequency.DAY, 'fast_period':fastPeriod, 'initial_budget':INITIAL_BUDGET,
+              'budget_use':BUDGET_USE, 'risk_percent':RISK_PERCENT, 'commission':COMMISSION,
+              'output_info':outputInfo, 'series_directory':series_directory if save_plots else None}
+    if portfolio_mode:
+        portfolio, instruments, errors = backtestrunner.run_portfolio(tickers, settings)
+        print(portfolio)
+        if save_results:
+            instruments.to_csv(results_directory+results_filename+'portfolio.csv', index=False)
+            errors.to_csv(results_directory+results_filename+'portfolioerrors.csv', index=False)
+        sys.exit()
+    if snapshot_directory:
+        results, errors = resumebacktest.run_watchlist_incremental(tickers, settings, snapshot_directory, workers)
+        results=results.sort_values(by=['Annual Ret'], ascending=False, kind='stable', na_position='last')
+        print(results)
+        if save_results:
+            results.to_csv(results_directory+results_filename+'.csv', index=False)
+            errors.to_csv(results_directory+results_filename+'errors'+'.csv', index=False)
+        sys.exit()
+
+    #each ticker is backtested in a worker process, results come back in watch list order
+    cache=resultcache.ResultCache(cache_directory, cache_max_bytes) if cache_directory else None
+    sink_path=results_directory+results_filename+'.jsonl'
+    if not resume and os.path.exists(sink_path):
+        os.remove(sink_path)
+    sink=resultsink.ResultSink(sink_path, resultsink.make_run_id(settings))
+    with sink:
+        report=instrumentation.Report(latency_histogram, profile_tickers, profile_directory) if instrument else None
+        if report is not None:
+            for summary in downloads:
+                report.addDownloads(summary)
+        backtestrunner.run_watchlist(tickers, settings, workers, cache, sink, report)
+    if report is not None:
+        report.save(results_directory+results_filename)
+    results, errors = sink.report('Annual Ret')
+    #Only the tickers of this watch list, a ticker removed from it may still be in the file
+    results=results[results['Ticker'].isin(tickers)]
+    errors=errors[errors['Ticker'].isin(tickers)]
+    #Universe level metrics merged from each ticker's aggregates, no per bar or per trade series involved
+    universe=pd.DataFrame([sink.aggregate(set(tickers)).getRow()])
+    if cache is not None:
+        print("Result cache: {hits} hits, {misses} misses".format(**cache.getStats()))
+
+    renderer=None
+    if save_plots:
+        renderer=plotrender.PlotRenderer(series_directory, plots_directory, plot_dpi, workers)
+        renderer.submit(plotrender.select_plot_tickers(results, plot_top, 'Annual Ret', plot_tickers))
         
     if save_results:
         print("Saving Results.....")
-        results=results.sort_values(by=['Annual Ret'], ascending=False)
         results.to_csv(results_directory+results_filename+'.csv', index=False)
+        universe.to_csv(results_directory+results_filename+'universe.csv', index=False)
     
     if save_results:
         print("Saving Exception Log.....")
         errors.to_csv(results_directory+results_filename+'errors'+'.csv', index=False)
 
+    if renderer is not None:
+        print("Waiting For Plots.....")
+        plots=renderer.wait()
+        print(plots[plots['Status']!='OK'])
+
     print(results)
-        
\ No newline at end of file
+    print(universe.T)
@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+'''
+Paper trading loop: the MovingAverageStrategy rules driven by streaming bars instead of
+BacktestingStrategy.run() over csv files.
+
+A bar source is any object with an async stream() generator yielding lists of LiveBar, one
+list per arrival. Three stand-ins for a live feed are provided: ReplaySource replays stored
+bars at a chosen speed, FileTailSource follows ticker csv files as rows are appended, and
+SocketSource reads the JSON lines sent by serve_replay(), a local replay server.
+
+PaperTrader gives every instrument its own queue and asyncio task, so a burst of bars or a
+failing instrument does not hold up the others. The decisions are the ones of the backtests,
+smarules.SMARules. Orders go to SimulatedBroker, one cash account shared by the instruments
+unless shared_cash=False, and fill at the open of the instrument's next bar. Each bar's latency,
+from its arrival to the end of the order decision, is binned into a histogram and summarized
+against a latency budget with getLatencyStats().
+'''
+
+import os
+import sys
+import json
+import time
+import asyncio
+from collections import namedtuple, deque
+import numpy as np
+import pandas as pd
+import indicators
+import smarules
+import instrumentation
+import barstore
+
+
+#Default latency budget from bar arrival to order decision, in milliseconds
+LATENCY_BUDGET_MS=50
+#Recent orders kept by PaperTrader, the older ones are only counted
+MAX_ORDERS=10000
+
+LiveBar=namedtuple('LiveBar', ['ticker', 'dateTime', 'open', 'high', 'low', 'close', 'volume', 'arrival'])
+LiveBar.__doc__='''A bar as received from a source. dateTime is epoch seconds, arrival the time.perf_counter() it was received'''
+
+
+class ReplaySource(object):
+    #Replays stored bars of many tickers in time order, all tickers of a timestamp in one batch
+    #bars: dict ticker -> dict column name -> numpy array, as returned by barstore.load_bars()
+    #interval_seconds: the bar spacing the replay clock advances by between timestamps
+    #speed: how many times faster than real time to replay, None to replay as fast as possible
+
+    def __init__(self, bars, interval_seconds=60, speed=None):
+        self.interval_seconds=interval_seconds
+        self.speed=speed
+        tickers=list(bars)
+        counts=[len(bars[ticker]['datetime']) for ticker in tickers]
+        self.tickers=np.repeat(np.arange(len(tickers)), counts)
+        self.names=tickers
+        columns={}
+        for column in ('datetime', 'open', 'high', 'low', 'close', 'volume'):
+            columns[column]=np.concatenate([np.asarray(bars[ticker][column]) for ticker in tickers]) if tickers else np.empty(0)
+        order=np.argsort(columns['datetime'], kind='stable')
+        self.tickers=self.tickers[order]
+        self.columns={column:values[order] for column, values in columns.items()}
+
+    @classmethod
+    def fromStore(cls, store_directory, interval, tickers, start=None, end=None, speed=None):
+        bars={ticker:barstore.load_bars(store_directory, interval, ticker, start, end, mmap=False) for ticker in tickers}
+        return cls(bars, barstore.INTERVAL_SECONDS[interval], speed)
+
+    async def stream(self):
+        date_times=self.columns['datetime']
+        if len(date_times)==0:
+            return
+        starts=np.flatnonzero(np.concatenate(([True], date_times[1:]!=date_times[:-1])))
+        ends=np.concatenate((starts[1:], [len(date_times)]))
+        delay=self.interval_seconds/self.speed if self.speed else 0
+        rows=zip(self.tickers.tolist(), date_times.tolist(), self.columns['open'].tolist(), self.columns['high'].tolist(),
+                 self.columns['low'].tolist(), self.columns['close'].tolist(), self.columns['volume'].tolist())
+        started=time.perf_counter()
+        for number, (first, last) in enumerate(zip(starts, ends)):
+            if delay:
+                #Keep to the replay clock rather than sleeping a fixed delay, so processing time does not add up
+                wait=started+number*delay-time.perf_counter()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            arrival=time.perf_counter()
+            yield [LiveBar(self.names[ticker], date_time, bar_open, high, low, close, volume, arrival)
+                   for ticker, date_time, bar_open, high, low, close, volume in _take(rows, last-first)]
+            if not delay:
+                await asyncio.sleep(0)
+
+
+def _take(iterator, count):
+    return [next(iterator) for _ in range(count)]
+
+
+class FileTailSource(object):
+    #Follows the ticker csv files written by tickerdatautil (<directory><ticker>.csv) and yields the rows appended to them
+    #poll: seconds between checks of the files
+    #from_start: also yield the rows already in the files, otherwise start at their current end
+    #idle_timeout: stop after that many seconds without a new row, None to follow the files forever
+
+    def __init__(self, directory, tickers, poll=1.0, from_start=False, idle_timeout=None):
+        self.directory=directory
+        self.tickers=list(tickers)
+        self.poll=poll
+        self.from_start=from_start
+        self.idle_timeout=idle_timeout
+        self.offsets={}
+        self.columns={}
+
+    def __readNew(self, ticker):
+        path=os.path.join(self.directory, ticker+'.csv')
+        if not os.path.exists(path):
+            return []
+        with open(path, 'rb') as f:
+            if ticker not in self.columns:
+                header=f.readline().decode('utf-8').strip().split(',')
+                self.columns[ticker]=[header.index(name) for name in
+                                      ('Date Time', 'Open', 'High', 'Low', 'Close', 'Volume')]
+                self.offsets[ticker]=f.tell() if self.from_start else os.path.getsize(path)
+            f.seek(self.offsets[ticker])
+            data=f.read()
+        #Only complete lines, a row being written is read on the next poll
+        end=data.rfind(b'\n')+1
+        self.offsets[ticker]+=end
+        arrival=time.perf_counter()
+        bars=[]
+        for line in data[:end].decode('utf-8').splitlines():
+            if not line.strip():
+                continue
+            values=line.split(',')
+            date_time, bar_open, high, low, close, volume=(values[i] for i in self.columns[ticker])
+            bars.append(LiveBar(ticker, int(_epoch(date_time)), float(bar_open), float(high), float(low),
+                                float(close), float(volume), arrival))
+        return bars
+
+    async def stream(self):
+        idle=0.0
+        while True:
+            batch=[bar for ticker in self.tickers for bar in self.__readNew(ticker)]
+            if batch:
+                idle=0.0
+                yield batch
+            else:
+                if self.idle_timeout is not None and idle >= self.idle_timeout:
+                    return
+                idle+=self.poll
+            await asyncio.sleep(self.poll)
+
+
+def _epoch(value):
+    value=value.strip()
+    if value.isdigit():
+        return int(value)
+    return (pd.Timestamp(value).tz_localize(None)-pd.Timestamp(0)).total_seconds()
+
+
+'''
+Function Name: serve_replay(source, host, port)
+Purpose: Start a local replay server sending the batches of a source to each client that connects, as one JSON
+         line per batch of [ticker, dateTime, open, high, low, close, volume] rows. Stands in for a market data feed.
+Arguments: source: a bar source, ex ReplaySource, streamed again from the start for every client
+           host, port: where to listen, port 0 picks a free port (see server.sockets[0].getsockname())
+Returns: asyncio Server
+'''
+async def serve_replay(source, host='127.0.0.1', port=0):
+    async def send(reader, writer):
+        try:
+            async for batch in source.stream():
+                writer.write((json.dumps([bar[:7] for bar in batch])+'\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+    return await asyncio.start_server(send, host, port)
+
+
+class SocketSource(object):
+    #Reads the batches sent by serve_replay(), stamping each with the time it was received
+
+    def __init__(self, host, port):
+        self.host=host
+        self.port=port
+
+    async def stream(self):
+        reader, writer=await asyncio.open_connection(self.host, self.port, limit=2**24)
+        try:
+            while True:
+                line=await reader.readline()
+                if not line:
+                    return
+                arrival=time.perf_counter()
+                yield [LiveBar(*row, arrival) for row in json.loads(line)]
+        finally:
+            writer.close()
+
+
+class SimulatedBroker(object):
+    #Paper broker. By default all the instruments trade out of one cash account holding initial_budget, like the
+    #portfolio backtests (backtestrunner.run_portfolio); shared=False gives each instrument its own initial_budget,
+    #like the watch list backtests. Market orders fill at the open of the instrument's next bar, minus a fixed
+    #commission. The cash of pending buys, valued at their instrument's last close, is reserved until they fill,
+    #and a buy the cash cannot cover at the open is canceled.
+
+    def __init__(self, initial_budget, commission=0.0, shared=True):
+        self.initial_budget=initial_budget
+        self.commission=commission
+        self.shared=shared
+        self.cash={}
+        self.reserved={}
+        self.shares={}
+        self.pending={}
+        self.entryPrice={}
+        self.trades={}
+        self.lastPrice={}
+
+    def __account(self, ticker):
+        return None if self.shared else ticker
+
+    def __balance(self, account):
+        return self.cash.setdefault(account, float(self.initial_budget))
+
+    def getCash(self, ticker=None):
+        #Cash available to the ticker's orders, the reserved cash of pending buys excluded
+        account=self.__account(ticker)
+        return self.__balance(account)-self.reserved.get(account, 0.0)
+
+    def getShares(self, ticker):
+        return self.shares.get(ticker, 0)
+
+    def hasPending(self, ticker):
+        return ticker in self.pending
+
+    def submit(self, ticker, shares):
+        #shares > 0 buys, shares < 0 sells, filled by onBar() on the next bar of the ticker
+        reserve=shares*self.lastPrice.get(ticker, 0.0) if shares > 0 else 0.0
+        account=self.__account(ticker)
+        self.reserved[account]=self.reserved.get(account, 0.0)+reserve
+        self.pending[ticker]=(shares, reserve)
+
+    def onBar(self, bar):
+        #Fill the pending order of the bar's instrument, returns ('filled' or 'canceled', shares) or None
+        self.lastPrice[bar.ticker]=bar.close
+        order=self.pending.pop(bar.ticker, None)
+        if order is None:
+            return None
+        shares, reserve=order
+        account=self.__account(bar.ticker)
+        self.reserved[account]-=reserve
+        cash=self.__balance(account)
+        if shares > 0:
+            cost=shares*bar.open+self.commission
+            if cost > cash-self.reserved[account]:
+                return 'canceled', shares
+            self.cash[account]=cash-cost
+            self.entryPrice[bar.ticker]=bar.open
+        else:
+            self.cash[account]=cash-shares*bar.open-self.commission
+            self.trades.setdefault(bar.ticker, []).append(-shares*(bar.open-self.entryPrice[bar.ticker])-2*self.commission)
+        self.shares[bar.ticker]=self.getShares(bar.ticker)+shares
+        return 'filled', shares
+
+    def getEquity(self, ticker=None):
+        #Equity of the ticker's account, the whole portfolio when the account is shared
+        account=self.__account(ticker)
+        held=self.shares if self.shared else {ticker:self.getShares(ticker)}
+        return self.__balance(account)+sum(shares*self.lastPrice.get(name, 0.0) for name, shares in held.items())
+
+    def getResults(self, tickers):
+        #Final Equity is the instrument's own account, or its market value when the account is shared
+        rows=[]
+        for ticker in tickers:
+            trades=np.array(self.trades.get(ticker, []))
+            equity=self.getShares(ticker)*self.lastPrice.get(ticker, 0.0) if self.shared else self.getEquity(ticker)
+            rows.append({'Ticker':ticker, 'Trades Made':len(trades), 'Net P/L':trades.sum(),
+                         'Shares':self.getShares(ticker), 'Final Equity':equity})
+        return pd.DataFrame(rows, columns=['Ticker', 'Trades Made', 'Net P/L', 'Shares', 'Final Equity'])
+
+
+class InstrumentTrader(object):
+    #Runs the smarules.SMARules of MovingAverageStrategy for one instrument, fed one bar at a time.
+    #An entry the available cash cannot buy a single share of is skipped, like in the portfolio backtests.
+
+    def __init__(self, ticker, broker, nfast, budget_use, risk_percent):
+        self.ticker=ticker
+        self.broker=broker
+        self.fastMA=indicators.SMA(nfast)
+        self.rules=smarules.SMARules(budget_use, risk_percent)
+
+    def onBar(self, bar):
+        #Returns the order decided on this bar, 'buy', 'sell' or None
+        fill=self.broker.onBar(bar)
+        if fill is not None and fill[0]=='canceled':
+            self.rules.cancelEntry()
+        sma=self.fastMA.update(bar.close)
+        if sma is None or self.broker.hasPending(self.ticker):
+            return None
+        cash=self.broker.getCash(self.ticker)
+        if not self.rules.holding and cash*self.rules.budget_use < bar.close:
+            return None
+        shares=self.rules.onBar(sma, bar.close, cash)
+        if shares > 0:
+            self.broker.submit(self.ticker, shares)
+            return 'buy'
+        if shares < 0:
+            self.broker.submit(self.ticker, -self.broker.getShares(self.ticker))
+            return 'sell'
+        return None
+
+
+class PaperTrader(object):
+    #Runs InstrumentTrader for every ticker over a bar source until the source ends
+    #settings: dict, see backtestrunner.DEFAULT_SETTINGS (fast_period, initial_budget, budget_use, risk_percent, commission)
+    #latency_budget_ms: bars whose arrival to decision latency exceeds it are counted as over budget
+    #shared_cash: one cash account of initial_budget for all the tickers, False for initial_budget per ticker
+    #max_orders: the number of recent orders kept in self.orders, the older ones are only counted
+    #The latencies are binned into an instrumentation.LatencyHistogram as they arrive, so memory does not grow
+    #with the length of the session.
+
+    def __init__(self, source, tickers, settings, latency_budget_ms=LATENCY_BUDGET_MS, shared_cash=True,
+                 max_orders=MAX_ORDERS):
+        import backtestrunner
+        settings=dict(backtestrunner.DEFAULT_SETTINGS, **settings)
+        self.source=source
+        self.tickers=list(dict.fromkeys(tickers))
+        self.latency_budget=latency_budget_ms/1000.0
+        self.broker=SimulatedBroker(settings['initial_budget'], settings['commission'], shared_cash)
+        self.traders={ticker:InstrumentTrader(ticker, self.broker, settings['fast_period'], settings['budget_use'],
+                                              settings['risk_percent']) for ticker in self.tickers}
+        self.latencies=instrumentation.LatencyHistogram()
+        self.overBudget=0
+        self.orders=deque(maxlen=max_orders)
+        self.orderCount=0
+        self.errors=[]
+        self.unknown=0
+        self.maxBacklog=0
+
+    async def __consume(self, ticker, queue):
+        trader=self.traders[ticker]
+        while True:
+            bar=await queue.get()
+            if bar is None:
+                return
+            try:
+                decision=trader.onBar(bar)
+            except Exception:
+                self.errors.append({'Ticker':ticker,'Section':'Paper','Error':str(sys.exc_info()[0])})
+                decision=None
+            latency=time.perf_counter()-bar.arrival
+            self.latencies.add(latency*1e6)
+            if latency > self.latency_budget:
+                self.overBudget+=1
+            if decision is not None:
+                self.orders.append((ticker, bar.dateTime, decision))
+                self.orderCount+=1
+            #Give the other instruments a turn before this one's next queued bar
+            await asyncio.sleep(0)
+
+    async def run(self):
+        queues={ticker:asyncio.Queue() for ticker in self.tickers}
+        tasks=[asyncio.ensure_future(self.__consume(ticker, queue)) for ticker, queue in queues.items()]
+        try:
+            async for batch in self.source.stream():
+                for bar in batch:
+                    queue=queues.get(bar.ticker)
+                    if queue is None:
+                        self.unknown+=1
+                        continue
+                    queue.put_nowait(bar)
+                self.maxBacklog=max(self.maxBacklog, max(queue.qsize() for queue in queues.values()))
+            for queue in queues.values():
+                queue.put_nowait(None)
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+        return self.getLatencyStats()
+
+    def getLatencyStats(self):
+        #Percentiles are the upper edge of their histogram bin
+        latencies=self.latencies
+        stats={'Bars':latencies.count, 'Orders':self.orderCount, 'Errors':len(self.errors),
+               'Unknown Tickers':self.unknown, 'Max Backlog':self.maxBacklog,
+               'Budget ms':self.latency_budget*1e3, 'Over Budget':self.overBudget}
+        for name, percentile in (('p50 ms', 50), ('p99 ms', 99), ('p99.9 ms', 99.9)):
+            stats[name]=latencies.percentile(percentile)/1e3
+        stats['Max ms']=latencies.max/1e3
+        stats['Histogram']=latencies.getHistogram()
+        return stats
+
+    def getResults(self):
+        return self.broker.getResults(self.tickers)
+
+
+#Settings of the paper trading demo: minute bars of synthetic tickers replayed through the local replay server
+PAPER_TICKERS=500
+PAPER_BARS=390
+PAPER_SPEED=600        #Replay speed, 600 sends a minute bar of every ticker each 0.1 s
+
+
+if __name__ == "__main__":
+    import synthdata
+
+    async def main():
+        symbols=['SYN{:04d}'.format(i) for i in range(PAPER_TICKERS)]
+        bars={}
+        for ticker in symbols:
+            df=synthdata.generate_bars(ticker, bars=PAPER_BARS, freq='min', session=True, volatility=0.001)
+            bars[ticker]={'datetime':df.index.values.astype('datetime64[s]').astype(np.int64),
+                          'open':df['Open'].values, 'high':df['High'].values, 'low':df['Low'].values,
+                          'close':df['Close'].values, 'volume':df['Volume'].values.astype(np.float64)}
+        server=await serve_replay(ReplaySource(bars, 60, PAPER_SPEED))
+        host, port=server.sockets[0].getsockname()[:2]
+        trader=PaperTrader(SocketSource(host, port), symbols, {})
+        try:
+            stats=await trader.run()
+        finally:
+            server.close()
+            await server.wait_closed()
+        del stats['Histogram']
+        print(pd.Series(stats).to_string())
+        print(trader.getResults().sort_values(by=['Net P/L'], ascending=False).head(10))
+
+    asyncio.run(main())
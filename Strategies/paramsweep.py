@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+'''
+Parameter sweep over the MovingAverageStrategy settings: the fast SMA period (nfast), the risk
+percent (setRiskPercent), the budget use (setBudgetUse) and the FixedPerTrade commission.
+
+Every ticker's bars are loaded once per worker process into arrays and shared by all the
+combinations run for that ticker, each run only wraps them in a fresh arrayfeed.ArrayBarFeed.
+The combinations run in parallel and all results end up in one ranked table. With
+engine='vector' the runs use the NumPy evaluator in vectorbacktest.py instead of the event loop.
+'''
+
+import itertools
+import random
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+import arrayfeed
+import backtestrunner
+import barstore
+import vectorbacktest
+
+
+#Settings keys that can be swept and their names in the results table
+PARAMETERS=OrderedDict([('fast_period','nfast'), ('risk_percent','Risk Percent'),
+                        ('budget_use','Budget Use'), ('commission','Commission')])
+
+#Bars loaded by this worker process, ticker -> dict of arrays. Kept small, tasks arrive grouped by ticker.
+_BARS_CACHE=OrderedDict()
+_BARS_CACHE_SIZE=4
+
+
+'''
+Function Name: build_grid(fast_period, risk_percent, budget_use, commission)
+Purpose: Build every combination of the given parameter values
+Arguments: each argument is a list of values for that setting, see backtestrunner.DEFAULT_SETTINGS
+Returns: list of dicts of settings
+'''
+def build_grid(fast_period=(9,), risk_percent=(2,), budget_use=(0.5,), commission=(0.1,)):
+    return [dict(zip(PARAMETERS.keys(), values))
+            for values in itertools.product(fast_period, risk_percent, budget_use, commission)]
+
+
+'''
+Function Name: sample_grid(space, samples, seed)
+Purpose: Draw a random sample of combinations from a parameter space, without repeats
+Arguments: space: dict settings key -> list of values, keys from PARAMETERS
+           samples: int, the number of combinations wanted
+           seed: int, random seed so a sample can be reproduced
+Returns: list of dicts of settings
+'''
+def sample_grid(space, samples, seed=0):
+    grid=build_grid(**space)
+    if samples >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, samples)
+
+
+'''
+Function Name: load_arrays(ticker, settings)
+Purpose: Load the bars of a ticker into arrays, memory-mapped from the bar store when settings['store_directory']
+         is set, otherwise parsed once from <data_directory><ticker>.csv
+Returns: dict column name -> numpy array, with the barstore column names
+'''
+def load_arrays(ticker, settings):
+    if settings.get('store_directory'):
+        return barstore.load_bars(settings['store_directory'], settings.get('store_interval', '1d'), ticker)
+    import tickerdatautil as td
+    df=td.read_ticker_csv(settings['data_directory']+ticker+'.csv')
+    bars={'datetime':df['Date Time'].to_numpy(dtype='datetime64[s]').astype('int64')}
+    for column, csv_column in barstore.COLUMNS.items():
+        if column!='datetime':
+            bars[column]=df[csv_column].to_numpy(dtype='float64') if csv_column in df.columns else None
+    return bars
+
+
+def _cached_arrays(ticker, settings):
+    if ticker in _BARS_CACHE:
+        _BARS_CACHE.move_to_end(ticker)
+    else:
+        _BARS_CACHE[ticker]=load_arrays(ticker, settings)
+        if len(_BARS_CACHE) > _BARS_CACHE_SIZE:
+            _BARS_CACHE.popitem(last=False)
+    return _BARS_CACHE[ticker]
+
+
+'''
+Function Name: run_combinations(ticker, combinations, settings, engine)
+Purpose: Run a chunk of parameter combinations on one ticker, reusing the ticker's cached bars. Runs in a worker.
+Arguments: engine: String, 'event' for the PyAlgoTrade strategy, 'vector' for vectorbacktest.run_sma_backtest()
+Returns: list of results rows, each with the parameters of the run and the backtestrunner.RESULT_COLUMNS metrics
+'''
+def run_combinations(ticker, combinations, settings, engine='event'):
+    try:
+        bars=_cached_arrays(ticker, settings)
+    except Exception as e:
+        error='Feed: {}'.format(e.__class__)
+        return [dict(_parameter_columns(combination), Ticker=ticker, Error=error) for combination in combinations]
+    rows=[]
+    for combination in combinations:
+        run_settings=dict(settings, series_directory=None, **combination)
+        if engine=='vector':
+            rows.append(dict(_run_vector(ticker, bars, run_settings), **_parameter_columns(combination)))
+            continue
+        feed=arrayfeed.ArrayBarFeed(run_settings.get('frequency', backtestrunner.DEFAULT_SETTINGS['frequency']))
+        feed.addBarsFromArrays(ticker, bars['datetime'], bars['open'], bars['high'], bars['low'], bars['close'],
+                               bars['volume'], bars['adj_close'])
+        result, errors=backtestrunner.run_strategy(feed, ticker, run_settings)
+        row=dict(result or {'Ticker':ticker}, **_parameter_columns(combination))
+        row['Error']='; '.join('{}: {}'.format(error['Section'], error['Error']) for error in errors)
+        rows.append(row)
+    return rows
+
+
+def _run_vector(ticker, bars, settings):
+    try:
+        result=vectorbacktest.run_sma_backtest(bars['datetime'], bars['open'], bars['close'], settings['fast_period'],
+                                               settings['initial_budget'], settings['budget_use'],
+                                               settings['risk_percent'], settings['commission'])
+    except Exception as e:
+        return {'Ticker':ticker, 'Error':'Trades: {}'.format(e.__class__)}
+    del result['Trades']
+    return dict(result, Ticker=ticker, Error='')
+
+
+def _parameter_columns(combination):
+    return {PARAMETERS[key]:value for key, value in combination.items()}
+
+
+'''
+Function Name: run_sweep(tickers, combinations, settings, workers, chunk_size, rank_by, engine)
+Purpose: Backtest every combination of parameters on every ticker and rank the results
+Arguments: tickers: list of ticker symbol strings
+           combinations: list of dicts of settings, from build_grid() or sample_grid()
+           settings: dict of the fixed settings, see backtestrunner.DEFAULT_SETTINGS
+           workers: int, the number of worker processes, None for one per core, 1 runs in this process
+           chunk_size: int, the number of combinations of one ticker sent to a worker at a time
+           rank_by: String, the results column to rank by, best first
+           engine: String, 'event' to run MovingAverageStrategy, 'vector' for the vectorized evaluator
+Returns: pandas DataFrame with one row per ticker and combination, with a Rank column
+'''
+def run_sweep(tickers, combinations, settings, workers=None, chunk_size=32, rank_by='Annual Ret', engine='event'):
+    settings=dict(backtestrunner.DEFAULT_SETTINGS, **settings)
+    tasks=[(ticker, combinations[i:i+chunk_size]) for ticker in dict.fromkeys(tickers)
+           for i in range(0, len(combinations), chunk_size)]
+    if workers==1:
+        chunks=[run_combinations(ticker, chunk, settings, engine) for ticker, chunk in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunks=list(pool.map(run_combinations, [ticker for ticker, _ in tasks], [chunk for _, chunk in tasks],
+                                 [settings]*len(tasks), [engine]*len(tasks)))
+    columns=['Ticker']+list(PARAMETERS.values())+backtestrunner.RESULT_COLUMNS[1:]+['Error']
+    table=pd.DataFrame([row for rows in chunks for row in rows], columns=columns)
+    table=table.sort_values(by=[rank_by], ascending=False, kind='stable', na_position='last').reset_index(drop=True)
+    table.insert(0, 'Rank', range(1, len(table)+1))
+    return table
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+'''
+Deferred plotting for the watch list backtests.
+
+During a run SeriesRecorder keeps only the series a plot needs (close, fast SMA, equity and the
+fills) and the worker saves them to <series_directory><ticker>.npz. Images are drawn afterwards,
+by a PlotRenderer process pool, for the tickers picked with select_plot_tickers() (the top N
+by a results column plus any requested tickers). matplotlib is never imported by the backtests.
+'''
+
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from pyalgotrade import stratanalyzer
+from pyalgotrade import broker
+
+
+SUMMARY_COLUMNS=['Ticker', 'Status', 'Seconds', 'Error']
+
+
+class SeriesRecorder(stratanalyzer.StrategyAnalyzer):
+    #Records the close, fast SMA and equity of each bar and the fills of the orders.
+    #Equity is taken before the bar's fills, like the Returns analyzer.
+
+    def __init__(self, instrument, fastMA):
+        super(SeriesRecorder, self).__init__()
+        self.instrument=instrument
+        self.fastMA=fastMA
+        self.dateTimes=[]
+        self.close=[]
+        self.sma=[]
+        self.equity=[]
+        self.fills=[]
+
+    def attached(self, strat):
+        strat.getBroker().getOrderUpdatedEvent().subscribe(self.__onOrderUpdated)
+
+    def __onOrderUpdated(self, broker_, orderEvent):
+        if orderEvent.getEventType() in (broker.OrderEvent.Type.FILLED, broker.OrderEvent.Type.PARTIALLY_FILLED):
+            info=orderEvent.getEventInfo()
+            self.fills.append((_epoch(info.getDateTime()), info.getPrice(), 1 if orderEvent.getOrder().isBuy() else -1))
+
+    def beforeOnBars(self, strat, bars):
+        bar=bars.getBar(self.instrument)
+        if bar is None:
+            return
+        sma=self.fastMA[-1]
+        self.dateTimes.append(_epoch(bar.getDateTime()))
+        self.close.append(bar.getClose())
+        self.sma.append(np.nan if sma is None else sma)
+        self.equity.append(strat.getBroker().getEquity())
+
+    def getSeries(self):
+        fills=np.array(self.fills, dtype=np.float64).reshape(-1, 3)
+        return {'datetime':np.array(self.dateTimes, dtype=np.int64), 'close':np.array(self.close),
+                'sma':np.array(self.sma), 'equity':np.array(self.equity),
+                'fill_datetime':fills[:, 0].astype(np.int64), 'fill_price':fills[:, 1],
+                'fill_side':fills[:, 2].astype(np.int8)}
+
+
+def _epoch(dateTime):
+    return int((pd.Timestamp(dateTime).tz_localize(None)-pd.Timestamp(0)).total_seconds())
+
+
+'''
+Function Name: save_series(series_directory, ticker, series)
+Purpose: Save the recorded series of a ticker to <series_directory><ticker>.npz, written atomically
+'''
+def save_series(series_directory, ticker, series):
+    path=series_path(series_directory, ticker)
+    with open(path+'.tmp', 'wb') as f:
+        np.savez(f, **series)
+    os.replace(path+'.tmp', path)
+
+
+def series_path(series_directory, ticker):
+    return os.path.join(series_directory, ticker+'.npz')
+
+
+def load_series(series_directory, ticker):
+    with np.load(series_path(series_directory, ticker)) as data:
+        return {name:data[name] for name in data.files}
+
+
+'''
+Function Name: select_plot_tickers(results, top, rank_by, tickers)
+Purpose: Pick the tickers worth a plot: the best top rows of the results by rank_by, then the requested tickers
+Arguments: results: pandas DataFrame with a Ticker column, from backtestrunner.run_watchlist()
+           top: int, number of best tickers to plot, None for all of them
+           rank_by: String, the results column to rank by, best first
+           tickers: list of ticker symbols to plot whatever their rank
+Returns: list of ticker symbols, without repeats
+'''
+def select_plot_tickers(results, top=20, rank_by='Annual Ret', tickers=()):
+    ranked=results.sort_values(by=[rank_by], ascending=False, kind='stable', na_position='last')
+    selected=list(ranked['Ticker'] if top is None else ranked['Ticker'].head(top))
+    return list(dict.fromkeys(selected+list(tickers)))
+
+
+'''
+Function Name: render_plot(series_directory, plots_directory, ticker, dpi)
+Purpose: Draw the price with the fast SMA and the buy/sell fills above the portfolio equity and save it as
+         <plots_directory><ticker>.png. Runs in a PlotRenderer worker.
+Returns: dict summary row
+'''
+def render_plot(series_directory, plots_directory, ticker, dpi=200):
+    started=time.perf_counter()
+    try:
+        import matplotlib
+        matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        series=load_series(series_directory, ticker)
+        dates=series['datetime'].astype('datetime64[s]')
+        fill_dates=series['fill_datetime'].astype('datetime64[s]')
+        buys=series['fill_side'] > 0
+        figure, (top, bottom)=plt.subplots(2, 1, sharex=True, figsize=(12, 8), gridspec_kw={'height_ratios':[3, 1]})
+        top.plot(dates, series['close'], label=ticker, linewidth=0.8)
+        top.plot(dates, series['sma'], label='Fast SMA', linewidth=0.8)
+        top.scatter(fill_dates[buys], series['fill_price'][buys], marker='^', color='green', label='Buy', zorder=3)
+        top.scatter(fill_dates[~buys], series['fill_price'][~buys], marker='v', color='red', label='Sell', zorder=3)
+        top.legend(loc='upper left')
+        bottom.plot(dates, series['equity'], label='Portfolio', linewidth=0.8)
+        bottom.legend(loc='upper left')
+        figure.tight_layout()
+        figure.savefig(os.path.join(plots_directory, ticker+'.png'), dpi=dpi, format='png')
+        plt.close(figure)
+    except Exception:
+        return {'Ticker':ticker, 'Status':'Failed', 'Seconds':time.perf_counter()-started, 'Error':str(sys.exc_info()[0])}
+    return {'Ticker':ticker, 'Status':'OK', 'Seconds':time.perf_counter()-started, 'Error':''}
+
+
+class PlotRenderer(object):
+    #Renders plots in a background process pool. submit() returns at once,
+    #wait() blocks until the submitted plots are saved and returns their summary.
+
+    def __init__(self, series_directory, plots_directory, dpi=200, workers=None):
+        self.series_directory=series_directory
+        self.plots_directory=plots_directory
+        self.dpi=dpi
+        self.workers=workers
+        self.pool=None
+        self.futures=[]
+        if not os.path.exists(plots_directory):
+            os.makedirs(plots_directory)
+
+    def submit(self, tickers):
+        if self.pool is None:
+            self.pool=ProcessPoolExecutor(max_workers=self.workers)
+        for ticker in tickers:
+            self.futures.append(self.pool.submit(render_plot, self.series_directory, self.plots_directory, ticker, self.dpi))
+
+    def wait(self):
+        rows=[future.result() for future in self.futures]
+        self.futures=[]
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool=None
+        return pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.wait()
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+'''
+Builds coarser bar intervals from the finest bars already in the bar store (barstore.py), so a
+universe downloaded once at 1m or 5m can be backtested at 15m, 1h, 1d, 1wk... without more downloads.
+
+Bars are grouped into buckets in the exchange's local time. Intraday buckets start at the session
+open (09:30, 10:30... for 1h, like Yahoo's 60m bars) and bars outside the session are left out.
+Daily, weekly (starting Monday), monthly and quarterly buckets follow the local calendar. Each
+bucket gets the first open, highest high, lowest low, last close and adj close and the summed
+volume, and is stamped with its start time. The aggregation is a handful of NumPy reduceat calls
+per ticker.
+
+Derived intervals are written back to the store under their interval name with a derived.json
+describing their source, so ArrayBarFeed.addBarsFromStore() and backtestrunner read them like
+downloaded bars. They are rebuilt when the source bars are newer or the options changed.
+'''
+
+import os
+import sys
+import json
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+import barstore
+
+
+SESSION=('09:30', '16:00')  #Regular session in exchange local time, None keeps every bar
+CALENDAR_INTERVALS=['1d', '1wk', '1mo', '3mo']
+SUMMARY_COLUMNS=['Ticker', 'Status', 'Source', 'Rows', 'Cached', 'Error']
+
+
+def _seconds(clock):
+    hours, minutes=clock.split(':')
+    return int(hours)*3600+int(minutes)*60
+
+
+'''
+Function Name: bucket_starts(date_times, interval, session)
+Purpose: Return the start of the bucket each bar falls in and which bars are inside the session
+Arguments: date_times: int64 numpy array of epoch seconds in exchange local time
+           interval: String, the target interval, an intraday key of barstore.INTERVAL_SECONDS or CALENDAR_INTERVALS
+           session: (open, close) 'HH:MM' strings or None
+Returns: int64 numpy array of bucket starts, numpy bool array of the bars kept
+'''
+def bucket_starts(date_times, interval, session=SESSION):
+    day=date_times//86400
+    second=date_times-day*86400
+    keep=np.ones(len(date_times), dtype=bool)
+    open_second=0
+    if session is not None:
+        open_second=_seconds(session[0])
+        keep=(second >= open_second) & (second < _seconds(session[1]))
+    if interval=='1d':
+        return day*86400, keep
+    if interval=='1wk':
+        #1970-01-01 was a Thursday, Monday is 3 days earlier
+        return (day-(day+3)%7)*86400, keep
+    if interval in ('1mo', '3mo'):
+        months=date_times.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+        if interval=='3mo':
+            months=months-months%3
+        return months.astype('datetime64[M]').astype('datetime64[s]').astype(np.int64), keep
+    if interval not in barstore.INTERVAL_SECONDS or barstore.INTERVAL_SECONDS[interval] >= 86400:
+        raise ValueError("Can't resample to interval {}".format(interval))
+    spacing=barstore.INTERVAL_SECONDS[interval]
+    return day*86400+open_second+((second-open_second)//spacing)*spacing, keep
+
+
+'''
+Function Name: resample_bars(bars, interval, tz, session)
+Purpose: Aggregate bars into a coarser interval
+Arguments: bars: dict column name -> numpy array, as returned by barstore.load_bars()
+           interval: String, the target interval
+           tz: String or None. None when the stored times are already exchange local time (what the download
+               functions store), otherwise the stored times are UTC and tz is the exchange time zone, ex America/New_York
+           session: (open, close) 'HH:MM' strings in local time or None, bars outside it are left out
+Returns: dict column name -> numpy array of the coarser bars, datetime in the same convention as the input
+'''
+def resample_bars(bars, interval, tz=None, session=SESSION):
+    date_times=np.asarray(bars['datetime'], dtype=np.int64)
+    local=date_times
+    if tz is not None:
+        local=pd.to_datetime(date_times, unit='s', utc=True).tz_convert(tz).tz_localize(None)
+        local=local.to_numpy(dtype='datetime64[s]').astype(np.int64)
+    starts, keep=bucket_starts(local, interval, session)
+    rows=np.flatnonzero(keep)
+    starts=starts[rows]
+    if len(rows)==0:
+        return {column:np.empty(0, dtype=np.int64 if column=='datetime' else np.float64) for column in bars}
+    first=np.flatnonzero(np.concatenate(([True], starts[1:]!=starts[:-1])))
+    last=np.concatenate((first[1:], [len(rows)]))-1
+    labels=starts[first]
+    if tz is not None:
+        labels=pd.to_datetime(labels, unit='s').tz_localize(tz, ambiguous=True, nonexistent='shift_forward')
+        labels=labels.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[s]').astype(np.int64)
+    resampled={'datetime':labels}
+    for column, values in bars.items():
+        if column=='datetime':
+            continue
+        values=np.asarray(values, dtype=np.float64)[rows]
+        if column=='open':
+            resampled[column]=values[first]
+        elif column=='high':
+            resampled[column]=np.maximum.reduceat(values, first)
+        elif column=='low':
+            resampled[column]=np.minimum.reduceat(values, first)
+        elif column=='volume':
+            resampled[column]=np.add.reduceat(values, first)
+        else:
+            resampled[column]=values[last]
+    return resampled
+
+
+'''
+Function Name: finest_interval(store_directory, ticker, interval)
+Purpose: Find the finest interval stored for a ticker that is finer than the target interval
+Returns: String, None when there is no finer data
+'''
+def finest_interval(store_directory, ticker, interval):
+    target=barstore.INTERVAL_SECONDS[interval]
+    stored=[name for name in barstore.INTERVAL_SECONDS if barstore.INTERVAL_SECONDS[name] < target
+            and os.path.exists(os.path.join(barstore.ticker_directory(store_directory, name, ticker), 'datetime.npy'))]
+    return min(stored, key=lambda name: barstore.INTERVAL_SECONDS[name]) if stored else None
+
+
+def _derivation(source_interval, tz, session):
+    return {'source':source_interval, 'tz':tz, 'session':list(session) if session is not None else None}
+
+
+def _cached(store_directory, ticker, interval, derivation):
+    directory=barstore.ticker_directory(store_directory, interval, ticker)
+    try:
+        with open(os.path.join(directory, 'derived.json')) as f:
+            stored=json.load(f)
+        derived_time=os.path.getmtime(os.path.join(directory, 'datetime.npy'))
+        source_time=os.path.getmtime(os.path.join(barstore.ticker_directory(store_directory, derivation['source'], ticker),
+                                                  'datetime.npy'))
+    except (OSError, ValueError):
+        return False
+    return stored==derivation and derived_time >= source_time
+
+
+'''
+Function Name: resample_ticker(store_directory, ticker, interval, source_interval, tz, session, cache)
+Purpose: Build the bars of a ticker for interval from its finest stored bars, and store them under interval.
+         Bars stored under interval that were downloaded rather than derived are returned as they are.
+Arguments: store_directory: String, the root directory of the bar store
+           ticker: String, the ticker symbol
+           interval: String, the target interval
+           source_interval: String, the interval to build from, None for the finest one stored
+           tz, session: see resample_bars()
+           cache: bool, reuse the derived bars when they are up to date and write them back after building them
+Returns: dict summary row (see SUMMARY_COLUMNS)
+'''
+def resample_ticker(store_directory, ticker, interval, source_interval=None, tz=None, session=SESSION, cache=True):
+    row={'Ticker':ticker, 'Status':'ok', 'Source':source_interval, 'Rows':0, 'Cached':False, 'Error':''}
+    try:
+        directory=barstore.ticker_directory(store_directory, interval, ticker)
+        downloaded=os.path.exists(os.path.join(directory, 'datetime.npy')) and \
+            not os.path.exists(os.path.join(directory, 'derived.json'))
+        if downloaded and source_interval is None:
+            row.update({'Source':interval, 'Cached':True,
+                        'Rows':len(barstore.load_bars(store_directory, interval, ticker, columns=[])['datetime'])})
+            return row
+        if source_interval is None:
+            source_interval=finest_interval(store_directory, ticker, interval)
+            if source_interval is None:
+                raise IOError("No bars finer than {} stored for {}".format(interval, ticker))
+        row['Source']=source_interval
+        #Daily and coarser bars carry no time of day, the session does not apply to them
+        if barstore.INTERVAL_SECONDS[source_interval] >= 86400:
+            session=None
+        derivation=_derivation(source_interval, tz, session)
+        if cache and _cached(store_directory, ticker, interval, derivation):
+            row['Cached']=True
+            row['Rows']=len(barstore.load_bars(store_directory, interval, ticker, columns=[])['datetime'])
+            return row
+        resampled=resample_bars(barstore.load_bars(store_directory, source_interval, ticker), interval, tz, session)
+        row['Rows']=len(resampled['datetime'])
+        if cache:
+            barstore.write_arrays(store_directory, interval, ticker, resampled)
+            with open(os.path.join(directory, 'derived.json'), 'w') as f:
+                json.dump(derivation, f)
+    except Exception:
+        row['Status']='error'
+        row['Error']=str(sys.exc_info()[0])
+    return row
+
+
+'''
+Function Name: resample_store(store_directory, interval, tickers, source_interval, tz, session, workers)
+Purpose: Build interval for many tickers of the store at once, in worker processes
+Arguments: tickers: list of ticker symbols, None for every ticker stored at source_interval (or at any interval)
+           workers: int, the number of worker processes, None for one per core, 1 runs in this process
+           see resample_ticker() for the other arguments
+Returns: pandas DataFrame with one summary row per ticker
+'''
+def resample_store(store_directory, interval, tickers=None, source_interval=None, tz=None, session=SESSION, workers=None):
+    if tickers is None:
+        intervals=[source_interval] if source_interval else list(barstore.INTERVAL_SECONDS)
+        tickers=sorted({ticker for name in intervals for ticker in barstore.list_tickers(store_directory, name)})
+    count=len(tickers)
+    arguments=[[store_directory]*count, tickers, [interval]*count, [source_interval]*count, [tz]*count, [session]*count]
+    if workers==1:
+        rows=list(map(resample_ticker, *arguments))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            rows=list(pool.map(resample_ticker, *arguments, chunksize=8))
+    summary=pd.DataFrame(rows, columns=SUMMARY_COLUMNS)
+    print("Resampled {} of {} tickers to {}".format((summary['Status']=='ok').sum(), len(summary), interval))
+    return summary
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+'''
+Persistent cache of per ticker backtest results.
+
+A result is stored under a hash of everything it depends on: the ticker's data file(s)
+(size and modification time, or the file contents), the strategy class and its source code,
+and the run settings (nfast, risk, budget use, commission, initial budget...). Rerunning an
+unchanged watch list then only reads the cache, and only tickers with new data or changed
+settings are backtested again. A record is what backtestrunner.run_backtest() returns: the
+metrics row, with the P/L of every closed trade as a float array under 'Trades', and the error
+rows.
+
+Entries are pickle files in one directory. When the directory grows past max_bytes the least
+recently used entries are removed.
+'''
+
+import os
+import glob
+import pickle
+import hashlib
+import inspect
+import sma_9_strategy_backtest as sma_9
+import smarules
+
+
+#Settings that change the outcome of a backtest, see backtestrunner.DEFAULT_SETTINGS
+KEY_SETTINGS=['fast_period', 'initial_budget', 'budget_use', 'risk_percent', 'commission', 'frequency',
+              'store_interval']
+
+#Bump when the results rows change (new metrics...), cached and checkpointed results are then computed again
+RESULT_VERSION=4
+
+
+'''
+Function Name: strategy_fingerprint(strategy_class)
+Purpose: Identify a strategy implementation by its name and the hash of its source code and of the trading rules
+         it runs (smarules.py), so editing either invalidates the cached results
+Returns: String
+'''
+def strategy_fingerprint(strategy_class=sma_9.MovingAverageStrategy):
+    try:
+        source=inspect.getsource(strategy_class)+inspect.getsource(smarules)
+    except (IOError, TypeError):
+        source=''
+    return strategy_class.__module__+'.'+strategy_class.__name__+':'+hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+'''
+Function Name: data_files(ticker, settings)
+Purpose: Return the files a ticker's backtest reads: the column files in the bar store when
+         settings['store_directory'] is set, otherwise <data_directory><ticker>.csv
+Returns: list of paths
+'''
+def data_files(ticker, settings):
+    if settings.get('store_directory'):
+        directory=os.path.join(settings['store_directory'], settings.get('store_interval', '1d'), ticker)
+        return sorted(glob.glob(os.path.join(directory, '*.npy')))
+    return [settings['data_directory']+ticker+'.csv']
+
+
+'''
+Function Name: data_fingerprint(ticker, settings, use_contents)
+Purpose: Fingerprint the data a ticker's backtest reads. By default from the size and modification time of each
+         file, which costs one stat per file; use_contents hashes the bytes instead.
+Returns: String, None if the data files are missing
+'''
+def data_fingerprint(ticker, settings, use_contents=False):
+    digest=hashlib.sha256()
+    files=data_files(ticker, settings)
+    if not files:
+        return None
+    for path in files:
+        try:
+            info=os.stat(path)
+        except OSError:
+            return None
+        digest.update(os.path.basename(path).encode('utf-8'))
+        if use_contents:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+        else:
+            digest.update('{}:{}'.format(info.st_size, info.st_mtime_ns).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    #directory: where the cache entries are kept
+    #max_bytes: size bound of the directory, least recently used entries are evicted past it
+    #use_contents: fingerprint data files by content instead of size and modification time
+
+    def __init__(self, directory, max_bytes=256*2**20, use_contents=False, strategy_class=sma_9.MovingAverageStrategy):
+        self.directory=directory
+        self.max_bytes=max_bytes
+        self.use_contents=use_contents
+        self.strategy=strategy_fingerprint(strategy_class)
+        self.hits=0
+        self.misses=0
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def key(self, ticker, settings):
+        #None when the data is missing, such runs are never cached
+        data=data_fingerprint(ticker, settings, self.use_contents)
+        if data is None:
+            return None
+        parts=[ticker, data, self.strategy, str(RESULT_VERSION)]+['{}={!r}'.format(name, settings.get(name)) for name in KEY_SETTINGS]
+        return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            self.misses+=1
+            return None
+        path=os.path.join(self.directory, key+'.pkl')
+        try:
+            with open(path, 'rb') as f:
+                record=pickle.load(f)
+            #Mark as recently used for eviction
+            os.utime(path, None)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses+=1
+            return None
+        self.hits+=1
+        return record
+
+    def put(self, key, record):
+        if key is None:
+            return
+        path=os.path.join(self.directory, key+'.pkl')
+        with open(path+'.tmp', 'wb') as f:
+            pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path+'.tmp', path)
+
+    def evict(self):
+        entries=[]
+        for path in glob.glob(os.path.join(self.directory, '*.pkl')):
+            try:
+                info=os.stat(path)
+            except OSError:
+                continue
+            entries.append((info.st_mtime, info.st_size, path))
+        total=sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total-=size
+
+    def getStats(self):
+        return {'hits':self.hits, 'misses':self.misses}
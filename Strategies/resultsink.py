@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+'''
+Checkpointed results of a watch list run, streamed to a JSON lines file.
+
+Each finished ticker is appended as one line holding its results row and error rows, and the
+line is flushed to disk right away, so a run that stops at ticker 480 keeps the first 479.
+Lines carry a run id built from the settings and the fingerprint of the ticker's data files
+(resultcache.data_fingerprint); restarting the same run skips the tickers already in the file
+whose data has not changed since, so the tickers updated after a run are backtested again. A
+ticker written twice keeps its last line, and report() builds the
+sorted results and errors tables from the file in one pass, aggregate() the universe metrics.
+'''
+
+import os
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+import backtestrunner
+import resultcache
+import streamanalyzer
+
+
+'''
+Function Name: make_run_id(settings)
+Purpose: Identify a run by the data it reads, the strategy code and the settings that change its results
+Returns: String
+'''
+def make_run_id(settings):
+    settings=dict(backtestrunner.DEFAULT_SETTINGS, **settings)
+    parts=[resultcache.strategy_fingerprint(), str(resultcache.RESULT_VERSION), str(settings.get('data_directory')),
+           str(settings.get('store_directory'))]
+    parts+=['{}={!r}'.format(name, settings.get(name)) for name in resultcache.KEY_SETTINGS]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def _to_json(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, streamanalyzer.MetricAggregate):
+        return value.getState()
+    raise TypeError('{} is not JSON serializable'.format(type(value)))
+
+
+class ResultSink(object):
+    #path: the JSON lines file, created if missing
+    #run_id: lines of other runs in the same file are ignored, see make_run_id()
+    #sync: fsync every line so it survives a crash of the machine, not only of the process
+
+    def __init__(self, path, run_id, sync=True):
+        self.path=path
+        self.run_id=run_id
+        self.sync=sync
+        directory=os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.__dropPartialLine()
+        self.file=open(path, 'a')
+
+    def __dropPartialLine(self):
+        #A line cut short by a crash is removed, its ticker runs again
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb+') as f:
+            end=f.seek(0, os.SEEK_END)
+            position=end
+            while position > 0:
+                step=min(4096, position)
+                f.seek(position-step)
+                block=f.read(step)
+                newline=block.rfind(b'\n')
+                if newline >= 0:
+                    position=position-step+newline+1
+                    break
+                position-=step
+            if position!=end:
+                f.truncate(position)
+
+    def write(self, ticker, record, fingerprint=None):
+        #fingerprint: resultcache.data_fingerprint() of the data the record was computed from
+        result, errors=record
+        if result is not None:
+            #The trades array stays in the result cache, the line holds the metrics row
+            result={key:value for key, value in result.items() if key!='Trades'}
+        line={'Run':self.run_id, 'Ticker':ticker, 'Data':fingerprint, 'Result':result, 'Errors':errors}
+        self.file.write(json.dumps(line, default=_to_json)+'\n')
+        self.file.flush()
+        if self.sync:
+            os.fsync(self.file.fileno())
+
+    def read(self):
+        #Lines of this run, last line per ticker
+        if os.path.getsize(self.path)==0:
+            return pd.DataFrame(columns=['Run', 'Ticker', 'Data', 'Result', 'Errors'])
+        lines=pd.read_json(self.path, lines=True, dtype=False, precise_float=True)
+        if 'Data' not in lines:
+            lines['Data']=None
+        lines=lines[lines['Run']==self.run_id]
+        return lines.drop_duplicates(subset=['Ticker'], keep='last')
+
+    def completed(self, fingerprints):
+        return set(self.records(fingerprints))
+
+    def records(self, fingerprints):
+        #ticker -> (result, errors) records, as returned by backtestrunner.run_backtest(), of the tickers whose line
+        #was written with their current fingerprint in fingerprints (ticker -> resultcache.data_fingerprint())
+        lines=self.read()
+        return {ticker:(result if isinstance(result, dict) else None, errors)
+                for ticker, data, result, errors in zip(lines['Ticker'], lines['Data'], lines['Result'], lines['Errors'])
+                if data is not None and data==fingerprints.get(ticker)}
+
+    def report(self, rank_by='Annual Ret'):
+        lines=self.read()
+        results=pd.DataFrame([result for result in lines['Result'] if isinstance(result, dict)],
+                             columns=backtestrunner.RESULT_COLUMNS)
+        errors=pd.DataFrame([error for rows in lines['Errors'] for error in rows], columns=backtestrunner.ERROR_COLUMNS)
+        results=results.sort_values(by=[rank_by], ascending=False, kind='stable', na_position='last')
+        return results.reset_index(drop=True), errors
+
+    def aggregate(self, tickers=None):
+        #streamanalyzer.MetricAggregate of the tickers' runs (all the tickers in the file when None)
+        lines=self.read()
+        states=[result['Metrics'] for ticker, result in zip(lines['Ticker'], lines['Result'])
+                if isinstance(result, dict) and isinstance(result.get('Metrics'), dict)
+                and (tickers is None or ticker in tickers)]
+        return streamanalyzer.merge_aggregates(states)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
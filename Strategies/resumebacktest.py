@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+'''
+Incremental SMA backtests that continue from a snapshot of the previous run instead of
+replaying the whole history when a few bars were appended.
+
+PyAlgoTrade strategies, brokers and analyzers are tied together by event subscriptions and
+cannot be pickled, so the end state of a run is kept explicitly in SMAState: the broker's cash,
+shares held, entry price and the orders waiting for the next bar, the smarules.SMARules of the
+strategy (the rules MovingAverageStrategy runs, with its position and stop), the last nfast closes
+of the SMA window, and the accumulators behind the Returns, SharpeRatio and Trades metrics. Orders fill like in vectorbacktest.py, which
+reproduces the event driven runs, so a resumed run gives the metrics of a full replay.
+
+A snapshot stores the settings key and a hash of the bars it has processed. The key includes
+resultcache.strategy_fingerprint() and the source of this module, so editing the strategy, the
+rules or the fills here invalidates the snapshots. A snapshot is thrown away, and the ticker
+replayed from the start, when the key changed or when any of those bars changed in the
+ticker's history.
+'''
+
+import os
+import sys
+import math
+import pickle
+import hashlib
+import functools
+import inspect
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import backtestrunner
+import paramsweep
+import resultcache
+import smarules
+
+
+#Bump when the state layout changes, older snapshots are then ignored. Code changes are caught by settings_key().
+SNAPSHOT_VERSION=4
+
+
+class SMAState(object):
+    #End state of an SMA backtest on one ticker, see the module docstring
+
+    def __init__(self, nfast, initial_budget, budget_use, risk_percent, commission):
+        self.nfast=nfast
+        self.initial_budget=float(initial_budget)
+        self.commission=commission
+        #Broker
+        self.cash=float(initial_budget)
+        self.shares=0
+        self.entry_price=0.0
+        #Orders decided on the last bar, filled at the next bar's open: shares to buy, and whether to sell
+        self.entry_order=0
+        self.exit_order=False
+        #Strategy
+        self.rules=smarules.SMARules(budget_use, risk_percent)
+        self.window=deque(maxlen=nfast)
+        #Returns analyzer: equity after the last bar's fills, and the highest equity for the drawdown
+        self.equity=float(initial_budget)
+        self.peak=float(initial_budget)
+        self.max_drawdown=0.0
+        #SharpeRatio analyzer: returns compounded per day, Welford accumulators of the completed days
+        self.day=None
+        self.day_growth=1.0
+        self.days=0
+        self.mean=0.0
+        self.m2=0.0
+        #Trades analyzer
+        self.trades=[]
+        #Number of bars of the ticker's history processed
+        self.bars=0
+        self.last_close=None
+
+    def update(self, date_times, open_, close):
+        #Process new bars, in order, after the ones already seen
+        window=self.window
+        for date_time, bar_open, bar_close in zip(date_times.tolist(), open_.tolist(), close.tolist()):
+            #The broker fills the orders of the previous bar at this bar's open, with the cash check of
+            #smarules.fill_cash like vectorbacktest.py: an entry it cannot pay for stays pending
+            if self.exit_order:
+                self.cash=smarules.fill_cash(-self.shares, bar_open, self.cash, self.commission)
+                self.trades.append(self.shares*(bar_open-self.entry_price)-2*self.commission)
+                self.shares=0
+                self.exit_order=False
+            elif self.entry_order:
+                cash=smarules.fill_cash(self.entry_order, bar_open, self.cash, self.commission)
+                if cash >= 0:
+                    self.cash=cash
+                    self.shares=self.entry_order
+                    self.entry_price=bar_open
+                    self.entry_order=0
+            #The analyzers see the portfolio after this bar's fills
+            equity=self.cash+self.shares*bar_close
+            day=date_time//86400
+            if day!=self.day:
+                if self.day is not None:
+                    self.__closeDay()
+                self.day=day
+            self.day_growth*=equity/self.equity
+            self.equity=equity
+            if equity > self.peak:
+                self.peak=equity
+            else:
+                self.max_drawdown=max(self.max_drawdown, 1-equity/self.peak)
+            self.last_close=bar_close
+            window.append(bar_close)
+            if len(window) < self.nfast:
+                continue
+            shares=self.rules.onBar(sum(window)/self.nfast, bar_close, self.cash)
+            if shares > 0:
+                self.entry_order=shares
+            elif shares < 0 and self.entry_order:
+                #The exit cancels an entry that did not fill
+                self.entry_order=0
+            elif shares < 0:
+                self.exit_order=True
+        self.bars+=len(date_times)
+
+    def __closeDay(self):
+        daily=self.day_growth-1
+        self.days+=1
+        delta=daily-self.mean
+        self.mean+=delta/self.days
+        self.m2+=delta*(daily-self.mean)
+        self.day_growth=1.0
+
+    def getSharpeRatio(self):
+        #Includes the current day without closing it
+        days, mean, m2=self.days, self.mean, self.m2
+        if self.day is not None:
+            daily=self.day_growth-1
+            days+=1
+            delta=daily-mean
+            mean+=delta/days
+            m2+=delta*(daily-mean)
+        if days < 2:
+            return float('nan')
+        volatility=math.sqrt(m2/(days-1))
+        if volatility==0:
+            return 0.0
+        return mean/volatility*math.sqrt(252)
+
+    def getResult(self, ticker):
+        trades=np.array(self.trades)
+        final_equity=self.cash+self.shares*self.last_close if self.last_close is not None else self.initial_budget
+        return {'Ticker':ticker, 'Initial Equity':self.initial_budget, 'Net P/L':trades.sum(),
+                'Annualized Sharpe':self.getSharpeRatio(), 'Trades Made':len(trades),
+                'Avg P/L':trades.mean() if len(trades) else float('nan'),
+                'Max Profit':trades.max() if len(trades) else float('nan'),
+                'Max Loss':trades.min() if len(trades) else float('nan'),
+                'Annual Ret':(self.equity/self.initial_budget-1)*100,
+                'Final Equity':final_equity, 'Max Drawdown':self.max_drawdown*100, 'Trades':trades}
+
+
+'''
+Function Name: settings_key(settings)
+Purpose: Identify the settings a snapshot was made with and the code it was made by
+Returns: String
+'''
+def settings_key(settings):
+    parts=[str(SNAPSHOT_VERSION), _code_fingerprint()]
+    parts+=['{}={!r}'.format(name, settings.get(name)) for name in resultcache.KEY_SETTINGS]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _code_fingerprint():
+    #The strategy and its rules, and the fills and metrics of this module
+    source=inspect.getsource(sys.modules[__name__])
+    return resultcache.strategy_fingerprint()+':'+hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def _prefix_digest(bars, count):
+    digest=hashlib.sha256()
+    digest.update(np.ascontiguousarray(bars['datetime'][:count], dtype=np.int64).tobytes())
+    digest.update(np.ascontiguousarray(bars['open'][:count], dtype=np.float64).tobytes())
+    digest.update(np.ascontiguousarray(bars['close'][:count], dtype=np.float64).tobytes())
+    return digest.hexdigest()
+
+
+'''
+Function Name: load_snapshot(snapshot_directory, ticker, settings, bars)
+Purpose: Load the snapshot of a ticker if it is still valid for these settings and this history
+Returns: (SMAState or None, String reason when it cannot be used)
+'''
+def load_snapshot(snapshot_directory, ticker, settings, bars):
+    path=os.path.join(snapshot_directory, ticker+'.pkl')
+    if not os.path.exists(path):
+        return None, 'no snapshot'
+    try:
+        with open(path, 'rb') as f:
+            key, digest, state=pickle.load(f)
+    except Exception:
+        return None, 'unreadable snapshot'
+    if key!=settings_key(settings):
+        return None, 'settings changed'
+    if state.bars > len(bars['datetime']) or _prefix_digest(bars, state.bars)!=digest:
+        return None, 'history changed'
+    return state, ''
+
+
+def save_snapshot(snapshot_directory, ticker, settings, bars, state):
+    if not os.path.exists(snapshot_directory):
+        os.makedirs(snapshot_directory)
+    path=os.path.join(snapshot_directory, ticker+'.pkl')
+    with open(path+'.tmp', 'wb') as f:
+        pickle.dump((settings_key(settings), _prefix_digest(bars, state.bars), state), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path+'.tmp', path)
+
+
+'''
+Function Name: run_incremental(ticker, settings, snapshot_directory)
+Purpose: Backtest one ticker from its snapshot, processing only the bars added since, or from the start when there
+         is no valid snapshot, then save the new snapshot. Runs in a worker process.
+Arguments: ticker: String, the ticker symbol
+           settings: dict, see backtestrunner.DEFAULT_SETTINGS
+           snapshot_directory: String, where the snapshots are kept, one file per ticker
+Returns: dict results row (None on failure, with a 'Bars Processed' and a 'Resumed' entry), list of error row dicts
+'''
+def run_incremental(ticker, settings, snapshot_directory):
+    settings=dict(backtestrunner.DEFAULT_SETTINGS, **settings)
+    try:
+        bars=paramsweep.load_arrays(ticker, settings)
+    except Exception:
+        return None, [{'Ticker':ticker,'Section':'Feed','Error':str(sys.exc_info()[0])}]
+    state, _=load_snapshot(snapshot_directory, ticker, settings, bars)
+    resumed=state is not None
+    if state is None:
+        state=SMAState(settings['fast_period'], settings['initial_budget'], settings['budget_use'],
+                       settings['risk_percent'], settings['commission'])
+    start=state.bars
+    try:
+        state.update(np.asarray(bars['datetime'][start:]), np.asarray(bars['open'][start:]), np.asarray(bars['close'][start:]))
+    except Exception:
+        return None, [{'Ticker':ticker,'Section':'Trades','Error':str(sys.exc_info()[0])}]
+    try:
+        save_snapshot(snapshot_directory, ticker, settings, bars, state)
+    except Exception:
+        errors=[{'Ticker':ticker,'Section':'Snapshot','Error':str(sys.exc_info()[0])}]
+    else:
+        errors=[]
+    result=state.getResult(ticker)
+    result['Bars Processed']=state.bars-start
+    result['Resumed']=resumed
+    return result, errors
+
+
+'''
+Function Name: run_watchlist_incremental(tickers, settings, snapshot_directory, workers)
+Purpose: run_incremental() for every ticker of a watch list, over a process pool like backtestrunner.run_watchlist()
+Returns: pandas DataFrame results, pandas DataFrame errors, both in watch list order
+'''
+def run_watchlist_incremental(tickers, settings, snapshot_directory, workers=None):
+    tickers=list(dict.fromkeys(tickers))
+    if workers==1:
+        records=[run_incremental(ticker, settings, snapshot_directory) for ticker in tickers]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            records=list(pool.map(run_incremental, tickers, [settings]*len(tickers),
+                                  [snapshot_directory]*len(tickers), chunksize=4))
+    processed=sum(result['Bars Processed'] for result, _ in records if result is not None)
+    resumed=sum(1 for result, _ in records if result is not None and result['Resumed'])
+    print("Processed {} bars, {} of {} tickers resumed from a snapshot".format(processed, resumed, len(tickers)))
+    return backtestrunner.merge_records(records)
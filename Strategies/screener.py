@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+'''
+Cross-sectional screen of the watch list: which tickers are above their fast SMA on the last
+bar, which just crossed it, how steep the SMA is and where MovingAverageStrategy would put the
+stop, without backtesting anything.
+
+The closes of every ticker are loaded into one tickers x bars matrix aligned on the union of the
+timestamps, NaN where a ticker has no bar (gaps, or before it was listed). Each row's valid
+closes are then packed to the right, so the SMA, like the strategy's, runs over the ticker's own
+last nfast bars whatever its gaps, and every metric is computed for all the tickers at once
+with NumPy. Loading from the bar store (barstore.py) reads only the tail of two memory-mapped
+columns per ticker.
+'''
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+import barstore
+
+
+SIGNAL_COLUMNS=['Rank', 'Ticker', 'Date', 'Close', 'SMA', 'SMA Distance %', 'Signal', 'Cross', 'Slope', 'Slope %',
+                'Shares', 'Stop', 'Stop Distance %', 'Bars', 'Stale']
+
+
+'''
+Function Name: load_close_matrix(tickers, settings, bars)
+Purpose: Load the last closes of every ticker into one matrix aligned on the union of their timestamps
+Arguments: tickers: list of ticker symbol strings
+           settings: dict, read from settings['store_directory'] and settings['store_interval'] when a store is set,
+                     otherwise from <settings['data_directory']><ticker>.csv (see backtestrunner.DEFAULT_SETTINGS)
+           bars: int, the number of timestamps kept, the most recent ones
+Returns: list of the tickers loaded, int64 numpy array of the timestamps (epoch seconds), float numpy matrix
+         tickers x timestamps of closes with NaN for missing bars, list of error row dicts
+'''
+def load_close_matrix(tickers, settings, bars=60):
+    loaded=[]
+    date_times=[]
+    closes=[]
+    errors=[]
+    for ticker in dict.fromkeys(tickers):
+        try:
+            if settings.get('store_directory'):
+                data=barstore.load_bars(settings['store_directory'], settings.get('store_interval', '1d'), ticker,
+                                        columns=['close'])
+                ticker_times, close=data['datetime'][-bars:], data['close'][-bars:]
+            else:
+                import tickerdatautil as td
+                df=td.read_ticker_csv(settings['data_directory']+ticker+'.csv').tail(bars)
+                ticker_times=df['Date Time'].to_numpy(dtype='datetime64[s]').astype(np.int64)
+                close=df['Close'].to_numpy(dtype=np.float64)
+        except Exception:
+            errors.append({'Ticker':ticker,'Section':'Feed','Error':str(sys.exc_info()[0])})
+            continue
+        loaded.append(ticker)
+        date_times.append(np.asarray(ticker_times, dtype=np.int64))
+        closes.append(np.asarray(close, dtype=np.float64))
+    if not loaded:
+        return loaded, np.empty(0, dtype=np.int64), np.empty((0, 0)), errors
+    rows=np.repeat(np.arange(len(loaded)), [len(values) for values in date_times])
+    date_times=np.concatenate(date_times)
+    closes=np.concatenate(closes)
+    columns=np.unique(date_times)[-bars:]
+    kept=date_times >= columns[0]
+    matrix=np.full((len(loaded), len(columns)), np.nan)
+    matrix[rows[kept], np.searchsorted(columns, date_times[kept])]=closes[kept]
+    #Bad prices are treated like missing bars
+    matrix[~(matrix > 0)]=np.nan
+    return loaded, columns, matrix, errors
+
+
+'''
+Function Name: pack_right(matrix)
+Purpose: Move the valid values of each row to the right end, keeping their order, NaN on the left
+Returns: numpy matrix, numpy array of the number of valid values per row
+'''
+def pack_right(matrix):
+    valid=~np.isnan(matrix)
+    order=np.argsort(valid, axis=1, kind='stable')
+    return np.take_along_axis(matrix, order, axis=1), valid.sum(axis=1)
+
+
+'''
+Function Name: screen(tickers, date_times, matrix, nfast, slope_period, initial_budget, budget_use, risk_percent)
+Purpose: Compute the signals of every ticker on its last bar, in one vectorized pass over the close matrix
+Arguments: tickers, date_times, matrix: as returned by load_close_matrix()
+           nfast: int, the SMA period
+           slope_period: int, the number of SMA values the slope is fitted over, like indicators.Slope
+           initial_budget, budget_use, risk_percent: size an entry and its stop like MovingAverageStrategy with the
+                                                     cash at initial_budget
+Returns: pandas DataFrame of SIGNAL_COLUMNS without Rank, one row per ticker in the order given.
+         Signal is 'buy' when the close is above the SMA and 'sell' when below, '' without nfast bars.
+         Cross is 'up' or 'down' when the close crossed the SMA on the last bar.
+'''
+def screen(tickers, date_times, matrix, nfast=9, slope_period=2, initial_budget=1600, budget_use=0.5, risk_percent=2):
+    count=len(tickers)
+    packed, valid=pack_right(matrix)
+    steps=max(slope_period, 2)
+    if packed.shape[1] < steps:
+        #Fewer bars than the signals look at, the missing ones are NaN like the bars before a listing
+        packed=np.concatenate((np.full((count, steps-packed.shape[1]), np.nan), packed), axis=1)
+    width=packed.shape[1]
+    #SMA of the last steps bars of each row from running sums, NaN where a row has fewer than nfast bars up to it
+    sums=np.concatenate((np.zeros((count, 1)), np.cumsum(np.nan_to_num(packed), axis=1)), axis=1)
+    ends=np.arange(width-steps+1, width+1)
+    starts=ends-nfast
+    sma=np.full((count, steps), np.nan)
+    usable=starts >= 0
+    sma[:, usable]=(sums[:, ends[usable]]-sums[:, starts[usable]])/nfast
+    sma[valid[:, None] < nfast+np.arange(steps-1, -1, -1)[None, :]]=np.nan
+    close=packed[:, -steps:]
+
+    last_close=close[:, -1]
+    last_sma=sma[:, -1]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        above=last_close > last_sma
+        below=last_close < last_sma
+        was_above=close[:, -2] > sma[:, -2]
+        ready=~np.isnan(last_sma)
+        prior=~np.isnan(sma[:, -2])
+        signal=np.where(ready & above, 'buy', np.where(ready & below, 'sell', ''))
+        cross=np.where(prior & ready & ~was_above & above, 'up', np.where(prior & ready & was_above & ~above, 'down', ''))
+
+        #Least squares slope of the last slope_period SMA values against their position, per bar
+        x=np.arange(slope_period, dtype=np.float64)
+        x-=x.mean()
+        window=sma[:, -slope_period:]
+        slope=((window-window.mean(axis=1, keepdims=True))*x).sum(axis=1)/(x*x).sum()
+
+        equity_use=initial_budget*budget_use
+        shares=np.floor(equity_use/last_close)
+        stop=np.where(shares >= 1, last_close-risk_percent*equity_use*.01/shares, np.nan)
+
+        distance=(last_close/last_sma-1)*100
+        slope_percent=slope/last_sma*100
+        stop_distance=(last_close-stop)/last_close*100
+
+    #Date of each ticker's last bar, its position in the aligned matrix
+    has_bars=valid > 0
+    last_column=matrix.shape[1]-1-np.argmax(~np.isnan(matrix[:, ::-1]), axis=1) if matrix.shape[1] else valid
+    last_time=np.where(has_bars, date_times[last_column] if len(date_times) else 0, 0)
+    dates=pd.to_datetime(np.where(has_bars, last_time, np.iinfo(np.int64).min).astype('datetime64[s]'))
+    return pd.DataFrame({'Ticker':tickers, 'Date':dates, 'Close':last_close, 'SMA':last_sma, 'SMA Distance %':distance,
+                         'Signal':signal, 'Cross':cross, 'Slope':slope, 'Slope %':slope_percent,
+                         'Shares':np.nan_to_num(shares).astype(np.int64), 'Stop':stop, 'Stop Distance %':stop_distance,
+                         'Bars':valid, 'Stale':has_bars & (last_time < (date_times[-1] if len(date_times) else 0))},
+                        columns=SIGNAL_COLUMNS[1:])
+
+
+'''
+Function Name: rank_signals(signals, rank_by, ascending)
+Purpose: Sort the signal table, the fresh upward crosses first, then by rank_by, and number the rows
+Returns: pandas DataFrame with a Rank column
+'''
+def rank_signals(signals, rank_by='SMA Distance %', ascending=False):
+    order=signals.assign(_fresh=signals['Cross']!='up')
+    order=order.sort_values(by=['_fresh', rank_by], ascending=[True, ascending], kind='stable', na_position='last')
+    ranked=order.drop(columns=['_fresh']).reset_index(drop=True)
+    ranked.insert(0, 'Rank', np.arange(1, len(ranked)+1))
+    return ranked
+
+
+'''
+Function Name: run_screen(tickers, settings, slope_period, bars, rank_by)
+Purpose: Load the universe and screen it with the settings of the backtests
+Arguments: tickers: list of ticker symbol strings
+           settings: dict, see backtestrunner.DEFAULT_SETTINGS (fast_period, initial_budget, budget_use, risk_percent
+                     and the data location)
+           slope_period: int, see screen()
+           bars: int, the number of most recent bars loaded, None for enough for the SMA and slope with room for gaps
+           rank_by: String, the column the signals are ranked by, best (largest) first
+Returns: pandas DataFrame ranked signals, pandas DataFrame errors
+'''
+def run_screen(tickers, settings, slope_period=2, bars=None, rank_by='SMA Distance %'):
+    nfast=settings.get('fast_period', 9)
+    started=time.perf_counter()
+    loaded, date_times, matrix, errors=load_close_matrix(tickers, settings, bars or 2*(nfast+slope_period))
+    signals=screen(loaded, date_times, matrix, nfast, slope_period, settings.get('initial_budget', 1600),
+                   settings.get('budget_use', 0.5), settings.get('risk_percent', 2))
+    ranked=rank_signals(signals, rank_by)
+    print("Screened {} tickers in {:.3f} s: {} above the SMA, {} crossed up, {} crossed down".format(
+        len(ranked), time.perf_counter()-started, int((ranked['Signal']=='buy').sum()),
+        int((ranked['Cross']=='up').sum()), int((ranked['Cross']=='down').sum())))
+    return ranked, pd.DataFrame(errors, columns=['Ticker', 'Section', 'Error'])
@@ -1,11 +1,15 @@
 import pyalgotrade.strategy as strategy
 import pyalgotrade.technical.ma as ma
+import indicators
+import smarules
+import numpy as np
 
 #moving average model
+#Orders fill at the next bar's open, the broker processes each bar before onBars like any BacktestingStrategy.
 class MovingAverageStrategy(strategy.BacktestingStrategy):
 
-    def __init__(self,feed,instrument,nfast):
-        super(MovingAverageStrategy,self).__init__(feed)
+    def __init__(self,feed,instrument,nfast,initialBudget=1000000):
+        super(MovingAverageStrategy,self).__init__(feed,initialBudget)
         self.feed=feed
         #we can track the position: long or short positions
         #if it is None we know we can open one
@@ -14,26 +18,51 @@ class MovingAverageStrategy(strategy.BacktestingStrategy):
         self.instrument = instrument
         #fast moving average indicator (short-term trend) period is smaller
         self.fastMA = ma.SMA(feed[instrument].getPriceDataSeries(),nfast)
-        self.stop_loss=0
-        self.fill_price=0
-        self.risk_percent=2
-        self.BUDGET_USE=0
+        #entry, exit and stop rules, shared with the other engines (see smarules.py)
+        self.rules=smarules.SMARules()
         self.INITIAL_BUDGET=0
         self.printInfo=False
         self.fastMASlope=0
+        #slope of the fast MA, updated in constant time per bar
+        self.fastMASlopeIndicator=indicators.Slope(2)
         
         
+    #the stop, entry price and sizing settings live in self.rules, read through these
+    @property
+    def stop_loss(self):
+        return self.rules.stop_loss
+
+    @property
+    def fill_price(self):
+        return self.rules.fill_price
+
+    @property
+    def risk_percent(self):
+        return self.rules.risk_percent
+
+    @property
+    def BUDGET_USE(self):
+        return self.rules.budget_use
+
     def getFastMA(self):
         return self.fastMA
     
+    def getFastMASlope(self):
+        return self.fastMASlope
+    
+    def setSlopePeriod(self,period):
+        #number of fast MA values the slope is fitted over
+        self.fastMASlopeIndicator=indicators.Slope(period)
+    
     def initBackTestStrategy(self,initialBudget):
-        strategy.BacktestingStrategy.__init__(self, self.feed, initialBudget)
+        #set the starting cash before the run, on the broker created with the strategy
+        self.getBroker().setCash(initialBudget)
         
     def setBudgetUse(self,budgetUse):
-        self.BUDGET_USE=budgetUse
+        self.rules.budget_use=budgetUse
     
     def setRiskPercent(self,risk_percent):
-        self.risk_percent=risk_percent
+        self.rules.risk_percent=risk_percent
         
     def setInfoOutput(self,printInfo):
         self.printInfo=printInfo
@@ -44,24 +73,18 @@ class MovingAverageStrategy(strategy.BacktestingStrategy):
     #when fast < slow MA -> close the long position
     def onBars(self,bars):
         bar = bars[self.instrument]
-        equity = self.getBroker().getCash()
-        equity_use = equity*self.BUDGET_USE
-        max_risk=self.risk_percent*equity_use*.01
         #MA with period p needs p previous values ... if not available then return (for the first p-1 bars the value is NULL)
         
         if self.fastMA[-1] is None:
             return
-        #if we have not opened a long position so far then we open one
-        if self.position is None:
-            #When Price Action is above sma 9 buy, else sell
-            if self.fastMA[-1] < bar.getPrice():
-                shares=int(equity_use//bar.getPrice())
-                risk_per_share = max_risk/shares
-                self.stop_loss=bar.getPrice()-risk_per_share
-                self.fill_price=bar.getPrice()
-                self.position = self.enterLong(self.instrument,shares,True)
-        
-        elif self.fastMA[-1] >  bar.getPrice() or bar.getPrice()<=self.stop_loss:
+        slope=self.fastMASlopeIndicator.update(self.fastMA[-1])
+        if slope is not None:
+            self.fastMASlope=slope
+        #When Price Action is above sma 9 buy, when below it or at the stop sell
+        shares=self.rules.onBar(self.fastMA[-1],bar.getPrice(),self.getBroker().getCash())
+        if shares>0:
+            self.position = self.enterLong(self.instrument,shares,True)
+        elif shares<0:
             #exit the long position
             self.position.exitMarket()
             self.position = None
@@ -82,4 +105,110 @@ class MovingAverageStrategy(strategy.BacktestingStrategy):
         if self.printInfo:
             trade_info = position.getExitOrder().getExecutionInfo()
             self.info("Sell stock at $%.2f"%(trade_info.getPrice()))
-    
+
+
+#portfolio version of the moving average model
+#every instrument of the feed trades the same rules as MovingAverageStrategy in one event loop (the entries
+#sized by smarules.size_entry, the exits tested on all the instruments at once),
+#buying with BUDGET_USE of the shared cash. The SMA and stop state of all instruments live in arrays.
+#Orders fill at the next bar's open, the broker processes each bar before onBars like any BacktestingStrategy.
+class PortfolioMovingAverageStrategy(strategy.BacktestingStrategy):
+
+    def __init__(self,feed,instruments,nfast,initialBudget):
+        super(PortfolioMovingAverageStrategy,self).__init__(feed,initialBudget)
+        self.instruments=list(instruments)
+        self.index={instrument:i for i,instrument in enumerate(self.instruments)}
+        count=len(self.instruments)
+        self.nfast=nfast
+        #last nfast prices of each instrument, as rows of ring buffers
+        self.prices=np.zeros((count,nfast))
+        self.priceCount=np.zeros(count,dtype=np.int64)
+        self.priceSum=np.zeros(count)
+        self.fastMA=np.full(count,np.nan)
+        self.holding=np.zeros(count,dtype=bool)
+        self.stop_loss=np.zeros(count)
+        self.fill_price=np.zeros(count)
+        self.positions=[None]*count
+        #closed trades and their P/L per instrument
+        self.tradeCount=np.zeros(count,dtype=np.int64)
+        self.tradePnL=np.zeros(count)
+        self.risk_percent=2
+        self.BUDGET_USE=0
+        self.printInfo=False
+
+    def getFastMA(self):
+        return self.fastMA
+
+    def setBudgetUse(self,budgetUse):
+        self.BUDGET_USE=budgetUse
+
+    def setRiskPercent(self,risk_percent):
+        self.risk_percent=risk_percent
+
+    def setInfoOutput(self,printInfo):
+        self.printInfo=printInfo
+
+    def getTradeStats(self):
+        #instrument -> (closed trades, net P/L)
+        return {instrument:(int(self.tradeCount[i]),float(self.tradePnL[i])) for i,instrument in enumerate(self.instruments)}
+
+    def updateFastMA(self,rows,price):
+        #push the new prices into the ring buffers of the instruments in rows
+        slot=self.priceCount[rows]%self.nfast
+        full=self.priceCount[rows]>=self.nfast
+        self.priceSum[rows]+=price-np.where(full,self.prices[rows,slot],0.0)
+        self.prices[rows,slot]=price
+        self.priceCount[rows]+=1
+        resum=rows[self.priceCount[rows]%indicators.RESUM_INTERVAL==0]
+        if len(resum):
+            self.priceSum[resum]=self.prices[resum].sum(axis=1)
+        ready=self.priceCount[rows]>=self.nfast
+        self.fastMA[rows]=np.where(ready,self.priceSum[rows]/self.nfast,np.nan)
+
+    def onBars(self,bars):
+        instruments=bars.getInstruments()
+        rows=np.fromiter((self.index[instrument] for instrument in instruments),dtype=np.int64,count=len(instruments))
+        price=np.fromiter((bars.getBar(instrument).getPrice() for instrument in instruments),dtype=np.float64,count=len(instruments))
+        self.updateFastMA(rows,price)
+        sma=self.fastMA[rows]
+        ready=~np.isnan(sma)
+        holding=self.holding[rows]
+
+        exits=ready&holding&((sma>price)|(price<=self.stop_loss[rows]))
+        for i in rows[exits]:
+            self.positions[i].exitMarket()
+            self.positions[i]=None
+            self.holding[i]=False
+
+        #entries share the cash left after the orders already placed on this bar
+        cash=self.getBroker().getCash()
+        for k in np.flatnonzero(ready&~holding&(sma<price)):
+            i=rows[k]
+            if cash*self.BUDGET_USE<price[k]:
+                continue
+            shares,self.stop_loss[i]=smarules.size_entry(price[k],cash,self.BUDGET_USE,self.risk_percent)
+            self.fill_price[i]=price[k]
+            self.positions[i]=self.enterLong(self.instruments[i],shares,True)
+            self.holding[i]=True
+            cash-=shares*price[k]
+
+    def onEnterCanceled(self,position):
+        #an exit signal came before the entry filled (a GTC entry without the cash for it stays pending and fills
+        #at a later open), the instrument can enter again
+        i=self.index[position.getInstrument()]
+        if self.positions[i] is position:
+            self.positions[i]=None
+            self.holding[i]=False
+
+    def onEnterOk(self,position):
+        if self.printInfo:
+            trade_info = position.getEntryOrder().getExecutionInfo()
+            self.info("Buy %s at $%.2f"%(position.getInstrument(),trade_info.getPrice()))
+
+    def onExitOk(self,position):
+        i=self.index[position.getInstrument()]
+        self.tradeCount[i]+=1
+        self.tradePnL[i]+=position.getPnL()
+        if self.printInfo:
+            trade_info = position.getExitOrder().getExecutionInfo()
+            self.info("Sell %s at $%.2f"%(position.getInstrument(),trade_info.getPrice()))
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+'''
+The trading rules of the SMA strategy, in one place for every engine that runs it:
+MovingAverageStrategy and PortfolioMovingAverageStrategy (sma_9_strategy_backtest.py), the
+incremental backtests (resumebacktest.py), paper trading (papertrade.py) and the position
+sizing of the vectorized backtests (vectorbacktest.py).
+
+  - flat and close > SMA: buy int(cash*budget_use // close) shares, with a stop at
+    close - risk_percent% of the budget used, spread over the shares
+  - long and (SMA > close or close <= stop): sell everything
+
+The engines differ in how and when the orders fill, not in the decisions. The backtests fill
+them with fill_cash(), the cash check of the PyAlgoTrade broker. Only the standard library is
+used, so the module costs nothing to import in the worker processes.
+'''
+
+
+'''
+Function Name: size_entry(price, cash, budget_use, risk_percent)
+Purpose: Size an entry and place its stop
+Arguments: price: float, the close the entry is decided on
+           cash: float, the cash available
+           budget_use: float, fraction of the cash used per entry
+           risk_percent: float, percent of the budget used that is risked to place the stop
+Returns: int shares, float stop loss price. Raises ZeroDivisionError when the budget cannot buy a single share,
+         the backtests record it as a Trades error.
+'''
+def size_entry(price, cash, budget_use, risk_percent):
+    equity_use=cash*budget_use
+    shares=int(equity_use//price)
+    risk_per_share=risk_percent*equity_use*.01/shares
+    return shares, price-risk_per_share
+
+
+'''
+Function Name: fill_cash(shares, price, cash, commission)
+Purpose: Cash left after a market order fills, computed like pyalgotrade's backtesting broker. The broker only fills
+         the order when the result is >= 0, a buy it cannot pay for stays pending (the entries are good till
+         canceled) and is tried again at the next open.
+Arguments: shares: int, or int array, shares bought, negative to sell
+           price: float, or float array, the fill price
+           cash: float, the cash before the fill
+           commission: float, fixed commission of the order
+Returns: float, or float array
+'''
+def fill_cash(shares, price, cash, commission):
+    return cash+(-(price*shares)-commission)
+
+
+class SMARules(object):
+    #Entry, exit and stop rules for one instrument, fed the SMA and close of each bar once the SMA is defined.
+    #Picklable, resumebacktest.py keeps it in its snapshots.
+
+    def __init__(self, budget_use=0, risk_percent=2):
+        self.budget_use=budget_use
+        self.risk_percent=risk_percent
+        self.holding=False
+        self.stop_loss=0
+        self.fill_price=0
+
+    def onBar(self, sma, price, cash):
+        #Returns the number of shares to buy, -1 to sell the whole position, 0 to do nothing
+        if not self.holding:
+            if sma < price:
+                shares, self.stop_loss=size_entry(price, cash, self.budget_use, self.risk_percent)
+                self.fill_price=price
+                self.holding=True
+                return shares
+        elif sma > price or price <= self.stop_loss:
+            self.holding=False
+            return -1
+        return 0
+
+    def cancelEntry(self):
+        #The entry order was canceled, the instrument can enter again
+        self.holding=False
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+'''
+Constant memory metrics for the backtests.
+
+StreamingAnalyzer replaces the Returns, SharpeRatio and Trades analyzers of a run. Those keep
+the return of every bar and the P/L of every trade until the run ends; StreamingAnalyzer
+updates running values instead: the cumulative return and drawdown, Welford accumulators of
+the daily returns for the Sharpe ratio, and the count, sum, min and max of the trade P/L.
+Attach it with strat.attachAnalyzer(), it shares the ReturnsAnalyzerBase the PyAlgoTrade
+analyzers use, so its returns and Sharpe ratio are theirs.
+
+getAggregate() packs the final values of a ticker into a MetricAggregate, a few numbers that
+merge() with the aggregates of other tickers into universe level metrics (all the trades,
+pooled daily returns, the spread of the tickers' returns, Sharpe ratios and drawdowns)
+without keeping any series.
+'''
+
+import math
+import array
+from pyalgotrade import stratanalyzer
+from pyalgotrade import broker
+from pyalgotrade.stratanalyzer import returns
+
+
+class RunningStats(object):
+    #Count, sum, mean, variance (Welford), min and max of a stream of values, mergeable with other RunningStats
+
+    def __init__(self):
+        self.count=0
+        self.total=0.0
+        self.mean=0.0
+        self.m2=0.0
+        self.min=float('nan')
+        self.max=float('nan')
+
+    def add(self, value):
+        self.count+=1
+        self.total+=value
+        delta=value-self.mean
+        self.mean+=delta/self.count
+        self.m2+=delta*(value-self.mean)
+        if self.count==1:
+            self.min=self.max=value
+        else:
+            self.min=min(self.min, value)
+            self.max=max(self.max, value)
+
+    def merge(self, other):
+        #Chan et al. pairwise update, same result as adding the other stream's values one by one
+        merged=RunningStats()
+        merged.count=self.count+other.count
+        if merged.count==0:
+            return merged
+        delta=other.mean-self.mean
+        merged.total=self.total+other.total
+        merged.mean=self.mean+delta*other.count/merged.count
+        merged.m2=self.m2+other.m2+delta*delta*self.count*other.count/merged.count
+        merged.min=_nanmin(self.min, other.min)
+        merged.max=_nanmax(self.max, other.max)
+        return merged
+
+    def getMean(self):
+        return self.mean if self.count else float('nan')
+
+    def getStdDev(self):
+        #Sample standard deviation (ddof=1), nan with fewer than 2 values
+        return math.sqrt(self.m2/(self.count-1)) if self.count > 1 else float('nan')
+
+    def getState(self):
+        return {'count':self.count, 'total':self.total, 'mean':self.mean, 'm2':self.m2, 'min':self.min, 'max':self.max}
+
+    @classmethod
+    def fromState(cls, state):
+        stats=cls()
+        for name, value in state.items():
+            setattr(stats, name, value if value is not None else float('nan'))
+        return stats
+
+
+def _nanmin(a, b):
+    return b if a!=a else a if b!=b else min(a, b)
+
+
+def _nanmax(a, b):
+    return b if a!=a else a if b!=b else max(a, b)
+
+
+class StreamingAnalyzer(stratanalyzer.StrategyAnalyzer):
+    #Net P/L and trade statistics, annualized Sharpe ratio of the daily returns, max drawdown and cumulative return,
+    #each updated per bar or per fill in constant memory
+    #keepTrades: also keep the P/L of every closed trade in tradePnL, a compact array of doubles (8 bytes a trade)
+
+    def __init__(self, keepTrades=False):
+        super(StreamingAnalyzer, self).__init__()
+        self.trades=RunningStats()
+        self.tradePnL=array.array('d') if keepTrades else None
+        self.dailyReturns=RunningStats()
+        self.currentDate=None
+        self.currentReturn=0.0
+        self.cumulativeReturn=0.0
+        self.peak=1.0
+        self.maxDrawDown=0.0
+        self.posTrackers={}
+        self.initialEquity=None
+        self.broker=None
+
+    def beforeAttach(self, strat):
+        base=returns.ReturnsAnalyzerBase.getOrCreateShared(strat)
+        base.getEvent().subscribe(self.__onReturns)
+
+    def attached(self, strat):
+        self.broker=strat.getBroker()
+        self.initialEquity=self.broker.getEquity()
+        self.broker.getOrderUpdatedEvent().subscribe(self.__onOrderEvent)
+
+    def __onReturns(self, dateTime, base):
+        netReturn=base.getNetReturn()
+        #Daily returns compounded from the bar returns, like SharpeRatio(useDailyReturns=True)
+        if dateTime.date()==self.currentDate:
+            self.currentReturn=(1+self.currentReturn)*(1+netReturn)-1
+        else:
+            if self.currentDate is not None:
+                self.dailyReturns.add(self.currentReturn)
+            self.currentDate=dateTime.date()
+            self.currentReturn=netReturn
+        self.cumulativeReturn=base.getCumulativeReturn()
+        wealth=1+self.cumulativeReturn
+        if wealth > self.peak:
+            self.peak=wealth
+        elif self.peak > 0:
+            self.maxDrawDown=max(self.maxDrawDown, 1-wealth/self.peak)
+
+    def __onOrderEvent(self, broker_, orderEvent):
+        if orderEvent.getEventType() not in (broker.OrderEvent.Type.PARTIALLY_FILLED, broker.OrderEvent.Type.FILLED):
+            return
+        order=orderEvent.getOrder()
+        posTracker=self.posTrackers.get(order.getInstrument())
+        if posTracker is None:
+            posTracker=returns.PositionTracker(order.getInstrumentTraits())
+            self.posTrackers[order.getInstrument()]=posTracker
+        execInfo=orderEvent.getEventInfo()
+        quantity=execInfo.getQuantity()
+        if order.getAction() in (broker.Order.Action.SELL, broker.Order.Action.SELL_SHORT):
+            quantity=-quantity
+        self.__updatePosTracker(posTracker, execInfo.getPrice(), execInfo.getCommission(), quantity)
+
+    def __updatePosTracker(self, posTracker, price, commission, quantity):
+        #A trade is complete when the position gets back to 0. A fill that crosses 0 closes the trade and opens the
+        #opposite one, the commission split in proportion like the Trades analyzer does.
+        position=posTracker.getPosition()
+        remaining=position+quantity
+        if position==0 or (remaining!=0 and (remaining > 0)==(position > 0)):
+            posTracker.update(quantity, price, commission)
+            return
+        posTracker.update(-position, price, commission*abs(position)/abs(quantity))
+        pnl=posTracker.getPnL(0)
+        self.trades.add(pnl)
+        if self.tradePnL is not None:
+            self.tradePnL.append(pnl)
+        posTracker.reset()
+        if remaining!=0:
+            posTracker.update(remaining, price, commission*abs(remaining)/abs(quantity))
+
+    def getCount(self):
+        return self.trades.count
+
+    def getNetProfit(self):
+        return self.trades.total
+
+    def getSharpeRatio(self, riskFreeRate=0.0, annualized=True):
+        #SharpeRatio.getSharpeRatio() of the daily returns, the current day included
+        daily=self.getDailyReturns()
+        volatility=daily.getStdDev()
+        if volatility==0:
+            return 0.0
+        ratio=(daily.getMean()-riskFreeRate/252.0)/volatility
+        return ratio*math.sqrt(252) if annualized else ratio
+
+    def getDailyReturns(self):
+        #RunningStats of the daily returns, the current day included
+        if self.currentDate is None:
+            return self.dailyReturns
+        current=RunningStats()
+        current.add(self.currentReturn)
+        return self.dailyReturns.merge(current)
+
+    def getMaxDrawDown(self):
+        return self.maxDrawDown
+
+    def getCumulativeReturn(self):
+        return self.cumulativeReturn
+
+    def getAggregate(self):
+        return MetricAggregate.fromAnalyzer(self)
+
+
+class MetricAggregate(object):
+    #Mergeable summary of one or more tickers' runs. Picklable, and getState()/fromState() give a JSON friendly dict.
+
+    def __init__(self):
+        self.tickers=0
+        self.initialEquity=0.0
+        self.finalEquity=0.0
+        self.trades=RunningStats()
+        self.dailyReturns=RunningStats()
+        self.cumulativeReturns=RunningStats()
+        self.sharpeRatios=RunningStats()
+        self.drawDowns=RunningStats()
+
+    @classmethod
+    def fromAnalyzer(cls, analyzer):
+        aggregate=cls()
+        aggregate.tickers=1
+        aggregate.initialEquity=analyzer.initialEquity
+        aggregate.finalEquity=analyzer.broker.getEquity()
+        aggregate.trades=analyzer.trades.merge(RunningStats())
+        aggregate.dailyReturns=analyzer.getDailyReturns().merge(RunningStats())
+        aggregate.cumulativeReturns.add(analyzer.getCumulativeReturn())
+        sharpe=analyzer.getSharpeRatio()
+        if sharpe==sharpe:
+            aggregate.sharpeRatios.add(sharpe)
+        aggregate.drawDowns.add(analyzer.getMaxDrawDown())
+        return aggregate
+
+    def merge(self, other):
+        merged=MetricAggregate()
+        merged.tickers=self.tickers+other.tickers
+        merged.initialEquity=self.initialEquity+other.initialEquity
+        merged.finalEquity=self.finalEquity+other.finalEquity
+        for name in ('trades', 'dailyReturns', 'cumulativeReturns', 'sharpeRatios', 'drawDowns'):
+            setattr(merged, name, getattr(self, name).merge(getattr(other, name)))
+        return merged
+
+    def getRow(self):
+        #Universe level metrics, returns and drawdowns in percent like the results rows
+        return {'Tickers':self.tickers, 'Initial Equity':self.initialEquity, 'Final Equity':self.finalEquity,
+                'Net P/L':self.trades.total, 'Trades Made':self.trades.count, 'Avg P/L':self.trades.getMean(),
+                'Trade P/L Std':self.trades.getStdDev(), 'Max Profit':self.trades.max, 'Max Loss':self.trades.min,
+                'Mean Annual Ret':self.cumulativeReturns.getMean()*100, 'Best Annual Ret':self.cumulativeReturns.max*100,
+                'Worst Annual Ret':self.cumulativeReturns.min*100, 'Mean Sharpe':self.sharpeRatios.getMean(),
+                'Pooled Daily Sharpe':self.dailyReturns.getMean()/self.dailyReturns.getStdDev()*math.sqrt(252)
+                if self.dailyReturns.count > 1 and self.dailyReturns.m2 > 0 else float('nan'),
+                'Mean Max Drawdown':self.drawDowns.getMean()*100, 'Worst Max Drawdown':self.drawDowns.max*100}
+
+    def getState(self):
+        state={'tickers':self.tickers, 'initialEquity':self.initialEquity, 'finalEquity':self.finalEquity}
+        for name in ('trades', 'dailyReturns', 'cumulativeReturns', 'sharpeRatios', 'drawDowns'):
+            state[name]=getattr(self, name).getState()
+        return state
+
+    @classmethod
+    def fromState(cls, state):
+        aggregate=cls()
+        aggregate.tickers=state['tickers']
+        aggregate.initialEquity=state['initialEquity']
+        aggregate.finalEquity=state['finalEquity']
+        for name in ('trades', 'dailyReturns', 'cumulativeReturns', 'sharpeRatios', 'drawDowns'):
+            setattr(aggregate, name, RunningStats.fromState(state[name]))
+        return aggregate
+
+
+'''
+Function Name: merge_aggregates(aggregates)
+Purpose: Merge the MetricAggregate of many tickers, or their getState() dicts as read back from a results file
+Returns: MetricAggregate
+'''
+def merge_aggregates(aggregates):
+    merged=MetricAggregate()
+    for aggregate in aggregates:
+        if isinstance(aggregate, dict):
+            aggregate=MetricAggregate.fromState(aggregate)
+        merged=merged.merge(aggregate)
+    return merged
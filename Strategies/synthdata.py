@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic market data used to exercise the data and backtest pipeline without
+touching the network or the E:/Datasets drive.
+
+Prices follow a geometric random walk seeded from the ticker name, so the same
+ticker always produces the same series.
+"""
+
+import os
+import zlib
+import numpy as np
+import pandas as pd
+
+
+'''
+Function Name: ticker_seed(ticker, seed)
+Purpose: Build a stable random seed for a ticker so generated series are reproducible
+         between runs and between processes (the builtin hash() is salted per process).
+Arguments: ticker: String, the ticker symbol
+           seed: int, a base seed mixed into the ticker seed
+Returns: int
+'''
+def ticker_seed(ticker, seed=0):
+    return (zlib.crc32(ticker.encode('utf-8')) + seed) % (2**32)
+
+
+#Regular trading session used for intraday bars when session=True
+SESSION_OPEN='09:30'
+SESSION_CLOSE='16:00'
+
+
+'''
+Function Name: session_index(bars, freq, start)
+Purpose: Build the timestamps of intraday bars that fall inside the regular session (SESSION_OPEN to SESSION_CLOSE)
+         on business days, like the minute history Yahoo returns, instead of a 24/7 range
+Arguments: bars: int, the number of timestamps
+           freq: String, a pandas intraday frequency, ex 'min', '5min', 'h'
+           start: String or datetime, the first trading day
+Returns: pandas DatetimeIndex named "Date"
+'''
+def session_index(bars, freq='min', start='2015-01-02'):
+    day=pd.date_range('2000-01-03 '+SESSION_OPEN, '2000-01-03 '+SESSION_CLOSE, freq=freq, inclusive='left')
+    offsets=(day-day[0].normalize()).to_numpy()
+    days=pd.bdate_range(start=pd.Timestamp(start).normalize(), periods=-(-bars//len(offsets))).to_numpy()
+    stamps=(days[:, None]+offsets[None, :]).ravel()[:bars]
+    return pd.DatetimeIndex(stamps, name="Date")
+
+
+'''
+Function Name: generate_bars(ticker, bars, freq, start, seed, drift, volatility, session)
+Purpose: Generate an OHLCV DataFrame in the same shape yfinance returns from Ticker.history():
+         a DatetimeIndex named "Date" and Open, High, Low, Close, Volume, Dividends, Stock Splits columns.
+Arguments: ticker: String, the ticker symbol, used to seed the random walk
+           bars: int, the number of bars to generate
+           freq: String, a pandas frequency for the bar spacing, ex 'B' for business days, 'min' for minutes
+           start: String or datetime, the timestamp of the first bar
+           seed: int, base seed mixed into the ticker seed
+           drift: float, mean log return per bar
+           volatility: float, standard deviation of the log return per bar
+           session: bool, for intraday freq only generate bars inside the regular trading session, see session_index()
+Returns: pandas DataFrame
+'''
+def generate_bars(ticker, bars=252, freq='B', start='2015-01-02', seed=0, drift=0.0003, volatility=0.02, session=False):
+    rng=np.random.default_rng(ticker_seed(ticker, seed))
+    if session:
+        index=session_index(bars, freq, start)
+    else:
+        index=pd.date_range(start=start, periods=bars, freq=freq, name="Date")
+    log_returns=rng.normal(drift, volatility, bars)
+    close=20.0 + 180.0*rng.random()
+    close=close*np.exp(np.cumsum(log_returns))
+    open_=np.empty(bars)
+    open_[0]=close[0]
+    open_[1:]=close[:-1]*np.exp(rng.normal(0, volatility/4, bars-1))
+    spread=np.abs(rng.normal(0, volatility/2, bars))
+    high=np.maximum(open_, close)*(1+spread)
+    low=np.minimum(open_, close)*(1-spread)
+    volume=rng.integers(100000, 5000000, bars)
+    return pd.DataFrame({'Open':open_.round(4), 'High':high.round(4), 'Low':low.round(4),
+                         'Close':close.round(4), 'Volume':volume,
+                         'Dividends':0.0, 'Stock Splits':0.0}, index=index)
+
+
+'''
+Function Name: write_csv_universe(data_directory, ticker_sub_directory, tickers, bars, freq, start, seed, drift, volatility, session, date_format)
+Purpose: Write one synthetic ticker csv per ticker in the same layout tickerdatautil.get_data_from_yahoo() writes
+         (Date Time as epoch seconds, Open, High, Low, Close, Volume, Adj Close), plus a ticker list csv.
+Arguments: data_directory: String, parent directory, the ticker list is written here as <ticker_sub_directory>.csv
+           ticker_sub_directory: String, sub directory that receives one csv per ticker
+           tickers: list of ticker symbols, or an int to generate that many symbols (SYN0000, SYN0001...)
+           bars, freq, start, seed, drift, volatility, session: see generate_bars()
+           date_format: String, format of the Date Time column. '%s' (epoch seconds) is what the download
+                        functions write, '%Y-%m-%d %H:%M:%S' is what csvfeed.GenericBarFeed reads.
+Returns: list of the ticker symbols written
+'''
+def write_csv_universe(data_directory, ticker_sub_directory, tickers, bars=252, freq='B', start='2015-01-02', seed=0,
+                       drift=0.0003, volatility=0.02, session=False, date_format='%s'):
+    #Imported here, tickerdatautil imports dataprovider which imports this module
+    import tickerdatautil as td
+    if isinstance(tickers, int):
+        tickers=['SYN{:04d}'.format(i) for i in range(tickers)]
+    os.makedirs(os.path.join(data_directory, ticker_sub_directory), exist_ok=True)
+    for ticker in tickers:
+        df=td.format_history(generate_bars(ticker, bars=bars, freq=freq, start=start, seed=seed, drift=drift,
+                                           volatility=volatility, session=session))
+        df.to_csv(os.path.join(data_directory, ticker_sub_directory, ticker+'.csv'), date_format=date_format, index=False)
+    pd.DataFrame({'Ticker':tickers}).to_csv(os.path.join(data_directory, ticker_sub_directory+'.csv'), index=False)
+    return tickers
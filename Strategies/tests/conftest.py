@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+'''
+The modules of Strategies import each other by name, run the tests with them on the path:
+python -m pytest Strategies/tests
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
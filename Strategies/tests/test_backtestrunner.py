@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+'''
+Watch list runs with the result cache and the results sink.
+'''
+
+import json
+import numpy as np
+import pytest
+import synthdata
+import backtestrunner
+import resultcache
+import resultsink
+
+
+def test_cache_keeps_the_trades_and_the_sink_the_rows(tmp_path):
+    symbols=synthdata.write_csv_universe(str(tmp_path)+'/', 'watch', 3, bars=504, date_format='%Y-%m-%d %H:%M:%S')
+    settings={'data_directory':str(tmp_path/'watch')+'/'}
+    cache=resultcache.ResultCache(str(tmp_path/'cache'))
+    with resultsink.ResultSink(str(tmp_path/'results.jsonl'), 'test', sync=False) as sink:
+        results, errors=backtestrunner.run_watchlist(symbols, settings, 1, cache, sink)
+    assert errors.empty and list(results.columns)==backtestrunner.RESULT_COLUMNS
+    for ticker, row in zip(symbols, results.to_dict('records')):
+        result, _=cache.get(cache.key(ticker, dict(backtestrunner.DEFAULT_SETTINGS, **settings)))
+        trades=result['Trades']
+        assert isinstance(trades, np.ndarray) and trades.dtype==np.float64
+        assert len(trades)==row['Trades Made'] > 0
+        assert trades.sum()==pytest.approx(row['Net P/L']) and trades.max()==row['Max Profit']
+    with open(str(tmp_path/'results.jsonl')) as f:
+        lines=[json.loads(line) for line in f]
+    assert [line['Ticker'] for line in lines]==symbols
+    assert all('Trades' not in line['Result'] and line['Result']['Trades Made'] > 0 for line in lines)
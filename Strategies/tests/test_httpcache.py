@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+'''
+httpcache.HTTPSession and the frame cache of dataprovider.YahooProvider against a local stub server,
+counting the requests that reach it.
+'''
+
+import io
+import threading
+import http.server
+import urllib.parse
+import pandas as pd
+import pytest
+import dataprovider
+import httpcache
+import synthdata
+import tickerdatautil as td
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    #/history?ticker=X&start=...&end=... answers a csv of daily bars with an ETag, 304 to a matching If-None-Match
+    protocol_version='HTTP/1.1'
+    counts=None
+
+    def do_GET(self):
+        url=urllib.parse.urlparse(self.path)
+        query=dict(urllib.parse.parse_qsl(url.query))
+        etag='"{}"'.format(abs(hash(self.path)))
+        self.counts.append((url.path, query.get('ticker'), self.headers.get('If-None-Match') is not None))
+        if self.headers.get('If-None-Match')==etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        df=synthdata.generate_bars(query.get('ticker', 'PAGE'), bars=20)
+        if query.get('start'):
+            df=df[df.index >= pd.Timestamp(query['start'])]
+        body=df.to_csv().encode('utf-8')
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubProvider(dataprovider.YahooProvider):
+    #YahooProvider with its downloads sent to the stub server instead of yfinance, the caching is YahooProvider's
+
+    def __init__(self, session, base_url):
+        super(StubProvider, self).__init__(session)
+        self.base_url=base_url
+
+    def _history(self, ticker, period, start, end, interval):
+        import requests
+        params={'ticker':ticker, 'period':period, 'start':start, 'end':end, 'interval':interval}
+        response=requests.get(self.base_url+'/history', params=params)
+        return pd.read_csv(io.StringIO(response.text), index_col='Date', parse_dates=True)
+
+
+@pytest.fixture
+def server():
+    requests_seen=[]
+    handler=type('Handler', (StubHandler,), {'counts':requests_seen})
+    httpd=http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield 'http://127.0.0.1:{}'.format(httpd.server_address[1]), requests_seen
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_session(tmp_path, ttl=3600):
+    return httpcache.HTTPSession(httpcache.ResponseCache(str(tmp_path/'http')), ttl=ttl)
+
+
+def test_session_serves_repeats_and_revalidates(tmp_path, server):
+    base_url, requests_seen=server
+    session=make_session(tmp_path)
+    try:
+        first=session.get(base_url+'/page', {'ticker':'A'})
+        second=session.get(base_url+'/page', {'ticker':'A'})
+        assert not first.from_cache and second.from_cache and first.content==second.content
+        assert len(requests_seen)==1
+        session.get(base_url+'/page', {'ticker':'B'})
+        assert len(requests_seen)==2
+        #Past the ttl the cached response is revalidated, the 304 brings no body
+        revalidated=session.get(base_url+'/page', {'ticker':'A'}, ttl=0)
+        assert revalidated.from_cache and revalidated.content==first.content
+        assert requests_seen[-1]==('/page', 'A', True)
+        assert session.getStats()=={'hits':1, 'misses':2, 'revalidated':1, 'requests':3, 'evicted':0}
+    finally:
+        session.close()
+
+
+def test_provider_caches_resolved_ranges(tmp_path, server):
+    base_url, requests_seen=server
+    provider=StubProvider(make_session(tmp_path), base_url)
+    #A period and a range reaching today are asked once a day
+    assert len(provider.history('AAA', period='1y'))==len(provider.history('AAA', period='1y'))
+    provider.history('AAA', period='1y', interval='1h')
+    assert len(requests_seen)==2
+    #Equal dates given in other types are the same request, another end is not
+    provider.history('AAA', start='2015-01-05', end='2015-01-20')
+    provider.history('AAA', start=pd.Timestamp('2015-01-05'), end=pd.Timestamp('2015-01-20').to_pydatetime())
+    assert len(requests_seen)==3
+    provider.history('AAA', start='2015-01-05', end='2015-01-21')
+    provider.history('BBB', start='2015-01-05', end='2015-01-21')
+    assert len(requests_seen)==5
+
+
+def test_provider_ttl_applies_to_open_ranges_only(tmp_path, server):
+    base_url, requests_seen=server
+    session=make_session(tmp_path)
+    provider=StubProvider(session, base_url)
+    provider.history('AAA', period='1mo')
+    provider.history('AAA', start='2015-01-05', end='2015-01-20')
+    session.ttl=1e-9
+    provider.history('AAA', period='1mo')
+    provider.history('AAA', start='2015-01-05', end='2015-01-20')
+    assert len(requests_seen)==3
+    #A ttl of 0 always downloads
+    session.ttl=0
+    provider.history('AAA', start='2015-01-05', end='2015-01-20')
+    assert len(requests_seen)==4
+
+
+def test_refresh_rerun_is_served_from_the_cache(tmp_path, server):
+    base_url, requests_seen=server
+    provider=StubProvider(make_session(tmp_path), base_url)
+    data_directory=str(tmp_path)+'/'
+    pd.DataFrame({'Ticker':['AAA', 'BBB', 'CCC']}).to_csv(data_directory+'watch.csv', index=False)
+    for _ in range(2):
+        summary=td.get_data_from_yahoo(data_directory, 'Data', 'watch.csv', '1y', True, False, 0, provider=provider)
+        assert (summary['Status']=='ok').all()
+    assert sorted(ticker for _, ticker, _ in requests_seen)==['AAA', 'BBB', 'CCC']
+    assert len(td.read_ticker_csv(data_directory+'Data/AAA.csv'))==20
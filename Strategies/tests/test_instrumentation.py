@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+'''
+The download summaries and per ticker rows of instrumentation.Report.
+'''
+
+import pandas as pd
+import dataprovider
+import instrumentation
+import tickerdatautil as td
+
+
+def test_batched_requests_are_counted_once():
+    provider=dataprovider.FakeProvider(latency=0, failure_rate=0.3, bars=30, seed=3)
+    tickers=['T{:02d}'.format(i) for i in range(12)]
+    _, summary=td.download_tickers_batched(tickers, provider.download, batch_size=5, workers=1, rate=0, retries=5,
+                                           backoff=0)
+    assert (summary['Status']=='ok').all()
+    assert sorted(set(summary['Batch']))==['T00', 'T05', 'T10'] and provider.getCalls() > 3
+    report=instrumentation.Report()
+    report.addDownloads(summary)
+    frame=report.toFrame()
+    assert frame['Requests'].sum()==provider.getCalls()
+    assert frame['Retries'].sum()==provider.getCalls()-3
+    assert (frame.loc[~frame['Ticker'].isin(['T00', 'T05', 'T10']), 'Requests']==0).all()
+
+
+def test_unbatched_requests_are_per_ticker():
+    provider=dataprovider.FakeProvider(latency=0, failure_rate=0.3, bars=30, seed=3)
+    _, summary=td.download_tickers(['A', 'B', 'C'], provider.history, workers=1, rate=0, retries=5, backoff=0)
+    report=instrumentation.Report()
+    report.addDownloads(summary)
+    frame=report.toFrame()
+    assert frame['Requests'].sum()==provider.getCalls()
+    assert (frame['Retries']==frame['Requests']-1).all()
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''
+PaperTrader over a ReplaySource of synthetic minute bars, and the latency histogram it keeps.
+'''
+
+import asyncio
+import numpy as np
+import instrumentation
+import papertrade
+import synthdata
+
+
+def minute_bars(tickers, bars):
+    data={}
+    for ticker in tickers:
+        df=synthdata.generate_bars(ticker, bars=bars, freq='min', session=True, volatility=0.002)
+        data[ticker]={'datetime':df.index.values.astype('datetime64[s]').astype(np.int64),
+                      'open':df['Open'].values, 'high':df['High'].values, 'low':df['Low'].values,
+                      'close':df['Close'].values, 'volume':df['Volume'].values.astype(np.float64)}
+    return data
+
+
+def test_latency_histogram_percentiles():
+    samples=np.random.default_rng(0).lognormal(5, 1, 20000)
+    histogram=instrumentation.LatencyHistogram()
+    for sample in samples:
+        histogram.add(sample)
+    assert histogram.count==len(samples) and histogram.max==samples.max()
+    for q in (50, 99, 99.9):
+        #The upper edge of the bin, at most one bin (2**(1/8)) above the exact percentile
+        assert np.percentile(samples, q) <= histogram.percentile(q) <= np.percentile(samples, q)*2**(1/8)
+    assert histogram.getHistogram()==np.histogram(samples, bins=instrumentation.LATENCY_BINS_US)[0].tolist()
+
+
+def test_paper_trader_memory_is_bounded():
+    tickers=['SYN{:04d}'.format(i) for i in range(20)]
+    trader=papertrade.PaperTrader(papertrade.ReplaySource(minute_bars(tickers, 200), 60), tickers, {}, max_orders=10)
+    stats=asyncio.run(trader.run())
+    assert stats['Bars']==20*200 and stats['Errors']==0
+    assert stats['Orders']==trader.orderCount > 10 and len(trader.orders)==10
+    assert sum(stats['Histogram'])==stats['Bars']
+    assert stats['p50 ms'] <= stats['p99 ms'] <= stats['p99.9 ms'] <= stats['Max ms']
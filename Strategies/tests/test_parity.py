@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+'''
+The engines that run the SMA strategy must give the same metrics on the same bars: the event driven
+MovingAverageStrategy (backtestrunner.run_strategy), the portfolio strategy on a single instrument
+(backtestrunner.run_portfolio), the vectorized evaluator (vectorbacktest) and the incremental
+backtests (resumebacktest).
+'''
+
+import numpy as np
+import pandas as pd
+import pytest
+import pyalgotrade.bar as bar
+import synthdata
+import barstore
+import arrayfeed
+import backtestrunner
+import vectorbacktest
+import resumebacktest
+import sma_9_strategy_backtest as sma_9
+import tickerdatautil as td
+
+
+METRICS=backtestrunner.RESULT_COLUMNS[1:]
+TOLERANCE=1e-9
+
+
+#Synthetic bars of the vector parity cases: store interval, pandas frequency, feed frequency, volatility per bar
+INTERVALS={'1d':('B', bar.Frequency.DAY, 0.02), '1h':('h', bar.Frequency.HOUR, 0.004)}
+
+
+def write_ticker(directory, ticker, bars=1260, interval='1d'):
+    freq, _, volatility=INTERVALS[interval]
+    df=td.format_history(synthdata.generate_bars(ticker, bars=bars, freq=freq, drift=0.0, volatility=volatility))
+    barstore.write_bars(str(directory), interval, ticker, df)
+    return barstore.load_bars(str(directory), interval, ticker)
+
+
+def event_result(directory, ticker, settings, interval='1d'):
+    feed=arrayfeed.ArrayBarFeed(INTERVALS[interval][1])
+    feed.addBarsFromStore(ticker, str(directory), interval)
+    result, errors=backtestrunner.run_strategy(feed, ticker, settings)
+    assert not errors, errors
+    return result
+
+
+def assert_same_metrics(expected, actual):
+    for column in METRICS:
+        difference=abs(expected[column]-actual[column])/max(1.0, abs(expected[column]))
+        assert difference <= TOLERANCE, (column, expected[column], actual[column])
+
+
+@pytest.mark.parametrize('ticker', ['PAR0', 'PAR1', 'PAR2'])
+@pytest.mark.parametrize('budget_use', [0.25, 0.5, 0.9])
+def test_portfolio_of_one_matches_run_strategy(tmp_path, ticker, budget_use):
+    write_ticker(tmp_path, ticker)
+    settings={'store_directory':str(tmp_path), 'budget_use':budget_use}
+    portfolio, instruments, errors=backtestrunner.run_portfolio([ticker], settings)
+    assert errors.empty, errors
+    single=event_result(tmp_path, ticker, settings)
+    assert single['Trades Made'] > 0
+    assert_same_metrics(single, portfolio)
+    assert instruments['Trades Made'].iloc[0]==single['Trades Made']
+    assert instruments['Net P/L'].iloc[0]==pytest.approx(single['Net P/L'], rel=TOLERANCE)
+
+
+@pytest.mark.parametrize('interval', ['1d', '1h'])
+@pytest.mark.parametrize('period', [5, 9, 20])
+@pytest.mark.parametrize('budget_use', [0.25, 0.5, 1.0])
+def test_vector_matches_event(tmp_path, interval, period, budget_use):
+    #With the whole cash used the entries often cannot pay for the open and wait for a later one
+    for ticker in ['PAR0', 'PAR1', 'PAR2']:
+        arrays=write_ticker(tmp_path, ticker, interval=interval)
+        settings={'fast_period':period, 'budget_use':budget_use}
+        event=event_result(tmp_path, ticker, settings, interval)
+        vector=vectorbacktest.run_sma_backtest(arrays['datetime'], arrays['open'], arrays['close'], nfast=period,
+                                               budget_use=budget_use)
+        assert_same_metrics(event, vector)
+
+
+def test_entry_waits_for_an_open_it_can_pay_for(tmp_path):
+    #SMA 3 entry decided on bar 3 for int(1600//11)=145 shares. Bar 4 opens at 11.1, 145 shares and the commission
+    #cost 1609.6 and the broker leaves the order pending, it fills at the 11.0 open of bar 5. The SMA exit of bar 7
+    #fills at the 10.4 open of bar 8.
+    open_=[10, 10, 10, 10, 11.1, 11.0, 11.5, 11.6, 10.4, 10.4]
+    close=[10, 10, 10, 11, 11.2, 11.5, 11.6, 10.5, 10.4, 10.4]
+    index=pd.date_range('2015-01-02', periods=len(close), freq='B', name='Date')
+    df=pd.DataFrame({'Open':open_, 'High':np.maximum(open_, close), 'Low':np.minimum(open_, close), 'Close':close,
+                     'Volume':1000000, 'Dividends':0.0, 'Stock Splits':0.0}, index=index)
+    barstore.write_bars(str(tmp_path), '1d', 'GAP', td.format_history(df))
+    arrays=barstore.load_bars(str(tmp_path), '1d', 'GAP')
+    settings={'fast_period':3, 'budget_use':1.0}
+    event=event_result(tmp_path, 'GAP', settings)
+    vector=vectorbacktest.run_sma_backtest(arrays['datetime'], arrays['open'], arrays['close'], nfast=3, budget_use=1.0)
+    assert event['Trades Made']==1
+    assert event['Net P/L']==pytest.approx(145*(10.4-11.0)-0.2)
+    assert_same_metrics(event, vector)
+
+
+@pytest.mark.parametrize('budget_use', [0.5, 1.0])
+def test_resumed_run_matches_event(tmp_path, budget_use):
+    #The first run stops part way through the history, the second resumes from its snapshot on the whole history
+    ticker='PAR0'
+    df=td.format_history(synthdata.generate_bars(ticker, bars=1260, drift=0.0))
+    settings={'store_directory':str(tmp_path), 'budget_use':budget_use}
+    snapshots=str(tmp_path/'snapshots')
+    barstore.write_bars(str(tmp_path), '1d', ticker, df.iloc[:800])
+    first, errors=resumebacktest.run_incremental(ticker, settings, snapshots)
+    assert not errors and not first['Resumed']
+    barstore.write_bars(str(tmp_path), '1d', ticker, df)
+    resumed, errors=resumebacktest.run_incremental(ticker, settings, snapshots)
+    assert not errors and resumed['Resumed'] and resumed['Bars Processed']==460
+    assert_same_metrics(event_result(tmp_path, ticker, settings), resumed)
+
+
+def test_strategy_reads_rule_state_through(tmp_path):
+    write_ticker(tmp_path, 'PAR0')
+    feed=arrayfeed.ArrayBarFeed(bar.Frequency.DAY)
+    feed.addBarsFromStore('PAR0', str(tmp_path), '1d')
+    strat=sma_9.MovingAverageStrategy(feed, 'PAR0', 9)
+    strat.initBackTestStrategy(1600)
+    strat.setBudgetUse(0.75)
+    strat.setRiskPercent(3)
+    assert (strat.BUDGET_USE, strat.risk_percent)==(0.75, 3)
+    strat.run()
+    assert strat.stop_loss==strat.rules.stop_loss > 0
+    assert strat.fill_price==strat.rules.fill_price > 0
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+'''
+The csv housekeeping of tickerdatautil on a synthetic data directory.
+'''
+
+import os
+import pytest
+import synthdata
+import tickerdatautil as td
+
+
+@pytest.mark.parametrize('ticker_sub_directory', ['SP500', 'SP500/'])
+def test_quality_report_is_kept_out_of_the_ticker_directory(tmp_path, ticker_sub_directory):
+    data_directory=str(tmp_path)+'/'
+    synthdata.write_csv_universe(data_directory, 'SP500', ['AAA', 'BBB'], bars=60)
+    synthdata.write_csv_universe(data_directory, 'Short', ['CCC'], bars=10)
+    os.replace(data_directory+'Short/CCC.csv', data_directory+'SP500/CCC.csv')
+    report=td.compact_data_directory(data_directory, ticker_sub_directory, workers=1)
+    assert sorted(report['Ticker'])==['AAA', 'BBB', 'CCC']
+    assert os.path.exists(data_directory+'SP500_quality.csv')
+    assert sorted(os.listdir(data_directory+'SP500'))==['AAA.csv', 'BBB.csv', 'CCC.csv']
+    assert td.usable_tickers(data_directory, ticker_sub_directory, ['AAA', 'BBB', 'CCC'])==(['AAA', 'BBB'], ['CCC'])
+
+
+def test_downloads_take_a_ticker_list_instead_of_the_file(tmp_path):
+    #cli fetch and update pass the tickers cli.load_tickers() read, from a csv or a pickle
+    import pickle
+    import cli
+    import dataprovider
+    data_directory=str(tmp_path)+'/'
+    with open(data_directory+'watch.pickle', 'wb') as f:
+        pickle.dump(['AAA', 'BBB'], f)
+    tickers=cli.load_tickers({'data_directory':str(tmp_path), 'ticker_file':'watch.pickle'})
+    assert tickers==['AAA', 'BBB']
+    provider=dataprovider.FakeProvider(latency=0, bars=40, end='2020-03-02')
+    summary=td.get_data_from_yahoo(data_directory, 'Data', 'watch.pickle', '1y', False, False, 0, provider=provider,
+                                   tickers=tickers)
+    assert list(summary['Ticker'])==tickers and (summary['Status']=='ok').all()
+    assert sorted(os.listdir(data_directory+'Data'))==['AAA.csv', 'BBB.csv']
+    summary=td.update_ticker_prices_fromLast(data_directory, 'Data', 'watch.pickle', 0, provider=provider,
+                                             tickers=['BBB'])
+    assert set(summary['Ticker']) <= {'BBB'}
@@ -48,26 +48,37 @@ SOFTWARE.
 
 #imports
 
-import bs4 as bs
-import requests
+#bs4, requests and yfinance are imported where they are used, so the modules that only read
+#or update the csv files start without them (yfinance is loaded by dataprovider.YahooProvider,
+#requests by httpcache.HTTPSession)
 import os
 import time
-import yfinance as yf
 import pandas as pd
 from datetime import datetime
 import glob as g
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import numpy as np
+import dataprovider
+import httpcache
+import barstore
 
 
 '''
-Function Name: save_sp_500_tickers(data_directory)
+Function Name: save_sp_500_tickers(data_directory,session)
 Function Purpose: To get the current list of S&P500 ticker Symbols from wikipedia
                   and save them to a file tickers.csv
 Arguments: data_directory: A string representing the data directory where csv files containing tickers are stored
+           session: httpcache.HTTPSession the page is requested through, defaults to the shared httpcache.get_session()
 Output: sp500tickers.csv
 '''
-def save_sp_500_tickers(data_directory):
-    resp=requests.get('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
+def save_sp_500_tickers(data_directory,session=None):
+    import bs4 as bs
+    if session is None:
+        session=httpcache.get_session()
+    resp=session.get('https://en.wikipedia.org/wiki/List_of_S%26P_500_companies')
+    resp.raise_for_status()
     soup=bs.BeautifulSoup(resp.text, 'lxml')
     table=soup.find('table',{'class': 'wikitable sortable'})
     tickers=[]
@@ -85,52 +96,375 @@ def save_sp_500_tickers(data_directory):
         
 
 '''
-Function Name: update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName)
+Function Name: update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName,delay,workers,provider,retries,batch_size,interval,tickers)
 Function Purpose: When given a csv file with a list of ticker names, if a csv file exists in the ticker subdirectory,
-                  then the function will check the last date in the file, download the data in a valid increment,
-                  and update the file.
+                  then the function will check the last date in the file, download the missing date range,
+                  and append only the rows newer than the last row in the file.
+                  The last date is found by seeking back from the end of the file, so the cost of an update
+                  depends on the amount of new data, not on the size of the file.
 Arguments:  data_directory: A string representing the data directory where csv files containing tickers are stored
             ticker_sub_directory: The sub folder that the csv files for each ticker will be stored
             fileName: A string representing name of the csv file that contains the tickers, .csv should be included
-            delay: float - The delay time in seconds between ticker info downloads, 0.5 works well, not to anger the yahoo server
+            delay: float - The average delay time in seconds between requests, 0.5 works well, not to anger the yahoo server
+            workers: int - The number of requests made concurrently
+            provider: The data source, defaults to dataprovider.YahooProvider()
+            retries: int - The number of times a failed download is retried, with exponential backoff
+            batch_size: int - When set, tickers last updated on the same day are requested batch_size at a time in
+                        one provider call. None keeps one request per ticker.
+            interval: String - The bar interval of the files being updated, default 1d.
+                      Intraday data cannot extend last 60 days
+            tickers: list of ticker symbols to update instead of the ones of fileName, ex read from a pickle
+Returns: pandas DataFrame with the per ticker download summary of the tickers updated (Ticker, Status, Attempts, Rows,
+         Seconds, Error), see instrumentation.Report.addDownloads()
 '''
-def update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName,delay):
-    tickers=pd.read_csv(data_directory + fileName, usecols=["Ticker"], index_col=None)
-    for ticker in tickers["Ticker"]:
+def update_ticker_prices_fromLast(data_directory,ticker_sub_directory,fileName,delay,workers=1,provider=None,retries=3,batch_size=None,interval='1d',tickers=None):
+    if tickers is None:
+        tickers=pd.read_csv(data_directory + fileName, usecols=["Ticker"], index_col=None)["Ticker"]
+    if provider is None:
+        provider=dataprovider.YahooProvider()
+    end=(datetime.now()+pd.Timedelta(days=1)).strftime('%Y-%m-%d')
+    plan={}
+    last_dates={}
+    for ticker in tickers:
         print("Updating Ticker: {}".format(ticker))
         if not os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)):
             print("Ticker File Not Found, Check directory, ticker name, or run get_data_from_yahoo()")
-        else:
-            delta, last_date=get_update_date_delta(data_directory,ticker_sub_directory,'{}'.format(ticker))
-            if delta==0:
-                print("No Update Needed for {}".format(ticker))
-                continue
-            if delta==1:
-                update_period = "1d"
-            if delta > 1 and delta < 32:
-                update_period ="1mo"
-            if delta > 31 and delta < 94:
-                update_period ="3mo"
-            if delta > 93: 
-                print("It has been more than 3 Months since update, it would be more efficient to get new data. \nUse get_data_from_yahoo") 
-                print("\nDays Since Last Update: {}  ".format(delta)) 
-                continue
-            with open(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),"a",newline='') as f:
-                tick=yf.Ticker(ticker)
-                df=tick.history(update_period)
-                df['Adj Close'] = df['Close']
-                df.index.name ="Date Time"
-                df.drop(columns=['Dividends','Stock Splits'],axis=1, inplace=True)
-                df.reset_index(inplace=True)
-                #Depedent on Update Time, Get aftermarket volume info
-                if update_period =="1d":
-                    df.drop(df.index[1], inplace=True)  
-                f.write(df.to_csv(date_format='%s',header=False, index=False))
-                time.sleep(delay)
-    
+            continue
+        delta, last_date=get_update_date_delta(data_directory,ticker_sub_directory,'{}'.format(ticker))
+        if last_date is None:
+            print("No rows found for {}, run get_data_from_yahoo()".format(ticker))
+            continue
+        if delta==0 and interval.endswith('d'):
+            print("No Update Needed for {}".format(ticker))
+            continue
+        #Start on the day of the last row, rows up to and including it are dropped before appending
+        last_dates[ticker]=last_date
+        plan.setdefault(last_date.strftime('%Y-%m-%d'), []).append(ticker)
+
+    def save(ticker, df):
+        df=format_history(df)
+        df=df[written_timestamps(df["Date Time"]) > last_dates[ticker]]
+        if df.empty:
+            print("No new rows for {}".format(ticker))
+            return
+        with open(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),"a",newline='') as f:
+            f.write(df.to_csv(date_format='%s',header=False, index=False))
+
+    summaries=[_fetch_histories(group, provider, {'start':start, 'end':end, 'interval':interval}, save,
+                                delay, workers, batch_size, retries) for start, group in plan.items()]
+    if not summaries:
+        return pd.DataFrame(columns=['Ticker', 'Status', 'Attempts', 'Rows', 'Seconds', 'Error'])
+    return pd.concat(summaries, ignore_index=True)
+
+
+'''
+Function Name: read_last_line(path, block_size)
+Purpose: Return the last non empty line of a text file by reading blocks backwards from the end of the file,
+         without reading the rest of the file.
+Arguments: path: String, the path of the file
+           block_size: int, the number of bytes read per step
+Returns: String, or None if the file is empty
+'''
+def read_last_line(path, block_size=4096):
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        position=f.tell()
+        tail=b''
+        while position > 0:
+            step=min(block_size, position)
+            position-=step
+            f.seek(position)
+            tail=f.read(step)+tail
+            lines=tail.rstrip(b'\r\n').split(b'\n')
+            if len(lines) > 1 or position==0:
+                line=lines[-1].strip()
+                return line.decode('utf-8') if line else None
+    return None
+
+
+'''
+Function Name: parse_date_time(value)
+Purpose: Parse a "Date Time" value as stored in the ticker csv files. Files written by this module store
+         epoch seconds (date_format='%s'), older files may hold a date string.
+Arguments: value: String, the raw "Date Time" value
+Returns: pandas Timestamp (timezone naive)
+'''
+def parse_date_time(value):
+    value=value.strip()
+    if value.isdigit():
+        return pd.Timestamp(int(value), unit='s')
+    return pd.Timestamp(value).tz_localize(None)
+
+
+'''
+Function Name: written_timestamps(date_times)
+Purpose: Return the timestamps a "Date Time" column will have once written with date_format='%s' and read back
+         with parse_date_time(), so new rows can be compared with the rows already in a file.
+Arguments: date_times: pandas Series of datetimes
+Returns: pandas Series of timezone naive Timestamps
+'''
+def written_timestamps(date_times):
+    return pd.to_datetime(date_times.dt.strftime('%s').astype('int64'), unit='s')
+
+
+'''
+Function Name: get_last_timestamp(path)
+Purpose: Return the timestamp of the last row of a ticker csv file, using read_last_line()
+Arguments: path: String, the path of the ticker csv file
+Returns: pandas Timestamp, or None if the file has no data rows
+'''
+def get_last_timestamp(path):
+    line=read_last_line(path)
+    if line is None or line.startswith("Date Time"):
+        return None
+    return parse_date_time(line.split(',', 1)[0])
+
+
+'''
+Class Name: TokenBucket(rate, burst)
+Purpose: A thread safe token bucket used to rate limit requests to the data provider across all
+         download threads. Replaces the fixed time.sleep(delay) between tickers.
+Arguments: rate: float, the number of requests allowed per second on average
+           burst: int, the number of requests that may be made back to back before the rate applies
+'''
+class TokenBucket(object):
+    def __init__(self, rate, burst=1):
+        self.rate=float(rate)
+        self.capacity=float(max(burst, 1))
+        self.tokens=self.capacity
+        self.last=time.monotonic()
+        self.lock=threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now=time.monotonic()
+                self.tokens=min(self.capacity, self.tokens+(now-self.last)*self.rate)
+                self.last=now
+                if self.tokens >= 1:
+                    self.tokens-=1
+                    return
+                wait=(1-self.tokens)/self.rate
+            time.sleep(wait)
+
+
+class NoDataError(Exception):
+    #Raised when the provider answers but returns no rows, retrying will not help
+    pass
+
+
+'''
+Function Name: download_tickers(tickers, fetch, save, workers, rate, burst, retries, backoff)
+Purpose: Download the history for a list of tickers using a pool of worker threads. Every request
+         (including retries) takes a token from a shared TokenBucket, failed requests are retried
+         with exponential backoff.
+Arguments: tickers: list of ticker symbol strings
+           fetch: function(ticker) returning a yfinance style DataFrame
+           save: function(ticker, df) called from the worker thread as soon as a ticker is downloaded,
+                 if None the DataFrames are kept and returned instead
+           workers: int, the number of concurrent downloads
+           rate: float, requests per second allowed across all workers, None for no limit
+           burst: int, the number of requests that may be made back to back
+           retries: int, the number of times a failed request is retried
+           backoff: float, seconds to wait before the first retry, doubled on every retry
+Returns: dict ticker -> DataFrame (empty when save is given),
+         pandas DataFrame summary with one row per ticker: Ticker, Status, Attempts, Rows, Seconds, Error
+'''
+def download_tickers(tickers, fetch, save=None, workers=8, rate=2.0, burst=1, retries=3, backoff=1.0):
+    limiter=TokenBucket(rate, burst) if rate else None
+    data={}
+
+    def work(ticker):
+        started=time.monotonic()
+        attempts=0
+        while True:
+            attempts+=1
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                df=fetch(ticker)
+                if df is None or df.empty:
+                    raise NoDataError("No data returned for {}".format(ticker))
+                break
+            except Exception as e:
+                if isinstance(e, NoDataError) or attempts > retries:
+                    return {'Ticker':ticker, 'Status':'error', 'Attempts':attempts, 'Rows':0,
+                            'Seconds':time.monotonic()-started, 'Error':repr(e)}
+                time.sleep(backoff*2**(attempts-1))
+        try:
+            if save is not None:
+                save(ticker, df)
+            else:
+                data[ticker]=df
+        except Exception as e:
+            return {'Ticker':ticker, 'Status':'error', 'Attempts':attempts, 'Rows':0,
+                    'Seconds':time.monotonic()-started, 'Error':repr(e)}
+        return {'Ticker':ticker, 'Status':'ok', 'Attempts':attempts, 'Rows':len(df),
+                'Seconds':time.monotonic()-started, 'Error':''}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        futures=[pool.submit(work, ticker) for ticker in tickers]
+        rows=[future.result() for future in as_completed(futures)]
+    summary=pd.DataFrame(rows, columns=['Ticker', 'Status', 'Attempts', 'Batch', 'Rows', 'Seconds', 'Error'])
+    if not summary.empty:
+        summary=summary.sort_values(by=['Ticker']).reset_index(drop=True)
+    return data, summary
+
+
+'''
+Function Name: split_batch_frame(wide, tickers)
+Purpose: Split the wide frame returned by a batched provider call (columns are a (ticker, field) MultiIndex,
+         the index is the union of every ticker's dates) back into one history DataFrame per ticker.
+         Rows a ticker has no data for are dropped.
+Arguments: wide: pandas DataFrame as returned by yf.download(tickers, group_by='ticker')
+           tickers: list of the ticker symbols that were requested
+Returns: dict ticker -> DataFrame, tickers without any data are left out
+'''
+def split_batch_frame(wide, tickers):
+    frames={}
+    if wide is None or wide.empty:
+        return frames
+    if not isinstance(wide.columns, pd.MultiIndex):
+        #Some yfinance versions return flat columns when only one symbol is requested
+        wide=pd.concat({tickers[0]:wide}, axis=1)
+    available=set(wide.columns.get_level_values(0))
+    for ticker in tickers:
+        if ticker not in available:
+            continue
+        df=wide[ticker].dropna(how='all')
+        if not df.empty:
+            frames[ticker]=df
+    return frames
+
+
+'''
+Function Name: download_tickers_batched(tickers, fetch_batch, save, batch_size, workers, rate, burst, retries, backoff)
+Purpose: Same as download_tickers(), but requests batch_size tickers per provider call and splits the
+         result back per ticker with split_batch_frame(). Rate limiting and retries apply per batch.
+Arguments: tickers: list of ticker symbol strings
+           fetch_batch: function(list of tickers) returning a wide (ticker, field) DataFrame
+           batch_size: int, the number of tickers requested per provider call
+           save, workers, rate, burst, retries, backoff: see download_tickers()
+Returns: dict ticker -> DataFrame (empty when save is given),
+         pandas DataFrame summary with one row per ticker: Ticker, Status, Attempts, Batch, Rows, Seconds, Error.
+         Attempts and Seconds are those of the ticker's batch, Batch is the first ticker of the batch, the row
+         instrumentation.Report counts the requests of the batch on.
+'''
+def download_tickers_batched(tickers, fetch_batch, save=None, batch_size=50, workers=2, rate=2.0, burst=1, retries=3, backoff=1.0):
+    tickers=list(tickers)
+    batches=[tuple(tickers[i:i+batch_size]) for i in range(0, len(tickers), batch_size)]
+    split={}
+
+    def save_batch(batch, wide):
+        split[batch]=split_batch_frame(wide, list(batch))
+
+    _, batch_summary=download_tickers(batches, lambda batch: fetch_batch(list(batch)), save=save_batch,
+                                      workers=workers, rate=rate, burst=burst, retries=retries, backoff=backoff)
+    data={}
+    rows=[]
+    for _, batch_row in batch_summary.iterrows():
+        batch=batch_row['Ticker']
+        frames=split.pop(batch, {})
+        for ticker in batch:
+            row={'Ticker':ticker, 'Status':'error', 'Attempts':batch_row['Attempts'], 'Batch':batch[0], 'Rows':0,
+                 'Seconds':batch_row['Seconds'], 'Error':batch_row['Error']}
+            if ticker in frames:
+                df=frames.pop(ticker)
+                try:
+                    if save is not None:
+                        save(ticker, df)
+                    else:
+                        data[ticker]=df
+                    row.update({'Status':'ok', 'Rows':len(df), 'Error':''})
+                except Exception as e:
+                    row['Error']=repr(e)
+            elif batch_row['Status']=='ok':
+                row['Error']=repr(NoDataError("No data returned for {}".format(ticker)))
+            rows.append(row)
+    summary=pd.DataFrame(rows, columns=['Ticker', 'Status', 'Attempts', 'Batch', 'Rows', 'Seconds', 'Error'])
+    if not summary.empty:
+        summary=summary.sort_values(by=['Ticker']).reset_index(drop=True)
+    return data, summary
+
+
+'''
+Function Name: _fetch_histories(tickers, provider, history_args, save, delay, workers, batch_size, retries)
+Purpose: Download the history for a list of tickers from a provider, batched when a batch size is given and the
+         provider supports multi symbol requests, one request per ticker otherwise.
+Returns: pandas DataFrame, the per ticker download summary
+'''
+def _fetch_histories(tickers, provider, history_args, save, delay, workers, batch_size, retries):
+    rate=1.0/delay if delay else None
+    if batch_size and hasattr(provider, 'download'):
+        _, summary=download_tickers_batched(tickers, lambda batch: provider.download(batch, **history_args), save=save,
+                                            batch_size=batch_size, workers=workers, rate=rate, retries=retries)
+    else:
+        _, summary=download_tickers(tickers, lambda ticker: provider.history(ticker, **history_args), save=save,
+                                    workers=workers, rate=rate, retries=retries)
+    failed=summary[summary['Status']!='ok']
+    for _, row in failed.iterrows():
+        print("Failed to get {}: {}".format(row['Ticker'], row['Error']))
+    return summary
+
+
+'''
+Function Name: format_history(df)
+Purpose: Convert a yfinance style history DataFrame into the per ticker csv layout
+         (Date Time, Open, High, Low, Close, Volume, Adj Close)
+Arguments: df: pandas DataFrame as returned by yf.Ticker().history()
+Returns: pandas DataFrame
+'''
+def format_history(df):
+    df=df.copy()
+    df['Adj Close'] = df['Close']
+    df.index.name ="Date Time"
+    df.reset_index(inplace=True)
+    df["Date Time"]=pd.to_datetime(df["Date Time"])
+    df.drop(columns=['Dividends','Stock Splits'], inplace=True, errors='ignore')
+    return df
+
+
+'''
+Function Name: _download_to_directory(data_directory,ticker_sub_directory,fileName,refresh,purge,delay,history_args,workers,provider,retries,batch_size,tickers)
+Purpose: Shared implementation of get_data_from_yahoo and get_data_from_yahoo_specific. Works out which tickers
+         need downloading, downloads them concurrently and writes one csv per ticker.
+Returns: pandas DataFrame, the per ticker download summary from download_tickers()
+'''
+def _download_to_directory(data_directory,ticker_sub_directory,fileName,refresh,purge,delay,history_args,workers,provider,retries,batch_size,tickers):
+    if tickers is None:
+        if not os.path.exists(data_directory+fileName):
+            print(data_directory+fileName+" Not Found! Check Path and File Name! Exiting!")
+            sys.exit()
+        tickers=pd.read_csv(data_directory + fileName, usecols=["Ticker"], index_col=None)["Ticker"]
+    if purge:
+        files=g.glob(data_directory+ticker_sub_directory+'/*')
+        print("Purging all files for a fresh clean start")
+        for f in files:
+            os.remove(f)
+    if not os.path.exists(data_directory+ticker_sub_directory):
+        os.makedirs(data_directory+ticker_sub_directory)
+    if provider is None:
+        provider=dataprovider.YahooProvider()
+    pending=[]
+    for ticker in tickers:
+        if not os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)):
+            print("Getting Ticker: {}".format(ticker))
+            pending.append(ticker)
+        elif refresh:
+            print("Refreshing data for {}".format(ticker))
+            pending.append(ticker)
+
+    def save(ticker, df):
+        #The old file is only replaced once the new data has arrived
+        format_history(df).to_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),date_format='%s', index=False)
+
+    summary=_fetch_histories(pending, provider, history_args, save, delay, workers, batch_size, retries)
+    print("Downloaded {} of {} tickers".format((summary['Status']=='ok').sum(), len(summary)))
+    return summary
+
 
 '''
-Function Name: get_data_from_yahoo(data_directory,ticker_sub_directory,fileName,period,refresh,purge)
+Function Name: get_data_from_yahoo(data_directory,ticker_sub_directory,fileName,period,refresh,purge,delay,workers,provider,retries,batch_size,tickers)
 Purpose:  This function will take as an input a csv file
           which it will open, take in all of the ticker names
           and download the information using the Yahoo Finance API.
@@ -145,49 +479,24 @@ Arguments:    data_directory: Data parent directory - this is where the csv file
                      leave old tickers that arent in the ticker list intact.
             purge:   Bool, if set to True, ALL data files in the directory will be deleted, and then the data will be downloaded. This
                      function serves to delete old data that is in the directory that is no longer in use. IE after a watch list has changed.
-            delay:   float - The delay time in seconds between ticker info downloads, 0.5 works well, not to anger the yahoo server
-'''
-def get_data_from_yahoo(data_directory,ticker_sub_directory,fileName,period,refresh,purge,delay):
-    if not os.path.exists(data_directory+fileName):
-        print(data_directory+fileName+" Not Found! Check Path and File Name! Exiting!")
-        sys.exit()
-    with open(data_directory + fileName,"rb") as f:
-        tickers=pd.read_csv(data_directory + fileName, usecols=["Ticker"], index_col=None)
-    if purge:
-        files=g.glob(data_directory+ticker_sub_directory+'/*')
-        print("Purging all files for a fresh clean start")
-        for f in files:
-            os.remove(f)
-    if not os.path.exists(data_directory+ticker_sub_directory):
-        os.makedirs(data_directory+ticker_sub_directory)
-    for ticker in tickers["Ticker"]:
-        if not os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)):
-            print("Getting Ticker: {}".format(ticker))
-            tick=yf.Ticker(ticker)
-            df=tick.history(period=period)
-            df['Adj Close'] = df['Close']
-            df.index.name ="Date Time"
-            df.reset_index(inplace=True)
-            df["Date Time"]=pd.to_datetime(df["Date Time"])
-            df.drop(columns=['Dividends','Stock Splits'],axis=1, inplace=True)
-            df.to_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),date_format='%s', index=False)
-            time.sleep(delay)
-            continue
-        if os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)) and refresh:
-            print("Refreshing data for {}".format(ticker))
-            os.remove(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker))
-            tick=yf.Ticker(ticker)
-            df=tick.history(period)
-            df['Adj Close'] = df['Close']
-            df.index.name ="Date Time"
-            df.reset_index(inplace=True)
-            df["Date Time"]=pd.to_datetime(df["Date Time"])
-            df.drop(columns=['Dividends','Stock Splits'],axis=1, inplace=True)
-            df.to_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),date_format='%s', index=False)
-            time.sleep(delay)
-
-'''
-Function Name: get_data_from_yahoo_specific(data_directory,ticker_sub_directory,fileName,start,end,interval, refresh, purge)
+            delay:   float - The average delay time in seconds between requests across all download threads, 0.5 works well,
+                     not to anger the yahoo server. 0 disables rate limiting.
+            workers: int - The number of tickers downloaded concurrently, 1 downloads one ticker at a time
+            provider: The data source, an object with a history() method, defaults to dataprovider.YahooProvider(),
+                      which serves a range that ended before today from the cache, and one reaching today when it
+                      is asked again within httpcache.DEFAULT_TTL, a refresh rerun included.
+            retries: int - The number of times a failed download is retried, with exponential backoff
+            batch_size: int - When set, tickers are requested batch_size at a time in one provider call (yf.download)
+                        instead of one request per ticker. None keeps one request per ticker.
+            tickers: list of ticker symbols to download instead of the ones of fileName, ex read from a pickle
+Returns: pandas DataFrame with the per ticker download summary (Ticker, Status, Attempts, Rows, Seconds, Error)
+'''
+def get_data_from_yahoo(data_directory,ticker_sub_directory,fileName,period,refresh,purge,delay,workers=1,provider=None,retries=3,batch_size=None,tickers=None):
+    return _download_to_directory(data_directory,ticker_sub_directory,fileName,refresh,purge,delay,
+                                  {'period':period},workers,provider,retries,batch_size,tickers)
+
+'''
+Function Name: get_data_from_yahoo_specific(data_directory,ticker_sub_directory,fileName,start,end,interval,refresh,purge,delay,workers,provider,retries,batch_size,tickers)
 Purpose:  This function will take as an input a csv file
           which it will open, take in all of the ticker names
           and download the information using the Yahoo Finance API.
@@ -203,56 +512,31 @@ Arguments:    data_directory: Data parent directory - this is where the csv file
             refresh:  Bool, if set to True, it will delete the file for each ticker, and re-download the data for the desired period. This will cause the old ticker data to remain.
             purge:    Bool, if set to True, ALL data files in the directory will be deleted, and then the data will be downloaded. This
                       function serves to delete old data that is in the directory that is no longer in use. IE after a watch list has changed.
-            delay:   float - The delay time in seconds between ticker info downloads, 0.5 works well, not to anger the yahoo server
-'''
-def get_data_from_yahoo_specific(data_directory,ticker_sub_directory,fileName,start,end,interval, refresh, purge, delay):
-    if not os.path.exists(data_directory+fileName):
-        print(data_directory+fileName+" Not Found! Check Path and File Name! Exiting!")
-        sys.exit()
-    with open(data_directory + fileName,"rb") as f:
-        tickers=pd.read_csv(data_directory + fileName, usecols=["Ticker"], index_col=None)
-    if purge:
-        files=g.glob(data_directory+ticker_sub_directory+'/*')
-        print("Purging all files for a fresh clean start")
-        for f in files:
-            os.remove(f)
-    if not os.path.exists(data_directory+ticker_sub_directory):
-        os.makedirs(data_directory+ticker_sub_directory)
-    for ticker in tickers["Ticker"]:
-        if not os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)):
-            print("Getting Ticker: {}".format(ticker))
-            tick=yf.Ticker(ticker)
-            df=tick.history(start=start,end=end,interval=interval)
-            df['Adj Close'] = df['Close']
-            df.index.name ="Date Time"
-            df.reset_index(inplace=True)
-            df["Date Time"]=pd.to_datetime(df["Date Time"])
-            df.drop(columns=['Dividends','Stock Splits'],axis=1, inplace=True)
-            df.to_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),date_format='%s', index=False)
-            time.sleep(delay)
-            continue
-        if os.path.exists(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker)) and refresh:
-            print("Refreshing data for {}".format(ticker))
-            os.remove(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker))
-            tick=yf.Ticker(ticker)
-            df=tick.history(start=start,end=end,interval=interval)
-            df['Adj Close'] = df['Close']
-            df.index.name ="Date Time"
-            df.reset_index(inplace=True)
-            df["Date Time"]=pd.to_datetime(df["Date Time"])
-            df.drop(columns=['Dividends','Stock Splits'],axis=1, inplace=True)
-            df.to_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker),date_format='%s', index=False)
-            time.sleep(delay)
+            delay:   float - The average delay time in seconds between requests across all download threads, 0.5 works well,
+                     not to anger the yahoo server. 0 disables rate limiting.
+            workers: int - The number of tickers downloaded concurrently, 1 downloads one ticker at a time
+            provider: The data source, an object with a history() method, defaults to dataprovider.YahooProvider(),
+                      which serves a range that ended before today from the cache, and one reaching today when it
+                      is asked again within httpcache.DEFAULT_TTL, a refresh rerun included.
+            retries: int - The number of times a failed download is retried, with exponential backoff
+            batch_size: int - When set, tickers are requested batch_size at a time in one provider call (yf.download)
+                        instead of one request per ticker. None keeps one request per ticker.
+            tickers: list of ticker symbols to download instead of the ones of fileName, ex read from a pickle
+Returns: pandas DataFrame with the per ticker download summary (Ticker, Status, Attempts, Rows, Seconds, Error)
+'''
+def get_data_from_yahoo_specific(data_directory,ticker_sub_directory,fileName,start,end,interval, refresh, purge, delay,workers=1,provider=None,retries=3,batch_size=None,tickers=None):
+    return _download_to_directory(data_directory,ticker_sub_directory,fileName,refresh,purge,delay,
+                                  {'start':start,'end':end,'interval':interval},workers,provider,retries,batch_size,tickers)
 
 '''
 Function Name: get_update_date_delta(data_directory,ticker_sub_directory,ticker)
 Purpose: This function takes a ticker name string as an input and will open
          the appropriate csv file, and will return the time in days since last
-         update as well as the date of the last update.
+         update as well as the date of the last update. Only the end of the file is read.
 Arguments: data_directory: Data parent directory - this is where the csv files should be stored
            ticker_sub_directory: String, data sub directory, this is where a csv for each of the tickers history will be stored
            ticker: String, the ticker symbol, ex Apple = 'AAPL'
-Returns: int days, pandas datetime last_date yyyy-mm-dd
+Returns: int days, pandas Timestamp last_date (None, None if the file has no data rows)
 '''
 
 def get_update_date_delta(data_directory,ticker_sub_directory,ticker):
@@ -260,11 +544,186 @@ def get_update_date_delta(data_directory,ticker_sub_directory,ticker):
             print("Ticker File Not Found, Run get_data_from_yahoo()")
     else:   
             today=datetime.now()
-            df=pd.read_csv(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker))
-            df["Date Time"]=pd.to_datetime(df["Date Time"])
-            last_date=df.tail(1)["Date Time"]
+            last_date=get_last_timestamp(data_directory+ticker_sub_directory+'/{}.csv'.format(ticker))
+            if last_date is None:
+                return None, None
             difference = today - last_date
-            return int(difference.astype('timedelta64[D]')), last_date
+            return difference.days, last_date
+
+
+'''
+Function Name: read_ticker_csv(path)
+Purpose: Read a ticker csv file into a DataFrame with the "Date Time" column parsed to timestamps. Handles both
+         the epoch seconds written by this module and date strings.
+Arguments: path: String, the path of the ticker csv file
+Returns: pandas DataFrame
+'''
+def read_ticker_csv(path):
+    df=pd.read_csv(path)
+    if pd.api.types.is_numeric_dtype(df["Date Time"]):
+        df["Date Time"]=pd.to_datetime(df["Date Time"], unit='s')
+    else:
+        df["Date Time"]=pd.to_datetime(df["Date Time"], utc=True).dt.tz_localize(None)
+    return df
+
+
+'''
+Function Name: convert_csv_directory_to_store(data_directory,ticker_sub_directory,store_directory,interval,workers)
+Purpose: Convert every ticker csv file in a directory into the columnar bar store (see barstore.py), so backtests
+         and screens can load memory-mapped arrays instead of parsing text. The csv files are left in place.
+Arguments: data_directory: Data parent directory - this is where the csv files should be stored
+           ticker_sub_directory: String, data sub directory holding one csv per ticker
+           store_directory: String, the root directory of the bar store
+           interval: String, the interval of the bars in the csv files, ex 1d. Each interval is stored separately.
+           workers: int, the number of files converted concurrently
+Returns: pandas DataFrame with one row per ticker: Ticker, Status, Rows, Error
+'''
+def convert_csv_directory_to_store(data_directory,ticker_sub_directory,store_directory,interval,workers=4):
+    files=sorted(g.glob(data_directory+ticker_sub_directory+'/*.csv'))
+
+    def convert(path):
+        ticker=os.path.splitext(os.path.basename(path))[0]
+        try:
+            df=read_ticker_csv(path).sort_values(by=["Date Time"], kind='stable')
+            rows=barstore.write_bars(store_directory, interval, ticker, df)
+            return {'Ticker':ticker, 'Status':'ok', 'Rows':rows, 'Error':''}
+        except Exception as e:
+            return {'Ticker':ticker, 'Status':'error', 'Rows':0, 'Error':repr(e)}
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as pool:
+        rows=list(pool.map(convert, files))
+    summary=pd.DataFrame(rows, columns=['Ticker', 'Status', 'Rows', 'Error'])
+    print("Converted {} of {} files to {}".format((summary['Status']=='ok').sum(), len(summary), store_directory))
+    return summary
+
+
+#Columns of the per ticker quality report written by compact_data_directory()
+QUALITY_COLUMNS=['Ticker', 'Status', 'Rows', 'Duplicates', 'Unsorted', 'Bad Prices', 'Gaps', 'Largest Gap Days',
+                 'First', 'Last', 'Rewritten', 'Usable', 'Error']
+
+
+'''
+Function Name: check_history(times, prices, interval)
+Purpose: Count the integrity problems of a ticker history
+Arguments: times: int64 numpy array of epoch seconds, sorted and without duplicates
+           prices: float numpy array (rows x Open/High/Low/Close) of the same rows
+           interval: String, the bar interval, a key of barstore.INTERVAL_SECONDS
+Returns: numpy bool array of the rows with a zero, negative or NaN price, number of gaps, largest gap in days
+'''
+def check_history(times, prices, interval='1d'):
+    bad=np.isnan(prices).any(axis=1) | (prices <= 0).any(axis=1)
+    spacing=barstore.INTERVAL_SECONDS.get(interval, 86400)
+    deltas=np.diff(times)
+    #Weekends and one day holidays are not gaps: a daily history can skip up to 3 calendar days
+    gaps=deltas > spacing+3*86400
+    if spacing < 86400:
+        days=times//86400
+        gaps|=(days[1:]==days[:-1]) & (deltas > spacing*1.5)
+    largest=float(deltas.max())/86400 if len(deltas) else 0.0
+    return bad, int(gaps.sum()), largest
+
+
+'''
+Function Name: compact_ticker_file(path, interval, drop_bad, min_rows)
+Purpose: Sort a ticker csv by date time, drop rows with a duplicated date time (the last one is kept, it is the most
+         recent download), optionally drop rows with zero, negative or NaN prices, and count the gaps left. The file
+         is only rewritten when rows changed, through a temporary file and os.replace() so a reader never sees it
+         half written. Values are written back as they were read, epoch seconds stay epoch seconds.
+Arguments: path: String, the ticker csv file
+           interval: String, the bar interval of the file, see barstore.INTERVAL_SECONDS
+           drop_bad: bool, remove the rows with a bad price
+           min_rows: int, histories shorter than this are reported as not usable
+Returns: dict, a row of the quality report (see QUALITY_COLUMNS)
+'''
+def compact_ticker_file(path, interval='1d', drop_bad=True, min_rows=30):
+    ticker=os.path.splitext(os.path.basename(path))[0]
+    row=dict.fromkeys(QUALITY_COLUMNS, 0)
+    row.update({'Ticker':ticker, 'First':'', 'Last':'', 'Rewritten':False, 'Usable':False, 'Error':''})
+    try:
+        raw=pd.read_csv(path)
+        if pd.api.types.is_numeric_dtype(raw["Date Time"]):
+            times=raw["Date Time"].to_numpy(dtype=np.int64)
+        else:
+            parsed=pd.to_datetime(raw["Date Time"], utc=True).dt.tz_localize(None)
+            times=parsed.to_numpy(dtype='datetime64[s]').astype(np.int64)
+        order=np.argsort(times, kind='stable')
+        row['Unsorted']=int((np.diff(times) < 0).sum())
+        times=times[order]
+        #Keep the last of each run of equal date times
+        keep=np.append(times[1:]!=times[:-1], True)
+        row['Duplicates']=int((~keep).sum())
+        order=order[keep]
+        times=times[keep]
+        prices=raw[['Open', 'High', 'Low', 'Close']].to_numpy(dtype=np.float64)[order]
+        bad, _, _=check_history(times, prices, interval)
+        row['Bad Prices']=int(bad.sum())
+        if drop_bad and bad.any():
+            order=order[~bad]
+            times=times[~bad]
+            prices=prices[~bad]
+        _, row['Gaps'], row['Largest Gap Days']=check_history(times, prices, interval)
+        row['Rows']=len(order)
+        if len(times):
+            row['First']=str(pd.Timestamp(int(times[0]), unit='s'))
+            row['Last']=str(pd.Timestamp(int(times[-1]), unit='s'))
+        if len(order)!=len(raw) or (np.diff(order) < 0).any():
+            raw.iloc[order].to_csv(path+'.tmp', index=False)
+            os.replace(path+'.tmp', path)
+            row['Rewritten']=True
+        row['Usable']=row['Rows'] >= min_rows and (drop_bad or row['Bad Prices']==0)
+        row['Status']='ok'
+    except Exception as e:
+        row['Status']='error'
+        row['Error']=repr(e)
+    return row
+
+
+'''
+Function Name: quality_report_path(data_directory,ticker_sub_directory)
+Purpose: Path of the quality report of a data sub directory, <data_directory><ticker_sub_directory>_quality.csv with
+         the trailing separator of ticker_sub_directory removed, so "SP500/" gives SP500_quality.csv next to the
+         sub directory and not _quality.csv inside it, where the *.csv globs of the ticker files would pick it up
+Returns: String
+'''
+def quality_report_path(data_directory,ticker_sub_directory):
+    return data_directory+ticker_sub_directory.rstrip('/\\')+'_quality.csv'
+
+
+'''
+Function Name: compact_data_directory(data_directory,ticker_sub_directory,interval,workers,drop_bad,min_rows)
+Purpose: Run compact_ticker_file() on every ticker csv of a directory, in parallel worker processes, and save the
+         quality report next to the sub directory, see quality_report_path()
+Arguments: data_directory: Data parent directory - this is where the csv files should be stored
+           ticker_sub_directory: String, data sub directory holding one csv per ticker
+           interval, drop_bad, min_rows: see compact_ticker_file()
+           workers: int, the number of worker processes, None for one per core
+Returns: pandas DataFrame, the quality report with one row per ticker
+'''
+def compact_data_directory(data_directory,ticker_sub_directory,interval='1d',workers=None,drop_bad=True,min_rows=30):
+    files=sorted(g.glob(data_directory+ticker_sub_directory+'/*.csv'))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows=list(pool.map(compact_ticker_file, files, [interval]*len(files), [drop_bad]*len(files),
+                           [min_rows]*len(files), chunksize=8))
+    report=pd.DataFrame(rows, columns=QUALITY_COLUMNS)
+    report.to_csv(quality_report_path(data_directory,ticker_sub_directory), index=False)
+    print("Compacted {} files, {} rewritten, {} not usable".format(len(report), int(report['Rewritten'].sum()),
+                                                                  int((~report['Usable'].astype(bool)).sum())))
+    return report
+
+
+'''
+Function Name: usable_tickers(data_directory,ticker_sub_directory,tickers)
+Purpose: Drop the tickers the last compact_data_directory() report marked as not usable. Tickers missing from the
+         report are kept. Without a report all the tickers are returned.
+Returns: list of ticker symbols, list of the tickers skipped
+'''
+def usable_tickers(data_directory,ticker_sub_directory,tickers):
+    path=quality_report_path(data_directory,ticker_sub_directory)
+    if not os.path.exists(path):
+        return list(tickers), []
+    report=pd.read_csv(path, usecols=['Ticker', 'Usable'])
+    bad=set(report.loc[~report['Usable'].astype(bool), 'Ticker'])
+    return [ticker for ticker in tickers if ticker not in bad], [ticker for ticker in tickers if ticker in bad]
 
 
 '''
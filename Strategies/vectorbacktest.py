@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+'''
+Vectorized NumPy evaluator for the MovingAverageStrategy (SMA 9) rules, for screening many
+ticker/parameter combinations without running the PyAlgoTrade event loop.
+
+The rules are the ones of smarules.SMARules, which MovingAverageStrategy.onBars runs. The
+signals are evaluated as arrays here, the entries sized with smarules.size_entry:
+  - flat and close > SMA: buy int(cash*BUDGET_USE // close) shares, with a stop at
+    close - risk_percent% of the budget used, spread over the shares
+  - long and (SMA > close or close <= stop): sell everything
+
+Fills reproduce the event driven version: an order decided on a bar's close fills at the open
+of the next bar, the broker processing each bar before onBars, and the Returns and SharpeRatio
+analyzers see the equity after that bar's fills. An order decided on the last bar never fills.
+Entries go through the broker's cash check (smarules.fill_cash): an entry the cash cannot pay for
+at the open, which happens when the open gaps above the close the entry was sized on, stays
+pending and fills at the first open it can pay for, unless an exit signal or the stop cancels it
+first. Volume limits are not modelled.
+'''
+
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import smarules
+
+
+'''
+Function Name: rolling_sma(close, period)
+Purpose: Simple moving average of the close prices, NaN for the first period-1 bars
+Returns: numpy array
+'''
+def rolling_sma(close, period):
+    sma=np.full(len(close), np.nan)
+    if len(close) >= period:
+        sma[period-1:]=sliding_window_view(close, period).mean(axis=1)
+    return sma
+
+
+'''
+Function Name: find_trades(open_, close, sma, initial_budget, budget_use, risk_percent, commission)
+Purpose: Walk the entry and exit signals trade by trade. Each step is a NumPy search over the signal
+         arrays, so the Python work is proportional to the number of trades, not the number of bars.
+Returns: entries (bar index of the fill), exits (bar index of the fill, -1 for a position still open at the end), shares,
+         final cash
+'''
+def find_trades(open_, close, sma, initial_budget, budget_use, risk_percent, commission):
+    valid=~np.isnan(sma)
+    entry_signals=np.flatnonzero(valid & (sma < close))
+    exit_signals=np.flatnonzero(valid & (sma > close))
+    entries, exits, shares_held=[], [], []
+    cash=float(initial_budget)
+    position=0
+    while True:
+        k=np.searchsorted(entry_signals, position)
+        if k==len(entry_signals):
+            break
+        i=int(entry_signals[k])
+        #Same failure as the event driven version when the budget cannot buy a single share
+        shares, stop_loss=smarules.size_entry(close[i], cash, budget_use, risk_percent)
+        #The exit is decided on the first SMA exit signal or stop after the entry decision, and fills at the next open
+        k=np.searchsorted(exit_signals, i+1)
+        sma_exit=int(exit_signals[k]) if k < len(exit_signals) else len(close)
+        stops=np.flatnonzero(close[i+1:sma_exit] <= stop_loss)
+        j=i+1+int(stops[0]) if len(stops) else sma_exit
+        position=j+1
+        #The entry fills at the first open up to the exit decision the cash can pay for, the exit cancels it otherwise
+        fills=np.flatnonzero(smarules.fill_cash(shares, open_[i+1:min(j, len(close)-1)+1], cash, commission) >= 0)
+        if len(fills)==0:
+            continue
+        entry=i+1+int(fills[0])
+        cash=smarules.fill_cash(shares, open_[entry], cash, commission)
+        entries.append(entry)
+        shares_held.append(shares)
+        if j+1 >= len(close):
+            exits.append(-1)
+            break
+        cash=smarules.fill_cash(-shares, open_[j+1], cash, commission)
+        exits.append(j+1)
+    return np.array(entries, dtype=np.int64), np.array(exits, dtype=np.int64), np.array(shares_held, dtype=np.int64), cash
+
+
+'''
+Function Name: run_sma_backtest(date_times, open_, close, nfast, initial_budget, budget_use, risk_percent, commission)
+Purpose: Evaluate the SMA strategy on one ticker's arrays and compute the metrics reported by multipleInstrumentTest.py
+Arguments: date_times: int64 epoch seconds of each bar
+           open_, close: float arrays of prices
+           nfast: int, the SMA period
+           initial_budget: float, starting cash
+           budget_use: float, fraction of the cash used per entry (setBudgetUse)
+           risk_percent: float, percent of the budget used that is risked to place the stop (setRiskPercent)
+           commission: float, fixed commission per order (backtesting.FixedPerTrade)
+Returns: dict with the backtestrunner.RESULT_COLUMNS metrics (without Ticker) and 'Trades', the array of trade P/L
+'''
+def run_sma_backtest(date_times, open_, close, nfast=9, initial_budget=1600, budget_use=0.5, risk_percent=2, commission=0.1):
+    open_=np.asarray(open_, dtype=np.float64)
+    close=np.asarray(close, dtype=np.float64)
+    date_times=np.asarray(date_times, dtype=np.int64)
+    sma=rolling_sma(close, nfast)
+    entries, exits, shares, _=find_trades(open_, close, sma, initial_budget, budget_use, risk_percent, commission)
+
+    #Cash and shares after the broker processed each bar
+    cash_change=np.zeros(len(close))
+    share_change=np.zeros(len(close))
+    np.add.at(cash_change, entries, smarules.fill_cash(shares, open_[entries], 0.0, commission))
+    np.add.at(share_change, entries, shares)
+    closed=exits >= 0
+    np.add.at(cash_change, exits[closed], smarules.fill_cash(-shares[closed], open_[exits[closed]], 0.0, commission))
+    np.add.at(share_change, exits[closed], -shares[closed])
+    cash=initial_budget+np.cumsum(cash_change)
+    held=np.cumsum(share_change)
+
+    #The analyzers value the portfolio after the current bar's fills
+    equity=cash+held*close
+    previous=np.concatenate(([float(initial_budget)], equity[:-1]))
+    returns=(equity-previous)/previous
+    trade_pnl=shares[closed]*(open_[exits[closed]]-open_[entries[closed]])-2*commission
+    #Drawdown from the highest equity seen so far, the initial budget included
+    peak=np.maximum.accumulate(np.concatenate(([float(initial_budget)], equity)))[1:]
+
+    return {'Initial Equity':initial_budget, 'Net P/L':trade_pnl.sum(),
+            'Annualized Sharpe':sharpe_ratio(returns, date_times),
+            'Trades Made':len(trade_pnl),
+            'Avg P/L':trade_pnl.mean() if len(trade_pnl) else float('nan'),
+            'Max Profit':trade_pnl.max() if len(trade_pnl) else float('nan'),
+            'Max Loss':trade_pnl.min() if len(trade_pnl) else float('nan'),
+            'Annual Ret':(equity[-1]/initial_budget-1)*100 if len(equity) else 0.0,
+            'Final Equity':cash[-1]+held[-1]*close[-1] if len(close) else initial_budget,
+            'Max Drawdown':(1-equity/peak).max()*100 if len(equity) else 0.0,
+            'Trades':trade_pnl}
+
+
+'''
+Function Name: sharpe_ratio(returns, date_times)
+Purpose: Annualized Sharpe ratio with a zero risk free rate, computed like pyalgotrade's SharpeRatio analyzer
+         with daily returns: bar returns are compounded per calendar day, then mean/stddev*sqrt(252)
+Returns: float, 0 when the volatility is 0
+'''
+def sharpe_ratio(returns, date_times):
+    if len(returns)==0:
+        return 0.0
+    days=date_times//86400
+    starts=np.flatnonzero(np.concatenate(([True], days[1:]!=days[:-1])))
+    daily=np.multiply.reduceat(1+returns, starts)-1
+    volatility=daily.std(ddof=1) if len(daily) > 1 else float('nan')
+    if volatility==0:
+        return 0.0
+    return daily.mean()/volatility*math.sqrt(252)